@@ -0,0 +1,497 @@
+# admin_handlers.py
+import html
+import logging
+import time
+
+from aiogram import Dispatcher
+from aiogram.filters import Command
+from aiogram.types import BufferedInputFile, Message
+
+from broadcast import (
+    format_progress,
+    pause_broadcast,
+    running_broadcast_id,
+    start_broadcast,
+)
+from bulk_grants import apply_grant_csv, notifier_running, resume_grant_notifiers
+from config import ADMIN_IDS
+from database import db
+from inflight import FAILED, FINISHING, NOT_FOUND, force_recheck, force_refund, format_tasks, inflight
+from loop_monitor import loop_monitor
+from prescreen import ACTIONS, describe_screen, normalize, reload_screen, screen
+from memdebug import memory_inspector
+from profiler import ProfilerBusy, profiler
+from stats import format_stats, stats
+from tracing import tracer, format_timeline
+from utils import safe_answer, safe_send_document
+
+logger = logging.getLogger(__name__)
+
+
+#  РАССЫЛКА
+
+BROADCAST_USAGE = (
+    "⚙️ Рассылка:\n"
+    "<code>/broadcast</code> ответом на сообщение — черновик (сообщение будет скопировано всем)\n"
+    "<code>/broadcast start id</code> — запустить / продолжить\n"
+    "<code>/broadcast pause</code> — приостановить текущую\n"
+    "<code>/broadcast cancel id</code> — отменить\n"
+    "<code>/broadcast list</code> — последние рассылки"
+)
+
+
+async def cmd_broadcast(message: Message):
+    """/broadcast — рассылка всем пользователям (только для админов)."""
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = message.text.split()
+    action = parts[1] if len(parts) > 1 else ""
+
+    if not action and message.reply_to_message is not None:
+        source = message.reply_to_message
+        draft = await db.create_broadcast(message.from_user.id, source.chat.id, source.message_id)
+        recipients = await db.count_broadcast_recipients()
+        await safe_answer(
+            message,
+            f"📝 Черновик рассылки #{draft['id']}: получателей {recipients}.\n"
+            f"Запуск: <code>/broadcast start {draft['id']}</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    if action == "start" and len(parts) == 3 and parts[2].isdigit():
+        broadcast = await db.get_broadcast(int(parts[2]))
+        if broadcast is None:
+            await safe_answer(message, "⚠️ Рассылка не найдена.")
+            return
+        if broadcast["status"] in ("done", "cancelled"):
+            await safe_answer(message, f"⚠️ Рассылка #{broadcast['id']} уже {broadcast['status']}.")
+            return
+        running = running_broadcast_id()
+        if running is not None:
+            await safe_answer(message, f"⚠️ Уже идёт рассылка #{running}, сначала /broadcast pause.")
+            return
+        broadcast["status"] = "running"
+        try:
+            progress = await message.bot.send_message(message.chat.id, format_progress(broadcast))
+            broadcast["progress_chat_id"] = progress.chat.id
+            broadcast["progress_message_id"] = progress.message_id
+        except Exception as e:
+            logger.info(f"cmd_broadcast: progress message failed: {e}")
+        await db.set_broadcast_status(
+            broadcast["id"], "running", broadcast.get("progress_chat_id"), broadcast.get("progress_message_id")
+        )
+        start_broadcast(message.bot, broadcast)
+        return
+
+    if action == "pause":
+        paused = await pause_broadcast()
+        await safe_answer(
+            message,
+            f"⏸ Рассылка #{paused} на паузе." if paused else "⚠️ Сейчас ничего не рассылается.",
+        )
+        return
+
+    if action == "cancel" and len(parts) == 3 and parts[2].isdigit():
+        broadcast_id = int(parts[2])
+        if running_broadcast_id() == broadcast_id:
+            await pause_broadcast()
+        await db.set_broadcast_status(broadcast_id, "cancelled")
+        await safe_answer(message, f"🛑 Рассылка #{broadcast_id} отменена.")
+        return
+
+    if action == "list":
+        broadcasts = await db.get_broadcasts(limit=10)
+        text = "\n\n".join(format_progress(b) for b in broadcasts) or "Рассылок ещё не было."
+        await safe_answer(message, text)
+        return
+
+    await safe_answer(message, BROADCAST_USAGE, parse_mode="HTML")
+
+
+#  МАССОВОЕ НАЧИСЛЕНИЕ
+
+# Больше Bot API всё равно не даст скачать
+GRANT_CSV_MAX_BYTES = 20 * 1024 * 1024
+
+
+async def cmd_grant_csv(message: Message):
+    """
+    CSV-файл с подписью «/grant_csv причина» — начислить токены списку
+    пользователей (строки user_id,amount) и разослать уведомления.
+    /grant_csv — состояние последних пакетов; /grant_csv resume —
+    продолжить прерванные рассылки. Только для админов.
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = (message.text or message.caption or "").split(maxsplit=1)
+    argument = parts[1].strip() if len(parts) > 1 else ""
+
+    if message.document is None:
+        if argument == "resume":
+            count = await resume_grant_notifiers(message.bot)
+            await safe_answer(message, f"▶️ Возобновлено рассылок: {count}.")
+            return
+        await _send_grant_status(message)
+        return
+
+    document = message.document
+    if document.file_size and document.file_size > GRANT_CSV_MAX_BYTES:
+        await safe_answer(message, "❌ Файл больше 20 МБ — разбейте его на части.")
+        return
+
+    await safe_answer(message, "⏳ Загружаю и начисляю…")
+    try:
+        data = await message.bot.download(document)
+        batch, reader = await apply_grant_csv(
+            message.bot, message.from_user.id, document.file_unique_id, argument, data
+        )
+    except Exception:
+        logger.exception(f"cmd_grant_csv: failed for file {document.file_unique_id}")
+        await safe_answer(message, "⚠️ Не удалось применить файл, токены не начислены. Подробности в логах.")
+        return
+
+    this_call = batch["this_call"]
+    lines = [
+        f"пакет {batch['batch_id']}",
+        f"строк в файле: {reader.rows} (ошибок: {reader.error_count})",
+        f"пользователей: {this_call['users']}, начислено сейчас: {this_call['applied']} "
+        f"({this_call['tokens']} токенов)",
+        f"нет в базе или уже начислено ранее: {this_call['users'] - this_call['applied']}",
+        f"всего по пакету: {batch['granted']} пользователей, {batch['tokens']} токенов",
+    ]
+    for line_no, reason in reader.errors:
+        lines.append(f"  строка {line_no}: {reason}")
+    lines.append("уведомления рассылаются в фоне, /grant_csv — прогресс")
+    await safe_answer(
+        message,
+        f"<pre>{html.escape(chr(10).join(lines))}</pre>",
+        parse_mode="HTML",
+    )
+
+
+async def _send_grant_status(message: Message) -> None:
+    batches = await db.get_grant_batches(limit=5)
+    if not batches:
+        await safe_answer(
+            message,
+            "⚙️ Пришлите CSV (user_id,amount) с подписью <code>/grant_csv причина</code>.",
+            parse_mode="HTML",
+        )
+        return
+    lines = []
+    for b in batches:
+        if b["notified_at"]:
+            state = "разослано"
+        elif notifier_running(b["batch_id"]):
+            state = f"рассылка, осталось {b['pending']}"
+        else:
+            state = f"рассылка остановлена, осталось {b['pending']}"
+        lines.append(
+            f"{b['created_at']:%d.%m %H:%M} {b['batch_id']} — {b['granted']}/{b['users_total']} польз., "
+            f"{b['tokens']} ток.; {state}" + (f" ({b['reason']})" if b["reason"] else "")
+        )
+    await safe_answer(
+        message,
+        f"<pre>{html.escape(chr(10).join(lines))}</pre>",
+        parse_mode="HTML",
+    )
+
+
+#  СТАТИСТИКА
+
+async def cmd_stats(message: Message):
+    """
+    /stats — генерации, возвраты, выручка и среднее время KIE
+    за 24 часа / 7 / 30 дней из почасовых агрегатов (только для админов).
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    started = time.perf_counter()
+    try:
+        data = await stats.summary()
+    except Exception:
+        logger.exception("cmd_stats: summary failed")
+        await safe_answer(message, "⚠️ Не удалось получить статистику.")
+        return
+    took_ms = (time.perf_counter() - started) * 1000
+
+    await safe_answer(
+        message,
+        f"<pre>{html.escape(format_stats(data))}</pre>\n<i>{took_ms:.0f} ms</i>",
+        parse_mode="HTML",
+    )
+
+
+#  ДИАГНОСТИКА ГЕНЕРАЦИЙ
+
+async def cmd_trace(message: Message):
+    """
+    /trace task_id — таймлайн генерации: подтверждение, createTask,
+    опросы KIE и доставка видео (только для админов).
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = message.text.split()
+    if len(parts) != 2:
+        await safe_answer(
+            message,
+            "⚙️ Использование: <code>/trace task_id</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    task_id = parts[1]
+    spans = await tracer.find(task_id)
+    if not spans:
+        await safe_answer(message, f"⚠️ Трасса для задачи {task_id} не найдена.")
+        return
+
+    await safe_answer(
+        message,
+        f"<b>{html.escape(task_id)}</b>\n<pre>{html.escape(format_timeline(spans))}</pre>",
+        parse_mode="HTML",
+    )
+
+
+async def cmd_tasks(message: Message):
+    """
+    /tasks — генерации, которые сейчас ждут KIE: по движкам и моделям,
+    возраст, число опросов, последний статус (только для админов).
+    /tasks refund task_id — вернуть токены, не дожидаясь KIE.
+    /tasks recheck task_id — опросить KIE немедленно.
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = message.text.split()
+    if len(parts) == 1:
+        await safe_answer(
+            message,
+            f"<pre>{html.escape(format_tasks(inflight))}</pre>",
+            parse_mode="HTML",
+        )
+        return
+
+    if len(parts) != 3 or parts[1] not in ("refund", "recheck"):
+        await safe_answer(
+            message,
+            "⚙️ Использование: <code>/tasks</code>, <code>/tasks refund task_id</code>, "
+            "<code>/tasks recheck task_id</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    action, task_id = parts[1], parts[2]
+    if action == "refund":
+        result = await force_refund(message.bot, task_id)
+    else:
+        result = force_recheck(task_id)
+
+    if result == NOT_FOUND:
+        await safe_answer(message, f"⚠️ Задача {task_id} не в работе.")
+    elif result == FINISHING:
+        await safe_answer(message, f"⏳ Задача {task_id} уже завершается (доставка или возврат).")
+    elif result == FAILED:
+        await safe_answer(message, f"❌ Не удалось вернуть токены за {task_id}, опрос продолжается. Попробуйте ещё раз.")
+    elif action == "refund":
+        await safe_answer(message, f"✅ Токены за {task_id} возвращены, опрос остановлен.")
+    else:
+        await safe_answer(message, f"✅ Задача {task_id} будет опрошена сейчас.")
+
+
+#  ПРЕДПРОВЕРКА ПРОМПТОВ
+
+async def cmd_prescreen(message: Message):
+    """
+    /prescreen — термины предпроверки промптов (только для админов).
+    /prescreen reload — перечитать PROMPT_TERMS_FILE и таблицу терминов.
+    /prescreen reject|warn|allow термин — добавить, изменить или отключить термин.
+    /prescreen test текст — что скажет проверка.
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = message.text.split(maxsplit=2)
+    action = parts[1] if len(parts) > 1 else ""
+
+    if action == "test" and len(parts) == 3:
+        started = time.perf_counter()
+        verdict = screen().check(parts[2])
+        took_us = (time.perf_counter() - started) * 1e6
+        terms = ", ".join(verdict.terms) or "—"
+        await safe_answer(message, f"{verdict.action}: {terms} ({took_us:.0f} µs)")
+        return
+
+    if action in ACTIONS and len(parts) == 3:
+        await db.set_prescreen_term(normalize(parts[2]), action, "admin")
+    elif action not in ("", "reload"):
+        await safe_answer(
+            message,
+            "⚙️ Использование: <code>/prescreen</code>, <code>/prescreen reload</code>, "
+            "<code>/prescreen reject|warn|allow термин</code>, <code>/prescreen test текст</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    if action:
+        try:
+            await reload_screen()
+        except Exception as e:
+            logger.exception("reload_screen failed")
+            await safe_answer(message, f"❌ Список не перечитан, действует прежний.\n{e}")
+            return
+
+    await safe_answer(message, "\n".join(describe_screen(screen())))
+
+
+#  EVENT LOOP
+
+async def cmd_loop(message: Message):
+    """
+    /loop — задержка event loop и кто его блокирует (только для админов).
+    /loop reset — обнулить статистику.
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = message.text.split()
+    if len(parts) > 1 and parts[1] == "reset":
+        loop_monitor.reset()
+        await safe_answer(message, "✅ Статистика event loop сброшена.")
+        return
+
+    lag = loop_monitor.lag_summary()
+    lines = [
+        f"lag ({lag['samples']} замеров): p50 {lag['p50'] * 1000:.1f} ms, "
+        f"p99 {lag['p99'] * 1000:.1f} ms, max {lag['max'] * 1000:.1f} ms",
+        "",
+        f"медленные колбэки (≥ {loop_monitor.slow_threshold * 1000:.0f} ms):",
+    ]
+    offenders = loop_monitor.top_offenders()
+    if not offenders:
+        lines.append("нет")
+    for source, count, total, worst in offenders:
+        lines.append(f"{total * 1000:8.0f} ms  ×{count:<5} max {worst * 1000:6.0f} ms  {source}")
+
+    await safe_answer(
+        message,
+        f"<pre>{html.escape(chr(10).join(lines))}</pre>",
+        parse_mode="HTML",
+    )
+
+
+#  ПРОФИЛИРОВАНИЕ
+
+async def cmd_profile(message: Message):
+    """
+    /profile [секунды] [notasks] — снять CPU-профиль работающего бота и
+    прислать collapsed stacks файлом (только для админов).
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = message.text.split()
+    seconds = 30
+    if len(parts) > 1:
+        try:
+            seconds = int(parts[1])
+        except ValueError:
+            await safe_answer(
+                message,
+                "⚙️ Использование: <code>/profile [секунды] [notasks]</code>",
+                parse_mode="HTML",
+            )
+            return
+    seconds = max(1, min(seconds, profiler.max_seconds))
+    include_tasks = "notasks" not in parts[2:]
+
+    if profiler.running:
+        await safe_answer(message, "⚠️ Профиль уже снимается, дождитесь результата.")
+        return
+
+    await safe_answer(message, f"⏱ Снимаю профиль {seconds} с…")
+    try:
+        result = await profiler.run(seconds, include_tasks=include_tasks)
+    except ProfilerBusy:
+        await safe_answer(message, "⚠️ Профиль уже снимается, дождитесь результата.")
+        return
+
+    if not result.samples:
+        await safe_answer(message, "⚠️ Не удалось снять ни одного замера.")
+        return
+
+    top = "\n".join(
+        f"{share * 100:5.1f}%  {name}" for name, share in result.top_functions(5)
+    )
+    caption = (
+        f"{result.samples} замеров за {result.duration:.1f} с "
+        f"(задачи: {result.task_samples})\n{top}"
+    )[:1000]
+    filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+    await safe_send_document(
+        message.bot,
+        message.chat.id,
+        BufferedInputFile(result.collapsed().encode("utf-8"), filename=filename),
+        caption=caption,
+    )
+
+
+#  ПАМЯТЬ
+
+async def cmd_mem(message: Message):
+    """
+    /mem — снимок памяти: топ мест выделения, рост с прошлого /mem,
+    живые объекты по типам (только для админов).
+    /mem stop — выключить tracemalloc.
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    parts = message.text.split()
+    if len(parts) > 1 and parts[1] == "stop":
+        memory_inspector.stop()
+        await safe_answer(message, "✅ tracemalloc выключен, снимки удалены.")
+        return
+
+    started = memory_inspector.start()
+    report = memory_inspector.report()
+    if len(report) > 3800:
+        report = report[:3800] + "\n…"
+    header = (
+        "tracemalloc включён: учитываются выделения с этого момента, "
+        "следующий /mem покажет рост.\n\n"
+        if started else ""
+    )
+    await safe_answer(
+        message,
+        f"{header}<pre>{html.escape(report)}</pre>",
+        parse_mode="HTML",
+    )
+
+
+# РЕГИСТРАЦИЯ
+
+def register_admin_handlers(dp: Dispatcher) -> None:
+    dp.message.register(cmd_broadcast, Command("broadcast"))
+    dp.message.register(cmd_grant_csv, Command("grant_csv"))
+    dp.message.register(cmd_stats, Command("stats"))
+    dp.message.register(cmd_trace, Command("trace"))
+    dp.message.register(cmd_tasks, Command("tasks"))
+    dp.message.register(cmd_prescreen, Command("prescreen"))
+    dp.message.register(cmd_loop, Command("loop"))
+    dp.message.register(cmd_profile, Command("profile"))
+    dp.message.register(cmd_mem, Command("mem"))
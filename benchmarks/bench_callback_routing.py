@@ -0,0 +1,105 @@
+# benchmarks/bench_callback_routing.py
+"""
+Микробенчмарк: стоимость выбора хендлера для одного callback_query.
+
+Сравнивает:
+- linear — как было: перебор фильтров F.data == ... / F.data.startswith(...)
+  в порядке регистрации, пока один не сработает;
+- router — CallbackRouter.resolve(): поиск по словарю.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_callback_routing.py [--iterations 200000]
+"""
+import argparse
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py требует переменные окружения — для бенчмарка хватит заглушек
+os.environ.setdefault("TOKEN", "0:bench")
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+os.environ.setdefault("KIE_API_KEY", "bench")
+
+from aiogram import Dispatcher, F  # noqa: E402
+
+from payments import register_payment_handlers  # noqa: E402
+from routing import get_callback_router  # noqa: E402
+from sora_handlers import register_sora_handlers  # noqa: E402
+from subscription import register_common_handlers  # noqa: E402
+from veo_handlers import register_veo_handlers  # noqa: E402
+
+
+# Типичная смесь нажатий: от главного меню до подтверждения
+SAMPLE = [
+    "menu_create", "engine_sora", "ptype_t2v", "tier_sora2pro", "qual_high",
+    "quality_next", "duration_15", "orientation_9_16", "continue_video",
+    "confirm_video", "engine_veo", "veo_mode_t2v", "veo_q_fast", "veo_ar_169",
+    "confirm_veo", "menu_topup", "pay_stars", "stars_60", "stars_back",
+    "pay_rub", "rubles_100", "menu_balance", "back_to_main",
+]
+
+
+def build_router():
+    dp = Dispatcher()
+    register_common_handlers(dp)
+    register_sora_handlers(dp)
+    register_veo_handlers(dp)
+    register_payment_handlers(dp)
+    return get_callback_router(dp)
+
+
+def build_linear(router):
+    """
+    Восстанавливаем прежнюю схему: один magic-фильтр на маршрут,
+    в порядке регистрации (точные маршруты, затем префиксы).
+    """
+    filters = []
+    for key, name in router.routes():
+        if key.endswith("*"):
+            filters.append((F.data.startswith(key[:-1]), name))
+        else:
+            filters.append((F.data == key, name))
+    return filters
+
+
+def linear_resolve(filters, callback):
+    for flt, name in filters:
+        if flt.resolve(callback):
+            return name
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+
+    router = build_router()
+    filters = build_linear(router)
+    callbacks = [SimpleNamespace(data=d) for d in SAMPLE]
+    n = args.iterations
+
+    def run_linear():
+        for cb in callbacks:
+            linear_resolve(filters, cb)
+
+    def run_router():
+        for cb in callbacks:
+            router.resolve(cb.data, None)
+
+    loops = max(1, n // len(callbacks))
+    t_linear = min(timeit.repeat(run_linear, number=loops, repeat=5))
+    t_router = min(timeit.repeat(run_router, number=loops, repeat=5))
+    per = loops * len(callbacks)
+
+    print(f"routes: {len(filters)}, callbacks/run: {per}")
+    print(f"linear filters: {t_linear / per * 1e9:8.0f} ns/callback")
+    print(f"dict router:    {t_router / per * 1e9:8.0f} ns/callback")
+    print(f"speedup:        {t_linear / t_router:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
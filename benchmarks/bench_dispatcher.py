@@ -0,0 +1,418 @@
+# benchmarks/bench_dispatcher.py
+"""
+Нагрузочный бенчмарк: сколько апдейтов в секунду выдерживает бот,
+прежде чем растёт задержка.
+
+Через настоящий Dispatcher (main.build_dispatcher — те же middleware
+и хендлеры, что в проде) прогоняются сгенерированные Update: /start,
+меню, полные FSM-сценарии Sora и Veo, загрузка фото, подтверждения,
+оплата Stars. Вместо внешних сервисов:
+- Bot API — FakeTelegramSession (без сети, с настоящим разбором ответов);
+- KIE — FakeKieServer на localhost;
+- БД — локальный Postgres (отдельная база! пользователи бенчмарка
+  создаются с id от 9_000_000_000).
+
+Нагрузка открытая: апдейты приходят с заданной частотой независимо от того,
+успевает ли бот; апдейты одного пользователя обрабатываются по очереди,
+как при polling. Частота растёт ступенями, пока p99 не превысит --max-p99
+или бот не перестанет успевать.
+
+Запуск из корня репозитория:
+    DATABASE_URL=postgresql://postgres@localhost/sora_bench \\
+        python benchmarks/bench_dispatcher.py --rates 50,100,200,400 --duration 10
+
+    --json out.json — результат для сравнения между версиями;
+    --real-limits   — оставить лимиты Telegram из конфига (по умолчанию сняты,
+                      чтобы мерить сам бот, а не token bucket).
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ID пользователей бенчмарка — заведомо не пересекаются с настоящими
+USER_BASE = 9_000_000_000
+
+
+#  СЦЕНАРИИ
+
+# Шаг сценария: (метка для отчёта, фабрика Update по uid)
+Step = Tuple[str, Callable[[Any, int], Any]]
+
+STARS_PACK = {"kind": "stars_pack", "pack": "60", "stars": 60, "tokens": 100}
+
+
+def _cb(data: str) -> Step:
+    return f"cb:{data}", lambda f, uid: f.callback(uid, data)
+
+
+def _text(label: str, text: str) -> Step:
+    return f"msg:{label}", lambda f, uid: f.text(uid, text)
+
+
+def _photo() -> Step:
+    return "msg:photo", lambda f, uid: f.photo(uid)
+
+
+def _pre_checkout() -> Step:
+    return "pre_checkout", lambda f, uid: f.pre_checkout(uid, 60, {**STARS_PACK, "uid": uid})
+
+
+def _stars_paid() -> Step:
+    return "msg:successful_payment", lambda f, uid: f.stars_paid(uid, 60, {**STARS_PACK, "uid": uid})
+
+
+PROMPT = "Кот в скафандре идёт по Луне, кинематографичный свет, медленный наезд камеры"
+
+SCENARIOS: Dict[str, List[Step]] = {
+    "start": [_text("/start", "/start")],
+    "browse": [
+        _text("/start", "/start"),
+        _cb("menu_balance"), _cb("back_to_main"),
+        _cb("menu_topup"), _cb("back_to_main"),
+    ],
+    "sora_t2v": [
+        _cb("menu_create"), _cb("engine_sora"), _cb("ptype_t2v"), _cb("tier_sora2"),
+        _cb("duration_10"), _cb("orientation_9_16"), _cb("continue_video"),
+        _text("prompt", PROMPT), _cb("confirm_video"),
+    ],
+    "sora_pro_i2v": [
+        _cb("menu_create"), _cb("engine_sora"), _cb("ptype_i2v"), _cb("tier_sora2pro"),
+        _cb("qual_high"), _cb("quality_next"), _cb("duration_15"), _cb("orientation_16_9"),
+        _cb("continue_video"), _photo(), _text("prompt", PROMPT), _cb("confirm_video"),
+    ],
+    "veo_t2v": [
+        _cb("menu_create"), _cb("engine_veo"), _cb("veo_mode_t2v"), _cb("veo_q_fast"),
+        _cb("veo_ar_169"), _text("prompt", PROMPT), _cb("confirm_veo"),
+    ],
+    "veo_i2v": [
+        _cb("menu_create"), _cb("engine_veo"), _cb("veo_mode_i2v"), _cb("veo_q_quality"),
+        _cb("veo_ar_916"), _photo(), _photo(), _text("prompt", PROMPT), _cb("confirm_veo"),
+    ],
+    "stars": [
+        _cb("menu_topup"), _cb("pay_stars"), _cb("stars_60"),
+        _pre_checkout(), _stars_paid(),
+    ],
+}
+
+# Доля сценариев в общем потоке
+DEFAULT_MIX = {
+    "start": 1, "browse": 3, "sora_t2v": 2, "sora_pro_i2v": 1,
+    "veo_t2v": 2, "veo_i2v": 1, "stars": 1,
+}
+
+
+def build_stream(
+    factory, rng: random.Random, count: int, active_users: int, first_uid: int, mix: Dict[str, int],
+) -> Tuple[List[Tuple[int, str, Any]], List[int]]:
+    """
+    Поток из count апдейтов: active_users пользователей одновременно проходят
+    сценарии, апдейты перемешаны между пользователями. Закончивший сценарий
+    пользователь заменяется новым. Возвращает поток и список всех uid.
+    """
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    next_uid = first_uid
+    slots: List[List[Step]] = []
+    slot_uids: List[int] = []
+    uids: List[int] = []
+
+    def new_session() -> Tuple[int, List[Step]]:
+        nonlocal next_uid
+        uid, next_uid = next_uid, next_uid + 1
+        uids.append(uid)
+        return uid, list(SCENARIOS[rng.choices(names, weights)[0]])
+
+    for _ in range(active_users):
+        uid, steps = new_session()
+        slot_uids.append(uid)
+        slots.append(steps)
+
+    stream = []
+    while len(stream) < count:
+        i = rng.randrange(active_users)
+        label, make = slots[i].pop(0)
+        stream.append((slot_uids[i], label, make(factory, slot_uids[i])))
+        if not slots[i]:
+            slot_uids[i], slots[i] = new_session()
+    return stream, uids
+
+
+#  ПРОГОН
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    v = sorted(values)
+    return {
+        "count": len(v),
+        "p50_ms": _percentile(v, 0.50) * 1000,
+        "p95_ms": _percentile(v, 0.95) * 1000,
+        "p99_ms": _percentile(v, 0.99) * 1000,
+        "max_ms": (v[-1] if v else 0.0) * 1000,
+    }
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # не Linux: пиковый RSS (на macOS в байтах, на Linux в КБ)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+async def seed_users(db, uids: List[int], balance: int) -> None:
+    async with db.acquire() as conn:
+        await conn.executemany(
+            """
+            INSERT INTO users (user_id, generations_left) VALUES ($1, $2)
+            ON CONFLICT (user_id) DO UPDATE SET generations_left = EXCLUDED.generations_left
+            """,
+            [(uid, balance) for uid in uids],
+        )
+
+
+async def run_step(dp, bot, stream, rate: float) -> Tuple[Dict[str, List[float]], float, int]:
+    """
+    Подаёт поток с частотой rate апдейтов/с. Задержка апдейта — от момента,
+    когда он «пришёл» по расписанию, до конца обработки (включая ожидание
+    в очереди своего пользователя).
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    queues: Dict[int, asyncio.Queue] = {}
+    workers: List[asyncio.Task] = []
+    errors = 0
+
+    async def worker(q: asyncio.Queue) -> None:
+        nonlocal errors
+        while True:
+            arrived, label, update = await q.get()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                errors += 1
+            latencies[label].append(time.perf_counter() - arrived)
+            q.task_done()
+
+    loop_start = time.perf_counter()
+    for i, (uid, label, update) in enumerate(stream):
+        due = loop_start + i / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        q = queues.get(uid)
+        if q is None:
+            q = queues[uid] = asyncio.Queue()
+            workers.append(asyncio.create_task(worker(q)))
+        q.put_nowait((due, label, update))
+
+    await asyncio.gather(*(q.join() for q in queues.values()))
+    elapsed = time.perf_counter() - loop_start
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    return latencies, elapsed, errors
+
+
+async def wait_generations(timeout: float) -> int:
+    """Ждём фоновые опросы KIE (они тоже нагрузка и должны закончиться)."""
+    from metrics import GENERATIONS_IN_FLIGHT
+
+    def in_flight() -> int:
+        return int(sum(GENERATIONS_IN_FLIGHT.labels(e).value for e in ("sora", "veo")))
+
+    deadline = time.monotonic() + timeout
+    while in_flight() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return in_flight()
+
+
+async def bench(args) -> Dict[str, Any]:
+    from fake_kie import FakeKieServer
+    from fake_telegram import FakeTelegramSession, UpdateFactory
+
+    from aiogram import Bot
+    from database import db
+    from main import build_dispatcher
+    from metrics import render as render_metrics
+
+    random.seed(args.seed)
+    rng = random.Random(args.seed)
+
+    kie = await FakeKieServer(port=args.kie_port, latency=args.kie_latency, seed=args.seed).start()
+    session = FakeTelegramSession(latency=args.tg_latency)
+    bot = Bot(token="42:BENCH", session=session)
+    dp = build_dispatcher()
+    factory = UpdateFactory(bot)
+    await db.connect()
+
+    mix = DEFAULT_MIX
+    if args.mix:
+        mix = {k: int(v) for k, v in (item.split("=") for item in args.mix.split(","))}
+
+    results: List[Dict[str, Any]] = []
+    next_uid = USER_BASE
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    try:
+        # прогрев: импорты, JIT-кэши pydantic, пул соединений
+        warm, uids = build_stream(factory, rng, 200, 20, next_uid, mix)
+        next_uid += len(uids)
+        await seed_users(db, uids, 10**6)
+        await run_step(dp, bot, warm, rate=1e9)
+        await wait_generations(30)
+
+        for rate in args.rates:
+            count = int(rate * args.duration)
+            stream, uids = build_stream(factory, rng, count, args.active_users, next_uid, mix)
+            next_uid += len(uids)
+            await seed_users(db, uids, 10**6)
+            gc.collect()
+            calls_before = sum(session.calls.values())
+
+            latencies, elapsed, errors = await run_step(dp, bot, stream, rate)
+            left = await wait_generations(args.generation_timeout)
+
+            overall = _summary([x for v in latencies.values() for x in v])
+            step = {
+                "target_rate": rate,
+                "updates": count,
+                "achieved_rate": count / elapsed if elapsed else 0.0,
+                "errors": errors,
+                "latency": overall,
+                "handlers": {label: _summary(v) for label, v in sorted(latencies.items())},
+                "telegram_calls_per_update": (sum(session.calls.values()) - calls_before) / max(1, count),
+                "generations_not_finished": left,
+                "rss_mb": _rss_mb(),
+                "gc_objects": len(gc.get_objects()),
+            }
+            if args.tracemalloc:
+                step["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.reset_peak()
+            results.append(step)
+            _print_step(step, verbose=args.verbose)
+
+            saturated = (
+                overall["p99_ms"] > args.max_p99 * 1000
+                or step["achieved_rate"] < 0.9 * rate
+            )
+            if saturated:
+                print(f"→ saturated at {rate:g} updates/s")
+                break
+    finally:
+        if args.metrics_out:
+            with open(args.metrics_out, "w", encoding="utf-8") as f:
+                f.write(render_metrics())
+        await db.close()
+        await bot.session.close()
+        await kie.stop()
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "aiogram": __import__("aiogram").__version__,
+            "seed": args.seed,
+            "duration": args.duration,
+            "active_users": args.active_users,
+            "mix": mix,
+            "tg_latency": args.tg_latency,
+            "kie_latency": args.kie_latency,
+            "real_limits": args.real_limits,
+        },
+        "steps": results,
+        "telegram_calls": dict(session.calls),
+        "kie_requests": dict(kie.requests),
+    }
+
+
+def _print_step(step: Dict[str, Any], verbose: bool) -> None:
+    lat = step["latency"]
+    print(
+        f"rate {step['target_rate']:>7g}/s | achieved {step['achieved_rate']:8.1f}/s | "
+        f"p50 {lat['p50_ms']:7.1f} ms | p95 {lat['p95_ms']:7.1f} ms | p99 {lat['p99_ms']:7.1f} ms | "
+        f"errors {step['errors']} | RSS {step['rss_mb']:.0f} MB"
+    )
+    if verbose:
+        for label, s in step["handlers"].items():
+            print(
+                f"    {label:<28} n={s['count']:<6} p50 {s['p50_ms']:7.1f}  "
+                f"p95 {s['p95_ms']:7.1f}  p99 {s['p99_ms']:7.1f} ms"
+            )
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rates", default="50,100,200,400,800",
+                        type=lambda s: [float(x) for x in s.split(",")],
+                        help="ступени нагрузки, апдейтов/с")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на ступень")
+    parser.add_argument("--active-users", type=int, default=200,
+                        help="сколько пользователей одновременно проходят сценарии")
+    parser.add_argument("--mix", default="", help="доли сценариев, например sora_t2v=3,browse=1")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tg-latency", type=float, default=0.03, help="задержка Bot API, с")
+    parser.add_argument("--kie-latency", type=float, default=0.05, help="задержка KIE, с")
+    parser.add_argument("--kie-port", type=int, default=0)
+    parser.add_argument("--max-p99", type=float, default=1.0, help="порог p99, с")
+    parser.add_argument("--generation-timeout", type=float, default=60.0)
+    parser.add_argument("--real-limits", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true", help="пик памяти Python (медленнее)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="перцентили по каждому шагу")
+    parser.add_argument("--json", dest="json_out", default="", help="сохранить результат в JSON")
+    parser.add_argument("--metrics-out", default="", help="сохранить /metrics после прогона")
+    args = parser.parse_args()
+
+    # Окружение — до импорта config.py
+    if not args.kie_port:
+        args.kie_port = _free_port()
+    os.environ["KIE_API_BASE"] = f"http://127.0.0.1:{args.kie_port}"
+    for name in ("JOBS_CREATE", "JOBS_STATUS", "VEO_URL", "VEO_STATUS"):
+        os.environ.pop(name, None)
+    os.environ.setdefault("TOKEN", "42:BENCH")
+    os.environ.setdefault("DATABASE_URL", "postgresql://postgres@localhost/sora_bench")
+    os.environ.setdefault("KIE_API_KEY", "bench")
+    os.environ.setdefault("CHANNEL_ID", "-1001234567890")
+    os.environ["WEB_SERVER_PORT"] = "0"
+    os.environ["PRICING_FILE"] = ""
+    if not args.real_limits:
+        for name in ("TG_GLOBAL_RATE", "TG_CHAT_RATE", "TG_CHAT_BURST", "TG_GROUP_PER_MINUTE"):
+            os.environ[name] = "1000000"
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    result = asyncio.run(bench(args))
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"saved {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
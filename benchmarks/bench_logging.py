@@ -0,0 +1,154 @@
+# benchmarks/bench_logging.py
+"""
+Влияние логирования на event loop при большом потоке записей.
+
+Тысячи корутин «опрашивают KIE» и на каждом шаге пишут лог; параллельно
+задача-пульс каждые 1 мс меряет, насколько loop опаздывает.
+Сравнивает:
+- sync  — как было: StreamHandler прямо в loop (basicConfig);
+- queue — log_setup.setup_logging(): очередь + поток записи.
+
+--slow-sink-ms имитирует медленный stdout (docker log driver, pipe в journald):
+каждая запись в поток «висит» столько миллисекунд.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_logging.py [--tasks 2000 --records 20 --slow-sink-ms 0.2]
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py требует переменные окружения — для бенчмарка хватит заглушек
+os.environ.setdefault("TOKEN", "0:bench")
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+os.environ.setdefault("KIE_API_KEY", "bench")
+
+from log_setup import LOGS_DROPPED, LOGS_SUPPRESSED, TEXT_FORMAT, setup_logging  # noqa: E402
+
+
+class SlowStream(io.TextIOBase):
+    """Файл, каждая запись в который занимает delay секунд."""
+
+    def __init__(self, path: str, delay: float):
+        self._f = open(path, "w", encoding="utf-8")
+        self.delay = delay
+
+    def write(self, s: str) -> int:
+        if self.delay:
+            time.sleep(self.delay)
+        return self._f.write(s)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+async def workload(tasks: int, records: int, error_every: int) -> float:
+    log = logging.getLogger("bench.poll")
+
+    async def poller(n: int) -> None:
+        task_id = f"task-{n}"
+        for i in range(records):
+            if error_every and i % error_every == error_every - 1:
+                log.warning("KIE poll error for task %s: %r", task_id, TimeoutError("read timeout"))
+            else:
+                log.info("KIE poll task %s: state=%s attempt=%d", task_id, "generating", i)
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(poller(n) for n in range(tasks)))
+    return time.perf_counter() - started
+
+
+async def measure(tasks: int, records: int, error_every: int):
+    lags = []
+    stop = asyncio.Event()
+
+    async def heartbeat() -> None:
+        while not stop.is_set():
+            t = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - t - 0.001)
+
+    hb = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.01)
+    elapsed = await workload(tasks, records, error_every)
+    stop.set()
+    await hb
+    return elapsed, lags
+
+
+def run(mode: str, args) -> None:
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_log_"), f"{mode}.log")
+    stream = SlowStream(path, args.slow_sink_ms / 1000)
+
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+
+    listener = None
+    if mode == "sync":
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        listener = setup_logging(
+            logging.INFO,
+            json_format=args.json,
+            stream=stream,
+            queue_size=args.queue_size,
+        )
+
+    elapsed, lags = asyncio.run(measure(args.tasks, args.records, args.error_every))
+    drained_at = time.perf_counter()
+    if listener:
+        listener.stop()
+    drain = time.perf_counter() - drained_at
+    stream.close()
+
+    with open(path, encoding="utf-8") as f:
+        written = sum(1 for _ in f)
+    total = args.tasks * args.records
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] if lags else 0.0
+    print(
+        f"{mode:<6} wall {elapsed:6.2f}s | {total / elapsed:9.0f} rec/s | "
+        f"loop lag p50 {statistics.median(lags) * 1000 if lags else 0:7.2f} ms, "
+        f"p99 {p99 * 1000:7.2f} ms, max {(lags[-1] if lags else 0) * 1000:7.2f} ms | "
+        f"written {written}/{total} | drain after {drain:.2f}s"
+    )
+    if listener:
+        print(
+            f"       suppressed (rate limit) {LOGS_SUPPRESSED.labels().value:.0f}, "
+            f"dropped (queue full) {LOGS_DROPPED.labels().value:.0f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--records", type=int, default=20)
+    parser.add_argument("--error-every", type=int, default=10,
+                        help="каждая N-я запись — повторяющийся warning (0 — без них)")
+    parser.add_argument("--slow-sink-ms", type=float, default=0.05)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--json", action="store_true", help="JSON-формат для queue")
+    args = parser.parse_args()
+
+    for mode in ("sync", "queue"):
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_prescreen.py
+"""
+Стоимость предпроверки промпта (prescreen.py) в зависимости от числа терминов.
+
+Сравнивает:
+- naive — как сделали бы «в лоб»: отдельный поиск по регулярке \\bterm\\b на каждый термин;
+- aho   — PromptScreen: автомат Ахо — Корасик, один проход по тексту.
+
+Термины — случайные «слова» (как выученные из отказов KIE), промпты —
+смесь обычных слов и изредка терминов.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_prescreen.py [--terms 100,1000,10000 --prompts 2000 --length 400]
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py требует переменные окружения — для бенчмарка хватит заглушек
+os.environ.setdefault("TOKEN", "0:bench")
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+os.environ.setdefault("KIE_API_KEY", "bench")
+
+from prescreen import REJECT, WARN, PromptScreen, normalize  # noqa: E402
+
+FILLER = (
+    "a cinematic shot of the city at night with neon lights and rain "
+    "slow camera pan over mountains golden hour soft light drone footage "
+    "кот сидит на подоконнике и смотрит на снег в старом городе"
+).split()
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+
+
+def make_prompts(rng: random.Random, terms, count: int, length: int):
+    prompts = []
+    for _ in range(count):
+        words = []
+        while sum(len(w) + 1 for w in words) < length:
+            words.append(rng.choice(terms) if rng.random() < 0.01 else rng.choice(FILLER))
+        prompts.append(" ".join(words))
+    return prompts
+
+
+def naive(terms):
+    patterns = [(t, re.compile(rf"\b{re.escape(t)}\b")) for t in terms]
+
+    def check(prompt: str):
+        text = normalize(prompt)
+        return [t for t, p in patterns if p.search(text)]
+
+    return check
+
+
+def bench(check, prompts) -> float:
+    started = time.perf_counter()
+    for prompt in prompts:
+        check(prompt)
+    return (time.perf_counter() - started) / len(prompts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--terms", default="100,1000,10000")
+    parser.add_argument("--prompts", type=int, default=2000)
+    parser.add_argument("--length", type=int, default=400)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'terms':>7}  {'compile ms':>10}  {'naive µs':>9}  {'aho µs':>7}")
+    for n in (int(x) for x in args.terms.split(",")):
+        terms = list(dict.fromkeys(random_word(rng) for _ in range(n)))
+        actions = {t: (REJECT if i % 10 == 0 else WARN) for i, t in enumerate(terms)}
+        prompts = make_prompts(rng, terms, args.prompts, args.length)
+
+        started = time.perf_counter()
+        screen = PromptScreen(actions)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        naive_check = naive(terms)
+        # одинаковый результат — иначе сравнение бессмысленно
+        for prompt in prompts[:200]:
+            assert sorted(screen.matcher.find(normalize(prompt))) == sorted(naive_check(prompt))
+
+        # naive растёт линейно с числом терминов — гоняем его на части промптов
+        naive_us = bench(naive_check, prompts[: max(50, args.prompts // max(1, n // 100))]) * 1e6
+        aho_us = bench(screen.check, prompts) * 1e6
+        print(f"{n:>7}  {compile_ms:>10.1f}  {naive_us:>9.0f}  {aho_us:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
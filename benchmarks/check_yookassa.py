@@ -0,0 +1,177 @@
+# benchmarks/check_yookassa.py
+"""
+Проверка рублёвых платежей против FakeYooKassaServer (без сети и SDK):
+
+- client — create_yookassa_payment через yookassa_client: платёж создаётся,
+  читается по id; повтор с тем же Idempotence-Key (и повтор клиента после
+  потерянного ответа 500) не создаёт второй платёж;
+- reconcile — reconcile_rub_payments, когда вебхук потерялся: оплаченный
+  платёж зачисляется (и с provider_created_at, и старая запись без него),
+  платёж старше RUB_RECONCILE_WINDOW закрывается перечитыванием по id,
+  а повторный проход не листает список YooKassa заново. Нужен локальный
+  Postgres (отдельная база! пользователь проверки — USER_BASE + 1).
+
+Запуск из корня репозитория:
+    DATABASE_URL=postgresql://postgres@localhost/sora_bench \\
+        python benchmarks/check_yookassa.py [client] [reconcile]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ID пользователей проверок — как в bench_dispatcher, не пересекаются с настоящими
+USER_BASE = 9_000_000_000
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+#  ПРОВЕРКИ
+
+async def check_client(fake) -> None:
+    from payments import create_yookassa_payment
+    from yookassa_client import yookassa
+
+    url, pay_id, created_at = await create_yookassa_payment(100, 42, 150, idempotence_key="check-1")
+    payment = await yookassa.get_payment(pay_id)
+    assert payment["status"] == "pending", payment
+    assert payment["amount"] == {"value": "100.00", "currency": "RUB"}, payment
+    assert payment["metadata"] == {"user_id": 42, "tokens": 150}, payment
+    assert url == payment["confirmation"]["confirmation_url"]
+    assert created_at is not None and created_at.tzinfo is not None, created_at
+
+    # повторная доставка того же нажатия — тот же платёж
+    _, again, _ = await create_yookassa_payment(100, 42, 150, idempotence_key="check-1")
+    assert again == pay_id, (again, pay_id)
+
+    # ответ на создание потерялся (500) — клиент повторяет с тем же ключом
+    fake.fail_after_create = 1
+    _, retried, _ = await create_yookassa_payment(100, 42, 150, idempotence_key="check-2")
+    assert retried != pay_id
+    assert len(fake.payments) == 2, fake.payments
+
+    print(f"client: ok ({dict(fake.requests)})")
+
+
+async def check_reconcile(fake) -> None:
+    from aiogram import Bot
+    from fake_telegram import FakeTelegramSession
+
+    from config import RUB_RECONCILE_WINDOW
+    from database import db
+    from payments import create_yookassa_payment, reconcile_rub_payments
+
+    uid = USER_BASE + 1
+    bot = Bot(token="42:CHECK", session=FakeTelegramSession())
+    await db.connect()
+    try:
+        async with db.acquire() as conn:
+            await conn.execute("DELETE FROM rub_payments WHERE user_id = $1", uid)
+            await conn.execute("""
+                INSERT INTO users (user_id, generations_left) VALUES ($1, 0)
+                ON CONFLICT (user_id) DO UPDATE SET generations_left = 0
+            """, uid)
+
+        async def new_payment(key: str, store_provider_time: bool = True) -> str:
+            _, pay_id, created_at = await create_yookassa_payment(100, uid, 150, idempotence_key=key)
+            await db.create_rub_payment(pay_id, uid, 100, 150, created_at if store_provider_time else None)
+            return pay_id
+
+        async def balance() -> int:
+            return (await db.get_user(uid))["generations_left"]
+
+        # вебхук не дошёл; у YooKassa платёж создан раньше нашей записи
+        # (медленный ответ, повторы) — курсор по нашему created_at его бы пропустил
+        fresh = await new_payment("check-fresh")
+        legacy = await new_payment("check-legacy", store_provider_time=False)
+        for pay_id in (fresh, legacy):
+            fake.backdate(pay_id, 30)
+            fake.succeed(pay_id)
+        settled = await reconcile_rub_payments(bot)
+        assert settled == 2, settled
+        assert await balance() == 300, await balance()
+
+        # платёж старше окна списка: только перечитывание по id
+        stale = await new_payment("check-stale")
+        stuck = await new_payment("check-stuck")
+        async with db.acquire() as conn:
+            await conn.execute("""
+                UPDATE rub_payments SET created_at = now() - make_interval(secs => $2)
+                WHERE payment_id = ANY($1::text[])
+            """, [stale, stuck], RUB_RECONCILE_WINDOW + 3600)
+        for pay_id in (stale, stuck):
+            fake.backdate(pay_id, RUB_RECONCILE_WINDOW + 3600)
+        fake.succeed(stale)
+
+        lists = fake.requests["list"]
+        settled = await reconcile_rub_payments(bot)
+        assert settled == 1, settled
+        assert await balance() == 450, await balance()
+        # в окне pending не осталось — список YooKassa не запрашивается,
+        # зависший платёж не тянет курсор назад
+        assert fake.requests["list"] == lists, fake.requests
+
+        gets = fake.requests["get"]
+        assert await reconcile_rub_payments(bot) == 0
+        assert fake.requests["list"] == lists, fake.requests
+        assert fake.requests["get"] == gets + 1, fake.requests
+
+        # YooKassa отменила неоплаченный платёж — закрывается следующим проходом
+        fake.cancel(stuck)
+        assert await reconcile_rub_payments(bot) == 1
+        assert await balance() == 450, await balance()
+
+        print(f"reconcile: ok ({dict(fake.requests)})")
+    finally:
+        await db.close()
+        await bot.session.close()
+
+
+CHECKS = {"client": check_client, "reconcile": check_reconcile}
+
+
+async def run(names, port: int) -> None:
+    from fake_yookassa import FakeYooKassaServer
+    from http_client import close_session
+
+    fake = await FakeYooKassaServer(port=port).start()
+    try:
+        for name in names:
+            await CHECKS[name](fake)
+    finally:
+        await close_session()
+        await fake.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checks", nargs="*", help=f"из {', '.join(CHECKS)} (по умолчанию все)")
+    args = parser.parse_args()
+    unknown = set(args.checks) - set(CHECKS)
+    if unknown:
+        parser.error(f"неизвестные проверки: {', '.join(sorted(unknown))}")
+
+    # Окружение — до импорта config.py: клиент ходит в фейк
+    port = _free_port()
+    os.environ["YOOKASSA_API_URL"] = f"http://127.0.0.1:{port}/v3"
+    os.environ["YOOKASSA_SHOP_ID"] = "check"
+    os.environ["YOOKASSA_SECRET_KEY"] = "check"
+    os.environ.setdefault("TOKEN", "42:CHECK")
+    os.environ.setdefault("DATABASE_URL", "postgresql://postgres@localhost/sora_bench")
+    os.environ.setdefault("KIE_API_KEY", "check")
+    os.environ["PRICING_FILE"] = ""
+    os.environ["RUB_RECONCILE_MIN_AGE"] = "0"
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(run(args.checks or list(CHECKS), port))
+
+
+if __name__ == "__main__":
+    main()
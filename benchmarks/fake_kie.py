@@ -0,0 +1,173 @@
+# benchmarks/fake_kie.py
+"""
+Фейковый KIE API для бенчмарков: те же эндпоинты и форма ответов,
+что использует бот (Sora jobs + Veo), без реальной генерации.
+
+- createTask / veo generate сразу отдают taskId;
+- первые pending_polls опросов статуса отвечают «генерируется»,
+  дальше — успех со ссылкой на видео (или ошибка с вероятностью fail_rate);
+- latency — искусственная задержка каждого ответа.
+
+Отдельный запуск (например, для ручной проверки бота):
+    python benchmarks/fake_kie.py --port 8089
+    KIE_API_BASE=http://127.0.0.1:8089 python main.py
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakeKieServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        pending_polls: int = 0,
+        fail_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.pending_polls = pending_polls
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.requests: Counter = Counter()
+        self._polls: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    #  Эндпоинты
+
+    async def _delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _new_task(self, prefix: str) -> str:
+        task_id = f"{prefix}-{next(self._ids)}"
+        self._polls[task_id] = 0
+        return task_id
+
+    def _task_state(self, task_id: str) -> str:
+        """pending / success / fail"""
+        polls = self._polls.get(task_id)
+        if polls is None:
+            return "fail"
+        self._polls[task_id] = polls + 1
+        if polls < self.pending_polls:
+            return "pending"
+        del self._polls[task_id]
+        if self.fail_rate and self.rng.random() < self.fail_rate:
+            return "fail"
+        return "success"
+
+    async def jobs_create(self, request: web.Request) -> web.Response:
+        self.requests["jobs_create"] += 1
+        await request.read()
+        await self._delay()
+        return web.json_response({"code": 200, "data": {"taskId": self._new_task("sora")}})
+
+    async def jobs_status(self, request: web.Request) -> web.Response:
+        self.requests["jobs_status"] += 1
+        await self._delay()
+        task_id = request.query.get("taskId", "")
+        state = self._task_state(task_id)
+        if state == "pending":
+            data = {"taskId": task_id, "state": "generating"}
+        elif state == "success":
+            data = {
+                "taskId": task_id,
+                "state": "success",
+                "resultJson": json.dumps({"resultUrls": [f"{self.base_url}/video/{task_id}.mp4"]}),
+            }
+        else:
+            data = {"taskId": task_id, "state": "fail", "failMsg": "fake failure"}
+        return web.json_response({"code": 200, "data": data})
+
+    async def veo_generate(self, request: web.Request) -> web.Response:
+        self.requests["veo_generate"] += 1
+        await request.read()
+        await self._delay()
+        return web.json_response({"code": 200, "data": {"taskId": self._new_task("veo")}})
+
+    async def veo_status(self, request: web.Request) -> web.Response:
+        self.requests["veo_status"] += 1
+        await self._delay()
+        task_id = request.query.get("taskId", "")
+        state = self._task_state(task_id)
+        if state == "pending":
+            data = {"taskId": task_id, "successFlag": 0}
+        elif state == "success":
+            data = {
+                "taskId": task_id,
+                "successFlag": 1,
+                "response": {"resultUrls": [f"{self.base_url}/video/{task_id}.mp4"]},
+            }
+        else:
+            data = {"taskId": task_id, "successFlag": 2, "errorMessage": "fake failure"}
+        return web.json_response({"code": 200, "data": data})
+
+    #  Запуск / остановка
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/api/v1/jobs/createTask", self.jobs_create)
+        app.router.add_get("/api/v1/jobs/recordInfo", self.jobs_status)
+        app.router.add_post("/api/v1/veo/generate", self.veo_generate)
+        app.router.add_get("/api/v1/veo/record-info", self.veo_status)
+        return app
+
+    async def start(self) -> "FakeKieServer":
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            # порт 0 — выбран системой, узнаём реальный
+            self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args) -> None:
+    server = await FakeKieServer(
+        args.host, args.port, args.latency, args.pending_polls, args.fail_rate
+    ).start()
+    print(f"fake KIE listening on {server.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--pending-polls", type=int, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# benchmarks/fake_telegram.py
+"""
+Заглушки Telegram для бенчмарков:
+- FakeTelegramSession — сессия Bot, которая не ходит в сеть, а отвечает
+  правдоподобным JSON и прогоняет его через обычный разбор ответа aiogram;
+- UpdateFactory — готовые Update (сообщения, фото, нажатия кнопок, оплата Stars),
+  привязанные к боту, как их отдаёт polling.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+
+# Методы, которые в ответ отдают Message
+_MESSAGE_METHODS = {
+    "SendMessage",
+    "SendVideo",
+    "SendInvoice",
+    "SendPhoto",
+    "SendDocument",
+    "EditMessageText",
+    "EditMessageReplyMarkup",
+    "EditMessageCaption",
+}
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    latency — искусственная задержка ответа Bot API (секунды).
+    calls — сколько раз вызван каждый метод.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+
+    def _result(self, name: str, method: TelegramMethod) -> Any:
+        chat_id = getattr(method, "chat_id", None) or getattr(method, "user_id", None) or 0
+        if name in _MESSAGE_METHODS:
+            result: Dict[str, Any] = {
+                "message_id": getattr(method, "message_id", None) or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            text = getattr(method, "text", None)
+            if isinstance(text, str):
+                result["text"] = text
+            return result
+        if name == "GetChatMember":
+            return {
+                "status": "member",
+                "user": {"id": method.user_id, "is_bot": False, "first_name": "bench"},
+            }
+        if name == "GetFile":
+            return {
+                "file_id": method.file_id,
+                "file_unique_id": f"u{method.file_id}",
+                "file_path": f"photos/{method.file_id}.jpg",
+            }
+        return True
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod,
+        timeout: Optional[int] = None,
+    ) -> Any:
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = json.dumps({"ok": True, "result": self._result(name, method)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class UpdateFactory:
+    """
+    Собирает Update из словарей, как это делает polling: через model_validate
+    с контекстом бота, чтобы message.answer()/edit_text() работали.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    def _user(self, uid: int) -> Dict[str, Any]:
+        return {"id": uid, "is_bot": False, "first_name": "bench", "language_code": "ru"}
+
+    def _message(self, uid: int, **fields: Any) -> Dict[str, Any]:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            **fields,
+        }
+
+    def _update(self, **fields: Any) -> Update:
+        return Update.model_validate(
+            {"update_id": next(self._update_ids), **fields},
+            context={"bot": self.bot},
+        )
+
+    def text(self, uid: int, text: str) -> Update:
+        entities = []
+        if text.startswith("/"):
+            entities.append({"type": "bot_command", "offset": 0, "length": len(text.split()[0])})
+        fields = {"text": text}
+        if entities:
+            fields["entities"] = entities
+        return self._update(message=self._message(uid, **fields))
+
+    def photo(self, uid: int) -> Update:
+        n = next(self._file_ids)
+        sizes = [
+            {"file_id": f"ph{n}_{w}", "file_unique_id": f"u{n}_{w}", "width": w, "height": w}
+            for w in (90, 320, 1280)
+        ]
+        return self._update(message=self._message(uid, photo=sizes))
+
+    def callback(self, uid: int, data: str) -> Update:
+        return self._update(callback_query={
+            "id": str(next(self._callback_ids)),
+            "from": self._user(uid),
+            "chat_instance": "bench",
+            "data": data,
+            "message": self._message(uid, text="menu"),
+        })
+
+    def pre_checkout(self, uid: int, stars: int, payload: Dict[str, Any]) -> Update:
+        return self._update(pre_checkout_query={
+            "id": str(next(self._callback_ids)),
+            "from": self._user(uid),
+            "currency": "XTR",
+            "total_amount": stars,
+            "invoice_payload": json.dumps(payload),
+        })
+
+    def stars_paid(self, uid: int, stars: int, payload: Dict[str, Any]) -> Update:
+        n = next(self._callback_ids)
+        return self._update(message=self._message(uid, successful_payment={
+            "currency": "XTR",
+            "total_amount": stars,
+            "invoice_payload": json.dumps(payload),
+            "telegram_payment_charge_id": f"bench-charge-{n}",
+            "provider_payment_charge_id": f"bench-provider-{n}",
+        }))
@@ -0,0 +1,219 @@
+# benchmarks/fake_yookassa.py
+"""
+Фейковый YooKassa API v3 для проверок и бенчмарков: те же эндпоинты
+и форма ответов, что использует yookassa_client.
+
+- POST /payments создаёт платёж в pending; обязателен Idempotence-Key:
+  повтор с тем же ключом отдаёт тот же платёж, второй не создаётся;
+- GET /payments/{id} — платёж или 404;
+- GET /payments — список от новых к старым, фильтры created_at.gte и status,
+  страницы по limit и непрозрачному cursor (next_cursor в ответе);
+- fail_after_create — столько POST подряд создают платёж, но отвечают 500
+  (ответ «потерялся»: клиент должен повторить с тем же ключом);
+- succeed() / cancel() — платёж оплачен / отменён (вебхук при этом не шлём);
+  backdate() — сдвинуть created_at платежа в прошлое.
+
+Отдельный запуск (например, для ручной проверки бота):
+    python benchmarks/fake_yookassa.py --port 8090
+    YOOKASSA_API_URL=http://127.0.0.1:8090/v3 YOOKASSA_SHOP_ID=1 YOOKASSA_SECRET_KEY=x python main.py
+"""
+import argparse
+import asyncio
+import base64
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+
+def yookassa_time(dt: datetime) -> str:
+    """Формат времени YooKassa: 2024-01-31T12:00:00.000Z"""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _error(status: int, code: str, description: str) -> web.Response:
+    return web.json_response(
+        {"type": "error", "id": str(uuid.uuid4()), "code": code, "description": description},
+        status=status,
+    )
+
+
+class FakeYooKassaServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        fail_after_create: int = 0,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.fail_after_create = fail_after_create
+        self.requests: Counter = Counter()
+        self.payments: Dict[str, Dict[str, Any]] = {}
+        self._by_key: Dict[str, str] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    #  Управление из проверок
+
+    def succeed(self, payment_id: str) -> Dict[str, Any]:
+        payment = self.payments[payment_id]
+        payment.update(status="succeeded", paid=True, captured_at=yookassa_time(datetime.now(timezone.utc)))
+        return payment
+
+    def cancel(self, payment_id: str) -> Dict[str, Any]:
+        payment = self.payments[payment_id]
+        payment.update(
+            status="canceled",
+            cancellation_details={"party": "yoo_money", "reason": "expired_on_confirmation"},
+        )
+        return payment
+
+    def backdate(self, payment_id: str, seconds: float) -> Dict[str, Any]:
+        payment = self.payments[payment_id]
+        created = datetime.fromisoformat(payment["created_at"].replace("Z", "+00:00"))
+        payment["created_at"] = yookassa_time(created - timedelta(seconds=seconds))
+        return payment
+
+    #  Эндпоинты
+
+    async def _delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @staticmethod
+    def _authorized(request: web.Request) -> bool:
+        return request.headers.get("Authorization", "").startswith("Basic ")
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        self.requests["create"] += 1
+        if not self._authorized(request):
+            return _error(401, "invalid_credentials", "Basic auth required")
+        key = request.headers.get("Idempotence-Key")
+        if not key:
+            return _error(400, "invalid_request", "Idempotence-Key header is required")
+        body = await request.json()
+        await self._delay()
+
+        payment_id = self._by_key.get(key)
+        if payment_id is not None:
+            self.requests["create_replayed"] += 1
+        else:
+            payment_id = str(uuid.uuid4())
+            self._by_key[key] = payment_id
+            self.payments[payment_id] = {
+                "id": payment_id,
+                "status": "pending",
+                "paid": False,
+                "amount": body["amount"],
+                "description": body.get("description"),
+                "metadata": body.get("metadata") or {},
+                "created_at": yookassa_time(datetime.now(timezone.utc)),
+                "confirmation": {
+                    "type": "redirect",
+                    "confirmation_url": f"{self.base_url}/checkout/{payment_id}",
+                },
+                "test": True,
+            }
+
+        if self.fail_after_create:
+            self.fail_after_create -= 1
+            return _error(500, "internal_server_error", "fake: response lost")
+        return web.json_response(self.payments[payment_id])
+
+    async def get_payment(self, request: web.Request) -> web.Response:
+        self.requests["get"] += 1
+        if not self._authorized(request):
+            return _error(401, "invalid_credentials", "Basic auth required")
+        await self._delay()
+        payment = self.payments.get(request.match_info["payment_id"])
+        if payment is None:
+            return _error(404, "not_found", "Payment not found")
+        return web.json_response(payment)
+
+    async def list_payments(self, request: web.Request) -> web.Response:
+        self.requests["list"] += 1
+        if not self._authorized(request):
+            return _error(401, "invalid_credentials", "Basic auth required")
+        query = request.query
+        try:
+            limit = int(query.get("limit", 10))
+            offset = int(base64.urlsafe_b64decode(query["cursor"]).decode()) if "cursor" in query else 0
+        except ValueError:
+            return _error(400, "invalid_request", "bad limit or cursor")
+        if not 1 <= limit <= 100:
+            return _error(400, "invalid_request", "limit must be 1..100")
+        await self._delay()
+
+        # формат времени фиксированной ширины — строки сравниваются как время
+        items = sorted(self.payments.values(), key=lambda p: p["created_at"], reverse=True)
+        if "created_at.gte" in query:
+            items = [p for p in items if p["created_at"] >= query["created_at.gte"]]
+        if "status" in query:
+            items = [p for p in items if p["status"] == query["status"]]
+
+        page = {"type": "list", "items": items[offset:offset + limit]}
+        if offset + limit < len(items):
+            page["next_cursor"] = base64.urlsafe_b64encode(str(offset + limit).encode()).decode()
+        return web.json_response(page)
+
+    #  Запуск / остановка
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v3/payments", self.create_payment)
+        app.router.add_get("/v3/payments", self.list_payments)
+        app.router.add_get("/v3/payments/{payment_id}", self.get_payment)
+        return app
+
+    @property
+    def api_url(self) -> str:
+        """Значение для YOOKASSA_API_URL."""
+        return f"{self.base_url}/v3"
+
+    async def start(self) -> "FakeYooKassaServer":
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            # порт 0 — выбран системой, узнаём реальный
+            self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args) -> None:
+    server = await FakeYooKassaServer(args.host, args.port, args.latency).start()
+    print(f"fake YooKassa listening on {server.api_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# broadcast.py
+"""
+Рассылка сообщения всем пользователям (/broadcast).
+
+- Получатели читаются серверным курсором (database.broadcast_recipients)
+  страницами по BROADCAST_PAGE id — весь список в память не попадает.
+  Курсор живёт не дольше BROADCAST_SEGMENT_SECONDS, потом открывается
+  заново с чекпоинта, чтобы не держать соединение пула всю рассылку.
+- Скорость: собственный token bucket на BROADCAST_RATE сообщений в секунду
+  поверх общего планировщика — живым пользователям остаётся часть лимита.
+- После каждой страницы чекпоинт (last_user_id + счётчики) пишется в БД;
+  рестарт продолжает рассылку с него (повторно могут уйти не больше
+  одной страницы).
+- Заблокировавшие бота помечаются в users.blocked_at и в следующих
+  рассылках пропускаются (снимается апдейтом my_chat_member, см. subscription.py).
+- Счётчики доставлено / ошибки / заблокировали обновляются в сообщении
+  админу каждые BROADCAST_PROGRESS_INTERVAL секунд.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from config import (
+    BROADCAST_PAGE,
+    BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_RATE,
+    BROADCAST_SEGMENT_SECONDS,
+    TG_SEND_DEADLINE,
+)
+from database import db
+from metrics import counter
+from supervisor import supervisor
+from utils import PRIORITY_LOW, TokenBucket, outbound, safe_edit_message_text, safe_send_message
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_MESSAGES = counter(
+    "bot_broadcast_messages_total",
+    "Broadcast deliveries by outcome",
+    ("outcome",),
+)
+
+# Ошибки «этому пользователю писать нельзя»: бот заблокирован, аккаунт удалён
+_BLOCKED_MARKERS = ("blocked", "deactivated", "chat not found", "user not found")
+
+DELIVERED = "delivered"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+def format_progress(b: Dict) -> str:
+    status = {
+        "draft": "черновик",
+        "running": "идёт",
+        "paused": "на паузе",
+        "done": "завершена",
+        "cancelled": "отменена",
+    }.get(b["status"], b["status"])
+    return (
+        f"📣 Рассылка #{b['id']} — {status}\n"
+        f"✅ доставлено: {b['delivered']}\n"
+        f"🚫 заблокировали бота: {b['blocked']}\n"
+        f"⚠️ ошибки: {b['failed']}"
+    )
+
+
+class BroadcastRunner:
+    """Одна запущенная рассылка (в процессе — не больше одной)."""
+
+    def __init__(self, bot: Bot, broadcast: Dict, rate: float = BROADCAST_RATE):
+        self.bot = bot
+        self.b = dict(broadcast)
+        self.bucket = TokenBucket(rate, 1)
+        self._stop = asyncio.Event()
+        self._last_report = 0.0
+
+    def request_stop(self) -> None:
+        """Остановиться после текущей страницы (чекпоинт сохранится)."""
+        self._stop.set()
+
+    async def _deliver(self, user_id: int) -> str:
+        await self.bucket.acquire(PRIORITY_LOW)
+        try:
+            await outbound.call(
+                user_id,
+                lambda: self.bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=self.b["from_chat_id"],
+                    message_id=self.b["message_id"],
+                ),
+                priority=PRIORITY_LOW,
+                deadline=TG_SEND_DEADLINE,
+                method="copy_message",
+            )
+            return DELIVERED
+        except TelegramForbiddenError:
+            return BLOCKED
+        except TelegramBadRequest as e:
+            if any(marker in str(e).lower() for marker in _BLOCKED_MARKERS):
+                return BLOCKED
+            logger.info("broadcast #%s: bad request for %s: %s", self.b["id"], user_id, e)
+            return FAILED
+        except Exception as e:
+            logger.warning("broadcast #%s: delivery to %s failed: %r", self.b["id"], user_id, e)
+            return FAILED
+
+    async def _page(self, user_ids: List[int]) -> None:
+        results = await asyncio.gather(*(self._deliver(uid) for uid in user_ids))
+        delivered = sum(1 for r in results if r == DELIVERED)
+        blocked = [uid for uid, r in zip(user_ids, results) if r == BLOCKED]
+        failed = len(user_ids) - delivered - len(blocked)
+        # если здесь упадём, страница уйдёт повторно после рестарта — не страшно
+        await db.checkpoint_broadcast(self.b["id"], user_ids[-1], delivered, failed, blocked)
+        self.b["last_user_id"] = user_ids[-1]
+        self.b["delivered"] += delivered
+        self.b["failed"] += failed
+        self.b["blocked"] += len(blocked)
+        BROADCAST_MESSAGES.labels(DELIVERED).inc(delivered)
+        BROADCAST_MESSAGES.labels(FAILED).inc(failed)
+        BROADCAST_MESSAGES.labels(BLOCKED).inc(len(blocked))
+
+    async def _report(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_report < BROADCAST_PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        if self.b.get("progress_chat_id") and self.b.get("progress_message_id"):
+            await safe_edit_message_text(
+                self.bot, self.b["progress_chat_id"], self.b["progress_message_id"], format_progress(self.b)
+            )
+
+    async def run(self) -> None:
+        broadcast_id = self.b["id"]
+        logger.info("Broadcast #%s running from user_id > %s", broadcast_id, self.b["last_user_id"])
+        finished = False
+        while not finished and not self._stop.is_set():
+            segment_started = time.monotonic()
+            async with db.broadcast_recipients(self.b["last_user_id"]) as cursor:
+                while not self._stop.is_set():
+                    rows = await cursor.fetch(BROADCAST_PAGE)
+                    if not rows:
+                        finished = True
+                        break
+                    await self._page([r["user_id"] for r in rows])
+                    await self._report()
+                    if time.monotonic() - segment_started >= BROADCAST_SEGMENT_SECONDS:
+                        break  # отдаём соединение, следующий сегмент — с чекпоинта
+
+        self.b["status"] = "done" if finished else "paused"
+        await db.set_broadcast_status(broadcast_id, self.b["status"])
+        await self._report(force=True)
+        logger.info(
+            "Broadcast #%s %s: delivered %d, blocked %d, failed %d",
+            broadcast_id, self.b["status"], self.b["delivered"], self.b["blocked"], self.b["failed"],
+        )
+        if finished:
+            await safe_send_message(self.bot, self.b["admin_id"], format_progress(self.b))
+
+
+#  УПРАВЛЕНИЕ
+
+_current: Optional[Tuple[BroadcastRunner, asyncio.Task]] = None
+
+
+def running_broadcast_id() -> Optional[int]:
+    if _current is None or _current[1].done():
+        return None
+    return _current[0].b["id"]
+
+
+def start_broadcast(bot: Bot, broadcast: Dict) -> bool:
+    """Запустить рассылку; False — уже идёт другая."""
+    global _current
+    if running_broadcast_id() is not None:
+        return False
+    runner = BroadcastRunner(bot, broadcast)
+    task = supervisor.spawn(
+        _run_logged(runner), name=f"broadcast:{broadcast['id']}", kind="broadcast", critical=True
+    )
+    _current = (runner, task)
+    return True
+
+
+async def _run_logged(runner: BroadcastRunner) -> None:
+    try:
+        await runner.run()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Broadcast #%s crashed, will resume from checkpoint", runner.b["id"])
+        await safe_send_message(
+            runner.bot,
+            runner.b["admin_id"],
+            f"⚠️ Рассылка #{runner.b['id']} прервана ошибкой. "
+            f"Продолжить: /broadcast start {runner.b['id']}",
+        )
+
+
+async def pause_broadcast() -> Optional[int]:
+    """Остановить текущую рассылку после страницы; id или None."""
+    if _current is None or _current[1].done():
+        return None
+    runner, task = _current
+    runner.request_stop()
+    await asyncio.gather(task, return_exceptions=True)
+    return runner.b["id"]
+
+
+async def resume_broadcasts(bot: Bot) -> None:
+    """После рестарта продолжить рассылку, которая была в статусе running."""
+    for broadcast in await db.get_broadcasts(status="running", limit=1):
+        start_broadcast(bot, broadcast)
+
+
+def stop_broadcasts() -> None:
+    """При остановке бота: прервать рассылку (статус остаётся running — продолжится после старта)."""
+    if _current is not None and not _current[1].done():
+        _current[1].cancel()
@@ -0,0 +1,222 @@
+# bulk_grants.py
+"""
+Массовое начисление токенов из CSV (/grant_csv).
+
+1. Файл читается потоково (csv.reader поверх скачанного документа), строки
+   «user_id,amount» проверяются и сразу уходят в COPY
+   (asyncpg copy_records_to_table) — без построчных INSERT.
+2. Журнал token_grants и начисление в users — одним set-based запросом
+   в той же транзакции (database.apply_grant_batch). Id пакета — file_unique_id
+   документа: повторная загрузка того же файла ничего не начислит дважды.
+3. Уведомления рассылает фоновая задача: пачками по NOTIFY_CHUNK из
+   token_grants (notified_at IS NULL), через общий планировщик исходящих
+   (лимиты Telegram), не больше BULK_GRANT_NOTIFY_CONCURRENCY сообщений
+   в полёте — основная часть лимита остаётся живым пользователям.
+   Прогресс отмечается в БД, после рестарта рассылка продолжается
+   с того же места (resume_grant_notifiers).
+"""
+import asyncio
+import csv
+import io
+import logging
+from typing import Dict, Iterator, List, Tuple
+
+from aiogram import Bot
+
+from config import BULK_GRANT_MAX_AMOUNT, BULK_GRANT_NOTIFY_CONCURRENCY
+from database import db
+from stats import stats
+from supervisor import supervisor
+from utils import PRIORITY_LOW, safe_send_message
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHUNK = 200
+# Раз в сколько уведомлённых пользователей сообщать админу о прогрессе
+PROGRESS_EVERY = 5000
+
+# Сколько ошибок разбора показываем админу
+MAX_REPORTED_ERRORS = 10
+
+
+#  РАЗБОР CSV
+
+class GrantCsvReader:
+    """
+    Итератор (user_id, amount) по CSV-файлу. Плохие строки пропускаются
+    и собираются в errors (номер строки и причина) — COPY получает только
+    валидные записи. Заголовок («user_id,amount») и пустые строки допустимы,
+    разделитель — запятая или точка с запятой.
+    """
+
+    def __init__(self, data: io.BufferedIOBase, max_amount: int = BULK_GRANT_MAX_AMOUNT):
+        self.data = data
+        self.max_amount = max_amount
+        self.rows = 0
+        self.errors: List[Tuple[int, str]] = []
+        self.error_count = 0
+
+    def _error(self, line: int, reason: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        text = io.TextIOWrapper(self.data, encoding="utf-8-sig", newline="")
+        first = text.readline()
+        dialect = "excel-semicolon" if first.count(";") > first.count(",") else "excel"
+        lines = _chain_first(first, text)
+        for line_no, row in enumerate(csv.reader(lines, dialect=dialect), start=1):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if len(row) < 2:
+                self._error(line_no, "нужно два поля: user_id,amount")
+                continue
+            try:
+                user_id = int(row[0].strip())
+                amount = int(row[1].strip())
+            except ValueError:
+                if line_no == 1:
+                    continue  # заголовок
+                self._error(line_no, "не число")
+                continue
+            if user_id <= 0:
+                self._error(line_no, f"неверный user_id {user_id}")
+                continue
+            if not 0 < amount <= self.max_amount:
+                self._error(line_no, f"amount {amount} вне 1..{self.max_amount}")
+                continue
+            self.rows += 1
+            yield user_id, amount
+
+
+def _chain_first(first: str, rest: io.TextIOBase) -> Iterator[str]:
+    if first:
+        yield first
+    yield from rest
+
+
+class _SemicolonDialect(csv.excel):
+    delimiter = ";"
+
+
+csv.register_dialect("excel-semicolon", _SemicolonDialect)
+
+
+#  ПРИМЕНЕНИЕ
+
+async def apply_grant_csv(
+    bot: Bot, admin_id: int, batch_id: str, reason: str, data: io.BufferedIOBase
+) -> Tuple[Dict, GrantCsvReader]:
+    """Загрузить и применить файл; запустить рассылку уведомлений."""
+    reader = GrantCsvReader(data)
+    batch = await db.apply_grant_batch(batch_id, admin_id, reason, reader)
+    applied = batch["this_call"]
+    if applied["applied"]:
+        stats.record("tokens_granted", "admin_csv", total=applied["tokens"], count=applied["applied"])
+    logger.info(
+        "Bulk grant %s: %d rows, %d users credited (%d tokens), %d bad rows",
+        batch_id, reader.rows, applied["applied"], applied["tokens"], reader.error_count,
+    )
+    start_notifier(bot, batch_id, admin_id)
+    return batch, reader
+
+
+#  УВЕДОМЛЕНИЯ
+
+# batch_id → задача рассылки (одна на пакет)
+_notifiers: Dict[str, asyncio.Task] = {}
+
+
+def start_notifier(bot: Bot, batch_id: str, admin_id: int) -> None:
+    task = _notifiers.get(batch_id)
+    if task is not None and not task.done():
+        return
+    _notifiers[batch_id] = supervisor.spawn(
+        _notify_batch(bot, batch_id, admin_id),
+        name=f"grant-notify:{batch_id}",
+        kind="grant-notify",
+        critical=True,
+    )
+
+
+def notifier_running(batch_id: str) -> bool:
+    task = _notifiers.get(batch_id)
+    return task is not None and not task.done()
+
+
+async def _notify_batch(bot: Bot, batch_id: str, admin_id: int) -> None:
+    semaphore = asyncio.Semaphore(BULK_GRANT_NOTIFY_CONCURRENCY)
+    sent = failed = 0
+
+    async def notify(user_id: int, amount: int) -> bool:
+        async with semaphore:
+            return await safe_send_message(
+                bot,
+                user_id,
+                f"🎁 Вам начислено <b>{amount}</b> токенов администратором.",
+                parse_mode="HTML",
+                priority=PRIORITY_LOW,
+            )
+
+    try:
+        after = 0
+        while True:
+            chunk = await db.get_unnotified_grants(batch_id, after, NOTIFY_CHUNK)
+            if not chunk:
+                break
+            results = await asyncio.gather(*(notify(uid, amount) for uid, amount in chunk))
+            # заблокировавшим бота не пишем повторно — отмечаем всех
+            await db.mark_grants_notified(batch_id, [uid for uid, _ in chunk])
+            ok = sum(1 for r in results if r)
+            done_before = sent + failed
+            sent += ok
+            failed += len(chunk) - ok
+            after = chunk[-1][0]
+            if (sent + failed) // PROGRESS_EVERY > done_before // PROGRESS_EVERY:
+                await safe_send_message(
+                    bot,
+                    admin_id,
+                    f"⏳ Пакет <code>{batch_id}</code>: уведомлено {sent + failed}…",
+                    parse_mode="HTML",
+                    priority=PRIORITY_LOW,
+                )
+
+        await db.finish_grant_batch(batch_id)
+        logger.info("Bulk grant %s: notifications done, sent %s, failed %s", batch_id, sent, failed)
+        await safe_send_message(
+            bot,
+            admin_id,
+            f"✅ Пакет <code>{batch_id}</code>: уведомления разосланы "
+            f"({sent} доставлено, {failed} не доставлено).",
+            parse_mode="HTML",
+        )
+    except asyncio.CancelledError:
+        logger.info("Bulk grant %s: notifier stopped after %s, will resume", batch_id, sent + failed)
+        raise
+    except Exception:
+        logger.exception("Bulk grant %s: notifier failed after %s", batch_id, sent + failed)
+        await safe_send_message(
+            bot,
+            admin_id,
+            f"⚠️ Пакет <code>{batch_id}</code>: рассылка прервана ошибкой. "
+            f"Повторите /grant_csv resume.",
+            parse_mode="HTML",
+        )
+    finally:
+        _notifiers.pop(batch_id, None)
+
+
+async def resume_grant_notifiers(bot: Bot) -> int:
+    """Продолжить рассылки, прерванные рестартом. Возвращает число пакетов."""
+    batches = await db.get_grant_batches(unfinished_only=True, limit=100)
+    for batch in batches:
+        start_notifier(bot, batch["batch_id"], batch["admin_id"])
+    if batches:
+        logger.info("Resumed %s bulk grant notifier(s)", len(batches))
+    return len(batches)
+
+
+def stop_grant_notifiers() -> None:
+    for task in list(_notifiers.values()):
+        task.cancel()
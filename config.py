@@ -4,24 +4,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Обязательные переменные: при старте сообщаем обо всех недостающих сразу,
+# а не по одной за перезапуск
+_missing = []
 
-TOKEN = os.getenv("TOKEN")
-if not TOKEN:
-    raise RuntimeError("TOKEN is not set in .env")
+
+def _required_env(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        _missing.append(name)
+    return value
+
+
+TOKEN = _required_env("TOKEN")
 
 BOT_TOKEN = TOKEN
 
 
 #  DATABASE
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL is not set in .env")
+DATABASE_URL = _required_env("DATABASE_URL")
 
 
 #  KIE API (Sora 2 + Veo 3.1)
-KIE_API_KEY = os.getenv("KIE_API_KEY")
-if not KIE_API_KEY:
-    raise RuntimeError("KIE_API_KEY is not set in .env")
+KIE_API_KEY = _required_env("KIE_API_KEY")
+
+if _missing:
+    raise RuntimeError(f"Not set in .env: {', '.join(_missing)}")
 
 # Базовый хост
 KIE_API_BASE = os.getenv("KIE_API_BASE", "https://api.kie.ai")
@@ -32,7 +40,7 @@ JOBS_STATUS = os.getenv("JOBS_STATUS", f"{KIE_API_BASE}/api/v1/jobs/recordInfo")
 
 # Эндпоинт Veo 3.1
 VEO_URL = os.getenv("VEO_URL", f"{KIE_API_BASE}/api/v1/veo/generate")
-VEO_STATUS = "https://api.kie.ai/api/v1/veo/record-info"
+VEO_STATUS = os.getenv("VEO_STATUS", f"{KIE_API_BASE}/api/v1/veo/record-info")
 
 CHANNEL_ID_RAW = os.getenv("CHANNEL_ID", "0")
 try:
@@ -48,6 +56,8 @@ CHANNEL_URL = os.getenv("CHANNEL_URL", "")
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
 YOOKASSA_RETURN_URL = os.getenv("YOOKASSA_RETURN_URL")
+# Можно направить на локальный стенд вместо боевого API
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
 
 
 def _int_env(name: str, default: int) -> int:
@@ -78,6 +88,123 @@ VEO_FAST_COST    = _int_env("VEO_FAST_COST", 60)
 VEO_QUALITY_COST = _int_env("VEO_QUALITY_COST", 250)
 
 
+#  ЛИМИТЫ ИСХОДЯЩИХ ЗАПРОСОВ В TELEGRAM
+
+# Глобально — не больше ~30 сообщений/с на бота, берём с запасом
+TG_GLOBAL_RATE = _int_env("TG_GLOBAL_RATE", 25)
+# В личный чат — ~1 сообщение/с (короткий всплеск допустим)
+TG_CHAT_RATE = _int_env("TG_CHAT_RATE", 1)
+TG_CHAT_BURST = _int_env("TG_CHAT_BURST", 3)
+# В группы/каналы — 20 сообщений/мин
+TG_GROUP_PER_MINUTE = _int_env("TG_GROUP_PER_MINUTE", 20)
+# Сколько секунд пытаемся доставить сообщение, прежде чем сдаться
+TG_SEND_DEADLINE = _int_env("TG_SEND_DEADLINE", 120)
+
+
+#  ВСТРОЕННЫЙ HTTP-СЕРВЕР (вебхуки YooKassa и т.п.), 0 — выключен
+
+WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+WEB_SERVER_PORT = _int_env("WEB_SERVER_PORT", 0)
+YOOKASSA_WEBHOOK_PATH = os.getenv("YOOKASSA_WEBHOOK_PATH", "/yookassa/webhook")
+# Prometheus scrape (пусто — не публиковать)
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# Служебное API (GET {ADMIN_API_PATH}/tasks и т.п.) с заголовком
+# «Authorization: Bearer <ADMIN_API_TOKEN>»; токен не задан — API выключено
+ADMIN_API_PATH = os.getenv("ADMIN_API_PATH", "/admin/api")
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+# Страховочная сверка RUB-платежей, если вебхук не дошёл (секунды)
+RUB_RECONCILE_INTERVAL = _int_env("RUB_RECONCILE_INTERVAL", 300)
+RUB_RECONCILE_MIN_AGE = _int_env("RUB_RECONCILE_MIN_AGE", 120)
+# Список YooKassa смотрим только за это окно; pending старше него
+# перечитываются по id, не больше RUB_RECONCILE_STALE_BATCH за проход
+RUB_RECONCILE_WINDOW = _int_env("RUB_RECONCILE_WINDOW", 2 * 3600)
+RUB_RECONCILE_STALE_BATCH = _int_env("RUB_RECONCILE_STALE_BATCH", 50)
+
+
+#  ОТСЛЕЖИВАЕМЫЕ СООБЩЕНИЯ (инвойсы Stars и кнопка «Назад» под ними)
+
+# Telegram даёт боту удалять сообщения только 48 часов — дольше хранить незачем
+TRACKED_MESSAGE_TTL = _int_env("TRACKED_MESSAGE_TTL", 48 * 3600)
+TRACKED_MESSAGE_MAX_ROWS = _int_env("TRACKED_MESSAGE_MAX_ROWS", 100_000)
+
+
+#  HTTP-КЛИЕНТ (общий пул соединений aiohttp)
+
+HTTP_POOL_LIMIT = _int_env("HTTP_POOL_LIMIT", 100)
+HTTP_TIMEOUT = _int_env("HTTP_TIMEOUT", 60)
+
+
+#  КЭШ ПРОВЕРКИ ПОДПИСКИ (секунды)
+
+SUB_CACHE_POSITIVE_TTL = _int_env("SUB_CACHE_POSITIVE_TTL", 600)
+SUB_CACHE_NEGATIVE_TTL = _int_env("SUB_CACHE_NEGATIVE_TTL", 30)
+
+
+# JSON с ценами (секции generation / star_packs / rub_packs), перечитывается
+# по SIGHUP или /reload_prices. Не задан — цены из переменных выше.
+PRICING_FILE = os.getenv("PRICING_FILE", "")
+
+# Предпроверка промптов: JSON {"reject": [...], "warn": [...]}, перечитывается
+# по SIGHUP или /prescreen reload; со скольких отказов KIE слово становится warn
+PROMPT_TERMS_FILE = os.getenv("PROMPT_TERMS_FILE", "")
+PRESCREEN_LEARN_MIN_REJECTIONS = _int_env("PRESCREEN_LEARN_MIN_REJECTIONS", 3)
+
+# Трассировка генераций: JSON Lines (пусто — только память) и сколько трасс держать в памяти
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_MAX_TRACES = _int_env("TRACE_MAX_TRACES", 2000)
+# Файл трасс больше TRACE_FILE_MAX_BYTES уходит в TRACE_FILE.1 (хранится
+# TRACE_FILE_BACKUPS старых файлов); 0 — без ротации
+TRACE_FILE_MAX_BYTES = _int_env("TRACE_FILE_MAX_BYTES", 50 * 1024 * 1024)
+TRACE_FILE_BACKUPS = _int_env("TRACE_FILE_BACKUPS", 3)
+
+# Логи: JSON-строки вместо текста, размер очереди до потока записи,
+# не больше LOG_RATE_BURST одинаковых предупреждений/ошибок за LOG_RATE_INTERVAL секунд
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
+LOG_QUEUE_SIZE = _int_env("LOG_QUEUE_SIZE", 10000)
+LOG_RATE_BURST = _int_env("LOG_RATE_BURST", 5)
+LOG_RATE_INTERVAL = _int_env("LOG_RATE_INTERVAL", 60)
+
+# Монитор event loop: период пульса (0 — выключен) и порог «медленного» колбэка, мс
+LOOP_MONITOR_INTERVAL_MS = _int_env("LOOP_MONITOR_INTERVAL_MS", 100)
+SLOW_CALLBACK_MS = _int_env("SLOW_CALLBACK_MS", 50)
+
+# Профайлер по /profile: период сэмплирования (мс), потолок длительности (с),
+# стеки asyncio-задач — каждый PROFILE_TASK_EVERY-й замер (0 — без задач)
+PROFILE_INTERVAL_MS = _int_env("PROFILE_INTERVAL_MS", 5)
+PROFILE_MAX_SECONDS = _int_env("PROFILE_MAX_SECONDS", 120)
+PROFILE_TASK_EVERY = _int_env("PROFILE_TASK_EVERY", 10)
+
+# Сколько кадров стека хранит tracemalloc для /mem (больше — точнее и дороже)
+MEM_TRACE_FRAMES = _int_env("MEM_TRACE_FRAMES", 5)
+
+# Как часто накопленная статистика (/stats) пишется в stats_hourly, секунды
+STATS_FLUSH_INTERVAL = _int_env("STATS_FLUSH_INTERVAL", 10)
+
+# /grant_csv: потолок начисления на одного пользователя (защита от опечаток)
+# и сколько уведомлений держим в полёте одновременно
+BULK_GRANT_MAX_AMOUNT = _int_env("BULK_GRANT_MAX_AMOUNT", 1000)
+BULK_GRANT_NOTIFY_CONCURRENCY = _int_env("BULK_GRANT_NOTIFY_CONCURRENCY", 20)
+
+# /broadcast: сообщений в секунду (меньше TG_GLOBAL_RATE — остальное живым пользователям),
+# id на страницу курсора, сколько секунд держим курсор открытым,
+# как часто обновляем сообщение с прогрессом
+BROADCAST_RATE = _int_env("BROADCAST_RATE", 15)
+BROADCAST_PAGE = _int_env("BROADCAST_PAGE", 100)
+BROADCAST_SEGMENT_SECONDS = _int_env("BROADCAST_SEGMENT_SECONDS", 60)
+BROADCAST_PROGRESS_INTERVAL = _int_env("BROADCAST_PROGRESS_INTERVAL", 5)
+
+# Фоновые задачи (supervisor.py): потолок одновременных (опросы KIE и т.п.,
+# сверх него новые генерации не принимаются) и сколько секунд ждём их остановки
+BACKGROUND_TASK_LIMIT = _int_env("BACKGROUND_TASK_LIMIT", 1000)
+BACKGROUND_SHUTDOWN_TIMEOUT = _int_env("BACKGROUND_SHUTDOWN_TIMEOUT", 10)
+
+# Остановка: сколько секунд ждём хендлеры, которые уже выполняются,
+# и исходящие сообщения в очереди планировщика
+SHUTDOWN_HANDLERS_TIMEOUT = _int_env("SHUTDOWN_HANDLERS_TIMEOUT", 20)
+SHUTDOWN_OUTBOUND_TIMEOUT = _int_env("SHUTDOWN_OUTBOUND_TIMEOUT", 10)
+
+
 _admin_ids_raw = os.getenv("ADMIN_IDS", "")
 ADMIN_IDS = {683135069}
 if _admin_ids_raw.strip():
@@ -1,10 +1,31 @@
 import asyncpg
 import os
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Iterable, List, Tuple, AsyncIterator
+
+from metrics import DB_POOL_ACQUIRE_SECONDS, function_gauge
 
 load_dotenv()
 
+
+def current_hour() -> datetime:
+    """Начало текущего часа (UTC) — ключ строки в stats_hourly"""
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+# Пачка приращений для stats_hourly: одной строкой на (hour, name, label)
+_BUMP_STATS_SQL = """
+    INSERT INTO stats_hourly (hour, name, label, count, total)
+    SELECT * FROM unnest($1::timestamptz[], $2::text[], $3::text[], $4::bigint[], $5::float8[])
+    ON CONFLICT (hour, name, label) DO UPDATE
+    SET count = stats_hourly.count + EXCLUDED.count,
+        total = stats_hourly.total + EXCLUDED.total
+"""
+
+
 class Database:
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
@@ -29,10 +50,18 @@ class Database:
         """Закрытие соединения с базой данных"""
         if self.pool:
             await self.pool.close()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        """Соединение из пула; время ожидания пишется в метрики"""
+        started = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            DB_POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - started)
+            yield conn
     
     async def create_tables(self):
         """Создание таблиц в базе данных"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             # Таблица пользователей
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -40,10 +69,145 @@ class Database:
                     generations_left INTEGER DEFAULT 0
                 )
             """)
+
+            # Пользователь заблокировал бота (рассылки его пропускают)
+            await conn.execute("""
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMPTZ
+            """)
+
+            # Рублёвые платежи YooKassa: пишем при создании,
+            # начисляем ровно один раз по вебхуку или сверке
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS rub_payments (
+                    payment_id TEXT PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    rubles INTEGER NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    credited_at TIMESTAMPTZ
+                )
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS rub_payments_pending_idx
+                ON rub_payments (created_at) WHERE status = 'pending'
+            """)
+            # created_at платежа по часам YooKassa (наш created_at всегда позже)
+            await conn.execute("""
+                ALTER TABLE rub_payments ADD COLUMN IF NOT EXISTS provider_created_at TIMESTAMPTZ
+            """)
+
+            # Служебные сообщения, которые надо будет удалить (инвойс Stars и т.п.)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS tracked_messages (
+                    user_id BIGINT NOT NULL,
+                    kind TEXT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    expires_at TIMESTAMPTZ NOT NULL,
+                    PRIMARY KEY (user_id, kind)
+                )
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS tracked_messages_expires_idx
+                ON tracked_messages (expires_at)
+            """)
+
+            # Массовые начисления (/grant_csv): пакет = загруженный файл,
+            # token_grants — по строке на пользователя (журнал начислений
+            # и очередь уведомлений: notified_at IS NULL — ещё не уведомлён)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS grant_batches (
+                    batch_id TEXT PRIMARY KEY,
+                    admin_id BIGINT NOT NULL,
+                    reason TEXT NOT NULL DEFAULT '',
+                    users_total INTEGER NOT NULL DEFAULT 0,
+                    granted INTEGER NOT NULL DEFAULT 0,
+                    tokens BIGINT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    notified_at TIMESTAMPTZ
+                )
+            """)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_grants (
+                    batch_id TEXT NOT NULL REFERENCES grant_batches (batch_id),
+                    user_id BIGINT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    granted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    notified_at TIMESTAMPTZ,
+                    PRIMARY KEY (batch_id, user_id)
+                )
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS token_grants_unnotified_idx
+                ON token_grants (batch_id, user_id) WHERE notified_at IS NULL
+            """)
+
+            # Рассылки (/broadcast): что копируем, курсор по user_id и счётчики.
+            # last_user_id — чекпоинт: после рестарта продолжаем с него
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id BIGSERIAL PRIMARY KEY,
+                    admin_id BIGINT NOT NULL,
+                    from_chat_id BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'draft',
+                    last_user_id BIGINT NOT NULL DEFAULT 0,
+                    delivered INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    progress_chat_id BIGINT,
+                    progress_message_id BIGINT,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    finished_at TIMESTAMPTZ
+                )
+            """)
+
+            # Почасовые агрегаты для /stats: (час, что считаем, разрез) → сколько раз и сумма.
+            # Пишутся инкрементально, /stats читает сотни строк, а не всю историю
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS stats_hourly (
+                    hour TIMESTAMPTZ NOT NULL,
+                    name TEXT NOT NULL,
+                    label TEXT NOT NULL DEFAULT '',
+                    count BIGINT NOT NULL DEFAULT 0,
+                    total DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    PRIMARY KEY (hour, name, label)
+                )
+            """)
+
+            # Предпроверка промптов (prescreen.py): термины от админа и выученные
+            # по отказам KIE, и статистика слов промптов для обучения
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS prescreen_terms (
+                    term TEXT PRIMARY KEY,
+                    action TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS prompt_words (
+                    word TEXT PRIMARY KEY,
+                    seen INTEGER NOT NULL DEFAULT 0,
+                    rejected INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+            # Фоновые задачи, прерванные остановкой бота (supervisor.py):
+            # kind + аргументы в JSON, после старта запускаются заново
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS background_tasks (
+                    name TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    saved_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
     
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получение пользователя по ID"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 "SELECT * FROM users WHERE user_id = $1", user_id
             )
@@ -51,7 +215,7 @@ class Database:
     
     async def create_user(self, user_id: int) -> Dict[str, Any]:
         """Создание нового пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow("""
                 INSERT INTO users (user_id)
                 VALUES ($1)
@@ -61,7 +225,7 @@ class Database:
     
     async def update_user_generations(self, user_id: int, generations_left: int):
         """Обновление количества генераций пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE users SET generations_left = $1 WHERE user_id = $2",
                 generations_left, user_id
@@ -69,7 +233,7 @@ class Database:
     
     async def add_generations(self, user_id: int, amount: int):
         """Добавление генераций к балансу пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(
                 "UPDATE users SET generations_left = generations_left + $1 WHERE user_id = $2",
                 amount, user_id
@@ -77,7 +241,7 @@ class Database:
     
     async def use_generation(self, user_id: int) -> bool:
         """Использование одной генерации. Возвращает True если успешно, False если недостаточно генераций"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             # Проверяем есть ли генерации
             user = await conn.fetchrow(
                 "SELECT generations_left FROM users WHERE user_id = $1", user_id
@@ -96,11 +260,501 @@ class Database:
     
     async def has_generations(self, user_id: int) -> bool:
         """Проверка есть ли у пользователя доступные генерации"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             user = await conn.fetchrow(
                 "SELECT generations_left FROM users WHERE user_id = $1", user_id
             )
             return user and user['generations_left'] > 0
 
+
+    # RUB-платежи (YooKassa)
+
+    async def create_rub_payment(
+        self,
+        payment_id: str,
+        user_id: int,
+        rubles: int,
+        tokens: int,
+        provider_created_at: Optional[datetime] = None,
+    ):
+        """Запись о созданном платеже (статус pending)"""
+        async with self.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO rub_payments (payment_id, user_id, rubles, tokens, provider_created_at)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (payment_id) DO NOTHING
+            """, payment_id, user_id, rubles, tokens, provider_created_at)
+
+    async def settle_rub_payment(self, payment_id: str, status: str) -> Optional[Dict[str, Any]]:
+        """
+        Перевод платежа из pending в итоговый статус.
+        Для succeeded в той же транзакции начисляет токены.
+        Возвращает строку платежа, если статус изменён этим вызовом,
+        и None, если платёж неизвестен или уже был обработан (идемпотентно).
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow("""
+                    UPDATE rub_payments
+                    SET status = $2,
+                        updated_at = now(),
+                        credited_at = CASE WHEN $2 = 'succeeded' THEN now() END
+                    WHERE payment_id = $1 AND status = 'pending'
+                    RETURNING *
+                """, payment_id, status)
+                if not row:
+                    return None
+                if status == "succeeded":
+                    await conn.execute(
+                        "UPDATE users SET generations_left = generations_left + $1 WHERE user_id = $2",
+                        row["tokens"], row["user_id"]
+                    )
+                    # выручка — в той же транзакции, что и начисление
+                    hour = current_hour()
+                    await conn.execute(
+                        _BUMP_STATS_SQL,
+                        [hour, hour], ["revenue", "tokens_sold"], ["rub", "rub"],
+                        [1, 1], [float(row["rubles"]), float(row["tokens"])],
+                    )
+                return dict(row)
+
+    async def settle_rub_payments_batch(self, updates: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Пакетный вариант settle_rub_payment: [(payment_id, status), ...].
+        Смена статусов и начисление токенов — одной транзакцией на весь пакет.
+        Возвращает только строки, статус которых изменён этим вызовом.
+        """
+        if not updates:
+            return []
+        ids = [u[0] for u in updates]
+        statuses = [u[1] for u in updates]
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch("""
+                    WITH changed AS (
+                        UPDATE rub_payments p
+                        SET status = u.status,
+                            updated_at = now(),
+                            credited_at = CASE WHEN u.status = 'succeeded' THEN now() END
+                        FROM unnest($1::text[], $2::text[]) AS u(payment_id, status)
+                        WHERE p.payment_id = u.payment_id AND p.status = 'pending'
+                        RETURNING p.*
+                    ), credited AS (
+                        UPDATE users
+                        SET generations_left = users.generations_left + c.tokens
+                        FROM (
+                            SELECT user_id, SUM(tokens) AS tokens
+                            FROM changed
+                            WHERE status = 'succeeded'
+                            GROUP BY user_id
+                        ) c
+                        WHERE users.user_id = c.user_id
+                    ), stats AS (
+                        INSERT INTO stats_hourly (hour, name, label, count, total)
+                        SELECT $3, s.name, 'rub', count(*), sum(s.value)
+                        FROM changed
+                        CROSS JOIN LATERAL (VALUES
+                            ('revenue', changed.rubles), ('tokens_sold', changed.tokens)
+                        ) AS s(name, value)
+                        WHERE changed.status = 'succeeded'
+                        GROUP BY s.name
+                        ON CONFLICT (hour, name, label) DO UPDATE
+                        SET count = stats_hourly.count + EXCLUDED.count,
+                            total = stats_hourly.total + EXCLUDED.total
+                    )
+                    SELECT * FROM changed
+                """, ids, statuses, current_hour())
+                return [dict(r) for r in rows]
+
+    async def get_oldest_pending_rub_payment(
+        self,
+        older_than_seconds: int,
+        window_seconds: int,
+    ) -> Optional[datetime]:
+        """
+        Время создания (по часам YooKassa, если известно) самого старого платежа,
+        который висит в pending дольше older_than_seconds, но не старше window_seconds.
+        Нижняя граница («курсор») для списка платежей при сверке.
+        """
+        async with self.acquire() as conn:
+            return await conn.fetchval("""
+                SELECT min(COALESCE(provider_created_at, created_at)) FROM rub_payments
+                WHERE status = 'pending'
+                  AND created_at < now() - make_interval(secs => $1)
+                  AND created_at >= now() - make_interval(secs => $2)
+            """, older_than_seconds, window_seconds)
+
+    async def get_stale_pending_rub_payments(self, older_than_seconds: int, limit: int) -> List[str]:
+        """
+        payment_id платежей, которые висят в pending дольше older_than_seconds
+        (за окном списка). Сначала те, что дольше всех не проверялись.
+        """
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT payment_id FROM rub_payments
+                WHERE status = 'pending'
+                  AND created_at < now() - make_interval(secs => $1)
+                ORDER BY updated_at
+                LIMIT $2
+            """, older_than_seconds, limit)
+            return [r["payment_id"] for r in rows]
+
+    async def touch_rub_payments(self, payment_ids: List[str]) -> None:
+        """Отметить, что pending-платежи проверены (в очередь проверки — последними)."""
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE rub_payments SET updated_at = now()
+                WHERE payment_id = ANY($1::text[]) AND status = 'pending'
+            """, payment_ids)
+
+    # Отслеживаемые сообщения (ключ: user_id + kind)
+
+    async def put_tracked_message(self, user_id: int, kind: str, message_id: int, ttl_seconds: int):
+        """Запомнить message_id (перезаписывает прежний того же вида)"""
+        async with self.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO tracked_messages (user_id, kind, message_id, expires_at)
+                VALUES ($1, $2, $3, now() + make_interval(secs => $4))
+                ON CONFLICT (user_id, kind) DO UPDATE
+                SET message_id = EXCLUDED.message_id, expires_at = EXCLUDED.expires_at
+            """, user_id, kind, message_id, ttl_seconds)
+
+    async def pop_tracked_messages(self, user_id: int, kinds: List[str]) -> Dict[str, int]:
+        """Забрать и удалить сообщения указанных видов (просроченные не возвращаются)"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                DELETE FROM tracked_messages
+                WHERE user_id = $1 AND kind = ANY($2::text[])
+                RETURNING kind, message_id, expires_at > now() AS alive
+            """, user_id, kinds)
+            return {r["kind"]: r["message_id"] for r in rows if r["alive"]}
+
+    async def prune_tracked_messages(self, max_rows: int) -> None:
+        """Удалить просроченные записи и всё, что сверх max_rows (самые старые)"""
+        async with self.acquire() as conn:
+            await conn.execute("DELETE FROM tracked_messages WHERE expires_at < now()")
+            await conn.execute("""
+                DELETE FROM tracked_messages
+                WHERE ctid IN (
+                    SELECT ctid FROM tracked_messages
+                    ORDER BY expires_at DESC
+                    OFFSET $1
+                )
+            """, max_rows)
+
+    # Массовые начисления (/grant_csv)
+
+    async def apply_grant_batch(
+        self,
+        batch_id: str,
+        admin_id: int,
+        reason: str,
+        records: Iterable[Tuple[int, int]],
+    ) -> Dict[str, Any]:
+        """
+        Одной транзакцией: COPY строк (user_id, amount) во временную таблицу,
+        журнал token_grants и начисление в users одним UPDATE.
+        Повтор того же batch_id ничего не начислит второй раз (ON CONFLICT).
+        Неизвестные user_id пропускаются. Возвращает строку grant_batches
+        и число строк этого вызова: rows, users, applied, tokens.
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                    CREATE TEMP TABLE grant_upload (
+                        user_id BIGINT NOT NULL,
+                        amount INTEGER NOT NULL
+                    ) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table(
+                    "grant_upload", records=records, columns=["user_id", "amount"]
+                )
+                await conn.execute("""
+                    INSERT INTO grant_batches (batch_id, admin_id, reason)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (batch_id) DO NOTHING
+                """, batch_id, admin_id, reason)
+                row = await conn.fetchrow("""
+                    WITH agg AS (
+                        SELECT user_id, SUM(amount)::int AS amount
+                        FROM grant_upload
+                        GROUP BY user_id
+                    ), inserted AS (
+                        INSERT INTO token_grants (batch_id, user_id, amount)
+                        SELECT $1, agg.user_id, agg.amount
+                        FROM agg JOIN users USING (user_id)
+                        ON CONFLICT (batch_id, user_id) DO NOTHING
+                        RETURNING user_id, amount
+                    ), credited AS (
+                        UPDATE users
+                        SET generations_left = users.generations_left + inserted.amount
+                        FROM inserted
+                        WHERE users.user_id = inserted.user_id
+                    )
+                    SELECT
+                        (SELECT count(*) FROM grant_upload) AS rows,
+                        (SELECT count(*) FROM agg) AS users,
+                        (SELECT count(*) FROM inserted) AS applied,
+                        (SELECT COALESCE(SUM(amount), 0) FROM inserted) AS tokens
+                """, batch_id)
+                batch = await conn.fetchrow("""
+                    UPDATE grant_batches
+                    SET users_total = GREATEST(users_total, $2),
+                        granted = granted + $3,
+                        tokens = tokens + $4
+                    WHERE batch_id = $1
+                    RETURNING *
+                """, batch_id, row["users"], row["applied"], row["tokens"])
+                return {**dict(batch), "this_call": dict(row)}
+
+    async def get_unnotified_grants(
+        self, batch_id: str, after_user_id: int, limit: int
+    ) -> List[Tuple[int, int]]:
+        """Следующие (user_id, amount) пакета без уведомления, по возрастанию user_id"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id, amount FROM token_grants
+                WHERE batch_id = $1 AND notified_at IS NULL AND user_id > $2
+                ORDER BY user_id
+                LIMIT $3
+            """, batch_id, after_user_id, limit)
+            return [(r["user_id"], r["amount"]) for r in rows]
+
+    async def mark_grants_notified(self, batch_id: str, user_ids: List[int]) -> None:
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE token_grants SET notified_at = now()
+                WHERE batch_id = $1 AND user_id = ANY($2::bigint[])
+            """, batch_id, user_ids)
+
+    async def finish_grant_batch(self, batch_id: str) -> None:
+        async with self.acquire() as conn:
+            await conn.execute(
+                "UPDATE grant_batches SET notified_at = now() WHERE batch_id = $1", batch_id
+            )
+
+    async def get_grant_batches(self, unfinished_only: bool = False, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Последние пакеты с числом ещё не уведомлённых пользователей.
+        unfinished_only — только те, где уведомления не дошли до конца (для возобновления).
+        """
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT b.*,
+                    (SELECT count(*) FROM token_grants g
+                     WHERE g.batch_id = b.batch_id AND g.notified_at IS NULL) AS pending
+                FROM grant_batches b
+                WHERE NOT $1 OR b.notified_at IS NULL
+                ORDER BY b.created_at DESC
+                LIMIT $2
+            """, unfinished_only, limit)
+            return [dict(r) for r in rows]
+
+    # Блокировка бота пользователем
+
+    async def set_user_blocked(self, user_id: int, blocked: bool) -> None:
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE users
+                SET blocked_at = CASE WHEN $2 THEN COALESCE(blocked_at, now()) END
+                WHERE user_id = $1
+            """, user_id, blocked)
+
+    # Рассылки (/broadcast)
+
+    async def create_broadcast(self, admin_id: int, from_chat_id: int, message_id: int) -> Dict[str, Any]:
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("""
+                INSERT INTO broadcasts (admin_id, from_chat_id, message_id)
+                VALUES ($1, $2, $3)
+                RETURNING *
+            """, admin_id, from_chat_id, message_id)
+            return dict(row)
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", broadcast_id)
+            return dict(row) if row else None
+
+    async def get_broadcasts(self, status: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT * FROM broadcasts
+                WHERE $1::text IS NULL OR status = $1
+                ORDER BY id DESC
+                LIMIT $2
+            """, status, limit)
+            return [dict(r) for r in rows]
+
+    async def set_broadcast_status(
+        self,
+        broadcast_id: int,
+        status: str,
+        progress_chat_id: Optional[int] = None,
+        progress_message_id: Optional[int] = None,
+    ) -> None:
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE broadcasts
+                SET status = $2,
+                    finished_at = CASE WHEN $2 IN ('done', 'cancelled') THEN now() END,
+                    progress_chat_id = COALESCE($3, progress_chat_id),
+                    progress_message_id = COALESCE($4, progress_message_id)
+                WHERE id = $1
+            """, broadcast_id, status, progress_chat_id, progress_message_id)
+
+    async def checkpoint_broadcast(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        delivered: int,
+        failed: int,
+        blocked_ids: List[int],
+    ) -> None:
+        """
+        Сдвинуть чекпоинт рассылки и прибавить счётчики страницы одной транзакцией;
+        заблокировавшие бота помечаются в users (следующие рассылки их пропустят).
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                    UPDATE broadcasts
+                    SET last_user_id = $2,
+                        delivered = delivered + $3,
+                        failed = failed + $4,
+                        blocked = blocked + $5
+                    WHERE id = $1
+                """, broadcast_id, last_user_id, delivered, failed, len(blocked_ids))
+                if blocked_ids:
+                    await conn.execute("""
+                        UPDATE users SET blocked_at = now()
+                        WHERE user_id = ANY($1::bigint[]) AND blocked_at IS NULL
+                    """, blocked_ids)
+
+    async def count_broadcast_recipients(self) -> int:
+        async with self.acquire() as conn:
+            return await conn.fetchval("SELECT count(*) FROM users WHERE blocked_at IS NULL")
+
+    @asynccontextmanager
+    async def broadcast_recipients(self, after_user_id: int) -> AsyncIterator[Any]:
+        """
+        Серверный курсор по получателям рассылки (user_id > after_user_id,
+        не заблокировавшие бота) — id читаются страницами через cursor.fetch(n),
+        в память целиком не попадают. Соединение занято, пока открыт блок:
+        держите его недолго и открывайте заново с чекпоинта.
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor("""
+                    SELECT user_id FROM users
+                    WHERE user_id > $1 AND blocked_at IS NULL
+                    ORDER BY user_id
+                """, after_user_id)
+                yield cursor
+
+    # Почасовые агрегаты (/stats)
+
+    async def bump_stats(self, rows: List[Tuple[datetime, str, str, int, float]]) -> None:
+        """Прибавить к stats_hourly пачку (hour, name, label, count, total) одним запросом"""
+        if not rows:
+            return
+        async with self.acquire() as conn:
+            await conn.execute(_BUMP_STATS_SQL, *(list(col) for col in zip(*rows)))
+
+    async def get_stats(self, since: List[datetime]) -> List[Dict[str, Any]]:
+        """
+        Суммы по (name, label) для нескольких окон сразу:
+        count_0/total_0 — с since[0], count_1/total_1 — с since[1], …
+        Читает только строки начиная с самого раннего окна (по первичному ключу).
+        """
+        columns = ",\n".join(
+            f"COALESCE(sum(count) FILTER (WHERE hour >= ${i + 1}), 0) AS count_{i}, "
+            f"COALESCE(sum(total) FILTER (WHERE hour >= ${i + 1}), 0) AS total_{i}"
+            for i in range(len(since))
+        )
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT name, label,
+                {columns}
+                FROM stats_hourly
+                WHERE hour >= ${len(since) + 1}
+                GROUP BY name, label
+            """, *since, min(since))
+            return [dict(r) for r in rows]
+
+    # Предпроверка промптов
+
+    async def get_prescreen_terms(self) -> List[Dict[str, Any]]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT term, action, source FROM prescreen_terms")
+            return [dict(r) for r in rows]
+
+    async def set_prescreen_term(self, term: str, action: str, source: str) -> None:
+        async with self.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO prescreen_terms (term, action, source)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (term) DO UPDATE
+                SET action = EXCLUDED.action, source = EXCLUDED.source, created_at = now()
+            """, term, action, source)
+
+    async def observe_prompt_words(self, words: List[str], rejected: bool, min_rejected: int) -> List[str]:
+        """
+        Учесть слова промпта одним запросом; при отказе вернуть слова,
+        которые только что стали терминами warn (отказов ≥ min_rejected
+        и не меньше половины появлений). Уже известные термины не трогаются.
+        """
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                WITH bumped AS (
+                    INSERT INTO prompt_words (word, seen, rejected)
+                    SELECT w, 1, $2::int FROM unnest($1::text[]) AS w
+                    ON CONFLICT (word) DO UPDATE
+                    SET seen = prompt_words.seen + 1,
+                        rejected = prompt_words.rejected + EXCLUDED.rejected
+                    RETURNING word, seen, rejected
+                )
+                INSERT INTO prescreen_terms (term, action, source)
+                SELECT word, 'warn', 'kie' FROM bumped
+                WHERE $2::int = 1 AND rejected >= $3 AND rejected * 2 >= seen
+                ON CONFLICT (term) DO NOTHING
+                RETURNING term
+            """, words, int(rejected), min_rejected)
+            return [r["term"] for r in rows]
+
+    # Фоновые задачи между рестартами
+
+    async def save_background_tasks(self, rows: List[Tuple[str, str, str]]) -> None:
+        """(name, kind, payload JSON) — перезаписывает одноимённые"""
+        if not rows:
+            return
+        async with self.acquire() as conn:
+            await conn.executemany("""
+                INSERT INTO background_tasks (name, kind, payload)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (name) DO UPDATE
+                SET kind = EXCLUDED.kind, payload = EXCLUDED.payload, saved_at = now()
+            """, rows)
+
+    async def take_background_tasks(self) -> List[Dict[str, Any]]:
+        """Забрать (и удалить) все сохранённые задачи"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                DELETE FROM background_tasks
+                RETURNING name, kind, payload, saved_at
+            """)
+            return [dict(r) for r in rows]
+
 # Глобальный экземпляр базы данных
 db = Database()
+
+function_gauge(
+    "bot_db_pool_size",
+    "Open asyncpg pool connections",
+    lambda: db.pool.get_size() if db.pool else None,
+)
+function_gauge(
+    "bot_db_pool_idle",
+    "Idle asyncpg pool connections",
+    lambda: db.pool.get_idle_size() if db.pool else None,
+)
@@ -0,0 +1,76 @@
+# delivery.py
+import logging
+from typing import Iterable
+
+from aiogram import Bot
+
+from keyboards import main_menu_keyboard
+from tracing import traced
+from utils import (
+    safe_send_message,
+    safe_send_video,
+    PRIORITY_CRITICAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Лимит длины подписи к медиа в Telegram
+CAPTION_LIMIT = 1024
+
+
+def compose_caption(title: str, details: Iterable[str] = ()) -> str:
+    """
+    Подпись к готовому ролику: заголовок + строки с параметрами.
+    """
+    lines = [title]
+    lines.extend(line for line in details if line)
+    return "\n".join(lines)
+
+
+@traced("telegram.deliver")
+async def deliver_video(
+    bot: Bot,
+    chat_id: int,
+    video_url: str,
+    title: str,
+    details: Iterable[str] = (),
+) -> bool:
+    """
+    Доставка готового видео одним запросом к Bot API:
+    видео + подпись с параметрами + клавиатура главного меню.
+
+    Несколько сообщений отправляем только когда без этого нельзя:
+    - подпись длиннее лимита → видео с заголовком, остальное отдельным сообщением;
+    - Telegram не смог отправить видео по URL → сообщение со ссылкой.
+    """
+    caption = compose_caption(title, details)
+
+    if len(caption) <= CAPTION_LIMIT:
+        if await safe_send_video(
+            bot,
+            chat_id,
+            video_url,
+            caption=caption,
+            reply_markup=main_menu_keyboard(),
+        ):
+            return True
+    else:
+        if await safe_send_video(bot, chat_id, video_url, caption=title[:CAPTION_LIMIT]):
+            return await safe_send_message(
+                bot,
+                chat_id,
+                caption,
+                reply_markup=main_menu_keyboard(),
+                priority=PRIORITY_CRITICAL,
+            )
+
+    # видео не ушло — хотя бы отдаём ссылку
+    logger.warning(f"deliver_video: send_video failed for chat {chat_id}, sending link")
+    return await safe_send_message(
+        bot,
+        chat_id,
+        f"{caption}\n\n🔗 {video_url}",
+        reply_markup=main_menu_keyboard(),
+        priority=PRIORITY_CRITICAL,
+    )
@@ -0,0 +1,54 @@
+# http_client.py
+import asyncio
+import logging
+from typing import Iterable, Optional
+
+import aiohttp
+
+from config import HTTP_POOL_LIMIT, HTTP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+# Общая сессия aiohttp на весь процесс: один пул соединений,
+# keep-alive и DNS-кэш вместо новой сессии на каждый запрос.
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Вернуть общую ClientSession (создаётся при первом обращении,
+    внутри запущенного event loop).
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+    return _session
+
+
+async def warm_up(urls: Iterable[str], timeout: float = 5.0) -> None:
+    """
+    Заранее открыть соединения (DNS + TLS) к хостам, которые понадобятся
+    первыми: они останутся в пуле keep-alive. Ошибки не мешают запуску.
+    """
+    session = get_session()
+
+    async def _touch(url: str) -> None:
+        try:
+            async with session.head(url, timeout=aiohttp.ClientTimeout(total=timeout)):
+                pass
+        except Exception as e:
+            logger.info(f"HTTP warm-up {url} failed: {e!r}")
+
+    await asyncio.gather(*(_touch(url) for url in urls if url))
+
+
+async def close_session() -> None:
+    """Закрыть общую сессию (при остановке бота)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,233 @@
+# inflight.py
+"""
+Реестр генераций, которые сейчас ждут KIE (/tasks для админа).
+
+check_video_status / check_veo_status регистрируют задачу при старте,
+на каждом опросе обновляют запись (O(1): счётчик, время, последний статус)
+и удаляют её в finally. Задачи asyncio не сканируем.
+
+Запись же — точка управления:
+- recheck() будит цикл опроса, не дожидаясь очередной паузы;
+- claim() — «кто первый завершает генерацию»: цикл опроса перед доставкой
+  или возвратом и админ перед принудительным возвратом берут claim, поэтому
+  токены не вернутся дважды и видео не придёт после возврата. Цикл опроса
+  берёт claim через acquire(): если его держит force_refund, ждёт итога.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+
+from database import db
+from metrics import GENERATIONS, REFUNDS
+from stats import stats
+from utils import safe_send_message
+
+logger = logging.getLogger(__name__)
+
+# Итоги force_refund / force_recheck
+NOT_FOUND = "not_found"
+FINISHING = "finishing"
+DONE = "done"
+# токены вернуть не удалось — опрос продолжается, можно повторить
+FAILED = "failed"
+
+
+class InFlight:
+    __slots__ = (
+        "task_id", "engine", "model", "uid", "cost",
+        "started", "polls", "last_status", "last_poll",
+        "task", "claimed", "_owner", "_wakeup", "_released",
+    )
+
+    def __init__(self, task_id: str, engine: str, model: str, uid: int, cost: int):
+        self.task_id = task_id
+        self.engine = engine
+        self.model = model
+        self.uid = uid
+        self.cost = cost
+        self.started = time.monotonic()
+        self.polls = 0
+        self.last_status: Optional[str] = None
+        self.last_poll: Optional[float] = None
+        self.task: Optional[asyncio.Task] = asyncio.current_task()
+        self.claimed = False
+        self._owner: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._released = asyncio.Event()
+
+    def polled(self, status) -> None:
+        self.polls += 1
+        self.last_status = None if status is None else str(status)
+        self.last_poll = time.monotonic()
+
+    async def wait(self, seconds: float) -> None:
+        """Пауза между опросами; recheck() прерывает её."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def recheck(self) -> None:
+        self._wakeup.set()
+
+    def claim(self) -> bool:
+        """True — только первому, кто завершает генерацию (доставка / возврат)."""
+        if self.claimed:
+            return False
+        self.claimed = True
+        self._owner = asyncio.current_task()
+        self._released.clear()
+        return True
+
+    def release(self) -> None:
+        """Отдать claim обратно (завершить не удалось)."""
+        self.claimed = False
+        self._owner = None
+        self._released.set()
+
+    async def acquire(self) -> bool:
+        """
+        claim для цикла опроса. Если его держит force_refund — ждём итога:
+        возврат удался — задачу опроса отменят, не удался — claim наш.
+        False — claim уже у этого же цикла (завершение началось раньше).
+        """
+        while not self.claim():
+            if self._owner is asyncio.current_task():
+                return False
+            await self._released.wait()
+        return True
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.started
+
+    def to_dict(self) -> Dict:
+        return {
+            "task_id": self.task_id,
+            "engine": self.engine,
+            "model": self.model,
+            "uid": self.uid,
+            "cost": self.cost,
+            "age": round(self.age, 1),
+            "polls": self.polls,
+            "last_status": self.last_status,
+            "since_last_poll": round(time.monotonic() - self.last_poll, 1) if self.last_poll else None,
+            "claimed": self.claimed,
+        }
+
+
+class InFlightRegistry:
+    def __init__(self):
+        self._items: Dict[str, InFlight] = {}
+
+    def add(self, task_id: str, engine: str, model: str, uid: int, cost: int) -> InFlight:
+        entry = InFlight(task_id, engine, model, uid, cost)
+        self._items[task_id] = entry
+        return entry
+
+    def remove(self, entry: InFlight) -> None:
+        if self._items.get(entry.task_id) is entry:
+            del self._items[entry.task_id]
+
+    def get(self, task_id: str) -> Optional[InFlight]:
+        return self._items.get(task_id)
+
+    def finishing(self, task_id: str) -> bool:
+        """Генерацию уже доставляют или возвращают (claim взят)."""
+        entry = self._items.get(task_id)
+        return entry is not None and entry.claimed
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def grouped(self) -> Dict[Tuple[str, str], List[InFlight]]:
+        """(engine, model) → записи, старые первыми"""
+        groups: Dict[Tuple[str, str], List[InFlight]] = defaultdict(list)
+        for entry in self._items.values():
+            groups[(entry.engine, entry.model)].append(entry)
+        for entries in groups.values():
+            entries.sort(key=lambda e: e.started)
+        return dict(sorted(groups.items()))
+
+    def snapshot(self) -> List[Dict]:
+        return [e.to_dict() for entries in self.grouped().values() for e in entries]
+
+
+#  УПРАВЛЕНИЕ (/tasks и API)
+
+async def force_refund(bot: Bot, task_id: str) -> str:
+    """
+    Вернуть токены, не дожидаясь KIE: опрос отменяется, пользователь
+    получает уведомление. FINISHING — цикл опроса уже доставляет видео
+    или сам возвращает токены. FAILED — токены вернуть не удалось:
+    claim отдан обратно, опрос продолжается.
+    """
+    entry = inflight.get(task_id)
+    if entry is None:
+        return NOT_FOUND
+    if not entry.claim():
+        return FINISHING
+    # сначала возврат (под claim), и только потом останавливаем опрос:
+    # иначе при ошибке БД генерацию никто не опросит и не вернёт
+    try:
+        await db.add_generations(entry.uid, entry.cost)
+    except Exception:
+        logger.exception("Force refund %s task %s: crediting failed", entry.engine, task_id)
+        entry.release()
+        return FAILED
+    if entry.task is not None:
+        entry.task.cancel()
+    inflight.remove(entry)
+    GENERATIONS.labels(entry.engine, "force_refund").inc()
+    stats.record("generations", f"{entry.engine}:force_refund")
+    REFUNDS.labels(entry.engine).inc()
+    stats.record("refunds", entry.engine)
+    logger.warning(
+        "Force refund %s task %s: uid %s, %d tokens, %d polls, last %s",
+        entry.engine, task_id, entry.uid, entry.cost, entry.polls, entry.last_status,
+    )
+    await safe_send_message(
+        bot,
+        entry.uid,
+        "❌ Генерация отменена: сервис не вернул результат. Токены возвращены.",
+    )
+    return DONE
+
+
+def force_recheck(task_id: str) -> str:
+    """Опросить KIE сейчас, не дожидаясь паузы между опросами."""
+    entry = inflight.get(task_id)
+    if entry is None:
+        return NOT_FOUND
+    if entry.claimed:
+        return FINISHING
+    entry.recheck()
+    return DONE
+
+
+def format_tasks(registry: "InFlightRegistry", per_group: int = 15) -> str:
+    groups = registry.grouped()
+    if not groups:
+        return "Нет генераций в работе."
+    lines = [f"в работе: {len(registry)}"]
+    for (engine, model), entries in groups.items():
+        lines.append("")
+        lines.append(f"{engine} / {model}: {len(entries)}")
+        for e in entries[:per_group]:
+            age_min = e.age / 60
+            lines.append(
+                f"  {e.task_id}  {age_min:5.1f} мин  опросов {e.polls:<3} "
+                f"{e.last_status or '—'}  uid {e.uid}"
+            )
+        if len(entries) > per_group:
+            lines.append(f"  … и ещё {len(entries) - per_group}")
+    return "\n".join(lines)
+
+
+# Глобальный реестр
+inflight = InFlightRegistry()
@@ -1,11 +1,30 @@
 # keyboards.py
-from typing import Optional
+from typing import Callable, Dict, Hashable, Optional
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from config import CHANNEL_URL, CHANNEL_USERNAME
 
 
+#  РЕЕСТР ГОТОВЫХ КЛАВИАТУР
+#
+#  Клавиатуры не зависят от пользователя, поэтому строятся один раз при импорте,
+#  а функции ниже лишь отдают готовый объект. Объекты общие на всех —
+#  менять их нельзя (модели aiogram и так frozen).
+
+_REGISTRY: Dict[Hashable, InlineKeyboardMarkup] = {}
+
+
+def _registered(key: Hashable, builder: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+    """
+    Вернуть клавиатуру из реестра, при первом обращении — построить.
+    """
+    kb = _REGISTRY.get(key)
+    if kb is None:
+        kb = _REGISTRY[key] = builder()
+    return kb
+
+
 #  БАЗОВЫЕ КНОПКИ
 
 def back_btn(callback_data: str) -> InlineKeyboardButton:
@@ -15,7 +34,7 @@ def back_btn(callback_data: str) -> InlineKeyboardButton:
     return InlineKeyboardButton(text="🔙 Назад", callback_data=callback_data)
 
 
-def main_menu_keyboard() -> InlineKeyboardMarkup:
+def _build_main_menu_keyboard() -> InlineKeyboardMarkup:
     """
     Главное меню под сообщением:
     - Создать видео
@@ -33,7 +52,7 @@ def main_menu_keyboard() -> InlineKeyboardMarkup:
 
 #  ПОДПИСКА НА КАНАЛ
 
-def subscribe_keyboard() -> InlineKeyboardMarkup:
+def _build_subscribe_keyboard() -> InlineKeyboardMarkup:
     """
     Кнопки для проверки подписки:
     - перейти в канал
@@ -55,7 +74,7 @@ def subscribe_keyboard() -> InlineKeyboardMarkup:
 
 #  ВЫБОР ДВИЖКА: SORA 2 / VEO 3.1
 
-def engine_select_keyboard() -> InlineKeyboardMarkup:
+def _build_engine_select_keyboard() -> InlineKeyboardMarkup:
     """
     Выбор между Sora 2 и Veo 3.1.
     """
@@ -70,7 +89,7 @@ def engine_select_keyboard() -> InlineKeyboardMarkup:
 
 #  SORA 2 — КЛАВИАТУРЫ FSM
 
-def get_prompt_type_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
+def _build_prompt_type_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
     """
     Выбор типа промпта:
     - текст → видео
@@ -91,7 +110,7 @@ def get_prompt_type_keyboard(selected: Optional[str] = None) -> InlineKeyboardMa
     )
 
 
-def get_model_tier_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
+def _build_model_tier_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
     """
     Выбор модели:
     - Sora 2
@@ -112,7 +131,7 @@ def get_model_tier_keyboard(selected: Optional[str] = None) -> InlineKeyboardMar
     )
 
 
-def get_quality_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
+def _build_quality_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
     """
     Качество для Sora 2 Pro:
     - standard
@@ -134,7 +153,7 @@ def get_quality_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup
     )
 
 
-def get_duration_orientation_keyboard(
+def _build_duration_orientation_keyboard(
     selected_duration: Optional[int] = None,
     selected_orientation: Optional[str] = None,
 ) -> InlineKeyboardMarkup:
@@ -165,7 +184,7 @@ def get_duration_orientation_keyboard(
     )
 
 
-def get_confirmation_keyboard() -> InlineKeyboardMarkup:
+def _build_confirmation_keyboard() -> InlineKeyboardMarkup:
     """
     Финальное подтверждение параметров генерации (Sora 2).
     """
@@ -180,7 +199,7 @@ def get_confirmation_keyboard() -> InlineKeyboardMarkup:
 
 #  VEO 3.1 — КЛАВИАТУРЫ FSM
 
-def veo_mode_keyboard() -> InlineKeyboardMarkup:
+def _build_veo_mode_keyboard() -> InlineKeyboardMarkup:
     """
     Выбор режима Veo 3.1:
     - текст → видео
@@ -196,7 +215,7 @@ def veo_mode_keyboard() -> InlineKeyboardMarkup:
         ]
     )
     
-def veo_aspect_keyboard() -> InlineKeyboardMarkup:
+def _build_veo_aspect_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
@@ -207,7 +226,7 @@ def veo_aspect_keyboard() -> InlineKeyboardMarkup:
         ]
     )
 
-def veo_quality_keyboard() -> InlineKeyboardMarkup:
+def _build_veo_quality_keyboard() -> InlineKeyboardMarkup:
     """
     Выбор качества Veo 3.1:
     - Fast
@@ -222,7 +241,7 @@ def veo_quality_keyboard() -> InlineKeyboardMarkup:
     )
 
 
-def get_veo_confirmation_keyboard() -> InlineKeyboardMarkup:
+def _build_veo_confirmation_keyboard() -> InlineKeyboardMarkup:
     """
     Финальное подтверждение параметров генерации (Veo 3.1).
     """
@@ -233,3 +252,106 @@ def get_veo_confirmation_keyboard() -> InlineKeyboardMarkup:
             [back_btn("back_to_engine")],
         ]
     )
+
+
+def back_keyboard(callback_data: str) -> InlineKeyboardMarkup:
+    """
+    Клавиатура из одной кнопки 'Назад'.
+    """
+    return _registered(
+        ("back", callback_data),
+        lambda: InlineKeyboardMarkup(inline_keyboard=[[back_btn(callback_data)]]),
+    )
+
+
+#  ПУБЛИЧНЫЕ ФУНКЦИИ — ОТДАЮТ ГОТОВЫЕ КЛАВИАТУРЫ ИЗ РЕЕСТРА
+
+def main_menu_keyboard() -> InlineKeyboardMarkup:
+    return _registered("main_menu", _build_main_menu_keyboard)
+
+
+def subscribe_keyboard() -> InlineKeyboardMarkup:
+    return _registered("subscribe", _build_subscribe_keyboard)
+
+
+def engine_select_keyboard() -> InlineKeyboardMarkup:
+    return _registered("engine_select", _build_engine_select_keyboard)
+
+
+def get_prompt_type_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
+    return _registered(
+        ("prompt_type", selected),
+        lambda: _build_prompt_type_keyboard(selected),
+    )
+
+
+def get_model_tier_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
+    return _registered(
+        ("model_tier", selected),
+        lambda: _build_model_tier_keyboard(selected),
+    )
+
+
+def get_quality_keyboard(selected: Optional[str] = None) -> InlineKeyboardMarkup:
+    return _registered(
+        ("quality", selected),
+        lambda: _build_quality_keyboard(selected),
+    )
+
+
+def get_duration_orientation_keyboard(
+    selected_duration: Optional[int] = None,
+    selected_orientation: Optional[str] = None,
+) -> InlineKeyboardMarkup:
+    return _registered(
+        ("duration_orientation", selected_duration, selected_orientation),
+        lambda: _build_duration_orientation_keyboard(selected_duration, selected_orientation),
+    )
+
+
+def get_confirmation_keyboard() -> InlineKeyboardMarkup:
+    return _registered("confirmation", _build_confirmation_keyboard)
+
+
+def veo_mode_keyboard() -> InlineKeyboardMarkup:
+    return _registered("veo_mode", _build_veo_mode_keyboard)
+
+
+def veo_aspect_keyboard() -> InlineKeyboardMarkup:
+    return _registered("veo_aspect", _build_veo_aspect_keyboard)
+
+
+def veo_quality_keyboard() -> InlineKeyboardMarkup:
+    return _registered("veo_quality", _build_veo_quality_keyboard)
+
+
+def get_veo_confirmation_keyboard() -> InlineKeyboardMarkup:
+    return _registered("veo_confirmation", _build_veo_confirmation_keyboard)
+
+
+def _prebuild() -> None:
+    """
+    Строим все варианты заранее, чтобы первый пользователь не платил за сборку.
+    """
+    main_menu_keyboard()
+    subscribe_keyboard()
+    engine_select_keyboard()
+    get_confirmation_keyboard()
+    veo_mode_keyboard()
+    veo_aspect_keyboard()
+    veo_quality_keyboard()
+    get_veo_confirmation_keyboard()
+    for sel in (None, "t2v", "i2v"):
+        get_prompt_type_keyboard(sel)
+    for sel in (None, "sora2", "sora2_pro"):
+        get_model_tier_keyboard(sel)
+    for sel in (None, "std", "high"):
+        get_quality_keyboard(sel)
+    for dur in (None, 10, 15):
+        for orient in (None, "9:16", "16:9"):
+            get_duration_orientation_keyboard(dur, orient)
+    for cb in ("back_to_main", "back_to_duration", "back_to_veo_mode", "back_to_engine"):
+        back_keyboard(cb)
+
+
+_prebuild()
@@ -0,0 +1,206 @@
+# log_setup.py
+"""
+Неблокирующие логи.
+
+В event loop логгер только кладёт LogRecord в очередь (без форматирования
+и без записи); строку собирает и пишет отдельный поток QueueListener.
+Если поток записи не успевает и очередь заполнена — запись отбрасывается
+(счётчик bot_log_records_dropped_total), но loop не ждёт.
+
+- JSON (LOG_JSON=1): одна строка на запись, поля uid / task_id / engine /
+  stage — из extra=... или из текущего спана трассы (tracing.py);
+- одинаковые предупреждения и ошибки с одной строки кода — не больше
+  LOG_RATE_BURST за LOG_RATE_INTERVAL секунд, число подавленных
+  дописывается к следующей записи.
+
+В горячих местах пишите лениво: logger.info("poll %s: %r", task_id, e),
+а не f-строкой — строка соберётся только в потоке записи.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from config import LOG_JSON, LOG_QUEUE_SIZE, LOG_RATE_BURST, LOG_RATE_INTERVAL
+from metrics import counter
+from tracing import current_span
+
+LOGS_DROPPED = counter(
+    "bot_log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+)
+LOGS_SUPPRESSED = counter(
+    "bot_log_records_suppressed_total",
+    "Repeated warnings/errors suppressed by the log rate limit",
+)
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+# Поля контекста в записи
+CONTEXT_FIELDS = ("uid", "task_id", "engine", "stage")
+
+
+#  ФИЛЬТРЫ (работают в потоке event loop, должны быть дешёвыми)
+
+class ContextFilter(logging.Filter):
+    """
+    Дополняет запись uid / task_id / engine / stage из текущего спана,
+    если они не переданы через extra.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = current_span()
+        if span is None:
+            return True
+        for field in ("uid", "task_id", "engine"):
+            if not hasattr(record, field):
+                value = span.lookup(field)
+                if value is not None:
+                    setattr(record, field, value)
+        if not hasattr(record, "stage"):
+            record.stage = span.name
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Не больше burst записей уровня >= min_level с одной строки кода
+    за interval секунд. Ключ — место вызова, а не текст: в тексте
+    обычно task_id или uid, и одинаковые ошибки иначе не склеились бы.
+    """
+
+    MAX_KEYS = 10_000
+
+    def __init__(self, burst: int, interval: float, min_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.min_level = min_level
+        # ключ → [начало окна, записей в окне, подавлено в окне]
+        self._windows: Dict[Tuple[str, int], List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level or self.burst <= 0:
+            return True
+
+        key = (record.pathname, record.lineno)
+        window = self._windows.get(key)
+        if window is None or record.created - window[0] >= self.interval:
+            if window is not None and window[2]:
+                record.suppressed = int(window[2])
+            if window is None and len(self._windows) >= self.MAX_KEYS:
+                self._windows.clear()
+            self._windows[key] = [record.created, 1, 0]
+            return True
+
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+
+        window[2] += 1
+        LOGS_SUPPRESSED.inc()
+        return False
+
+
+#  ОЧЕРЕДЬ
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который никогда не ждёт и не форматирует в вызывающем
+    потоке: сообщение, args и traceback форматирует поток записи.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGS_DROPPED.inc()
+
+
+#  ФОРМАТТЕРЫ (работают в потоке записи)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Привычный текстовый формат + контекст в квадратных скобках."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        context = " ".join(
+            f"{field}={getattr(record, field)}"
+            for field in CONTEXT_FIELDS
+            if getattr(record, field, None) is not None
+        )
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            context = f"{context} (+{suppressed} similar suppressed)".strip()
+        if not context:
+            return text
+        first, sep, rest = text.partition("\n")
+        return f"{first} [{context}]{sep}{rest}"
+
+
+#  НАСТРОЙКА
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # при остановке очередь может быть полной — тут подождать можно
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    json_format: bool = LOG_JSON,
+    stream: Optional[TextIO] = None,
+    queue_size: int = LOG_QUEUE_SIZE,
+    rate_burst: int = LOG_RATE_BURST,
+    rate_interval: float = LOG_RATE_INTERVAL,
+) -> logging.handlers.QueueListener:
+    """
+    Заменяет обработчики root-логгера на очередь + поток записи.
+    Возвращает запущенный QueueListener: listener.stop() при остановке
+    дописывает всё, что осталось в очереди.
+    """
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    sink = logging.StreamHandler(stream or sys.stderr)
+    sink.setFormatter(JsonFormatter() if json_format else TextFormatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(rate_burst, rate_interval))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = _Listener(log_queue, sink)
+    listener.start()
+    return listener
@@ -0,0 +1,193 @@
+# loop_monitor.py
+"""
+Монитор event loop: насколько loop опаздывает и кто в этом виноват.
+
+- Пульс: задача каждые LOOP_MONITOR_INTERVAL_MS засыпает и меряет, насколько
+  позже проснулась — это задержка, которую видят все хендлеры (lag).
+- Медленные колбэки: asyncio.Handle._run обёрнут таймером; всё, что держит
+  loop дольше SLOW_CALLBACK_MS, приписывается виновнику:
+    task:<имя>        — задача с осмысленным именем (kie-poll-sora:…, rub_reconciler);
+    handler:<имя>     — хендлер aiogram, в контексте которого шёл код;
+    coro:<qualname>   — корутина безымянной задачи;
+    callback:<…>      — обычный call_soon/call_later.
+
+Всё уходит в метрики (bot_loop_lag_seconds, bot_slow_callbacks_total…)
+и в /loop для админа.
+"""
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+
+from config import LOOP_MONITOR_INTERVAL_MS, SLOW_CALLBACK_MS
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = histogram(
+    "bot_loop_lag_seconds",
+    "Event loop lag measured by the heartbeat task",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+SLOW_CALLBACKS = counter(
+    "bot_slow_callbacks_total",
+    "Callbacks that blocked the event loop longer than SLOW_CALLBACK_MS",
+    ("source",),
+)
+SLOW_CALLBACK_SECONDS = counter(
+    "bot_slow_callback_seconds_total",
+    "Total time the event loop was blocked by slow callbacks",
+    ("source",),
+)
+
+# Имя хендлера, в контексте которого выполняется код (ставят CallbackRouter
+# и HandlerMetricsMiddleware). Задача на апдейт живёт ровно один апдейт,
+# поэтому значение не сбрасываем.
+current_handler: ContextVar[Optional[str]] = ContextVar("current_handler", default=None)
+
+_DEFAULT_TASK_NAME = re.compile(r"^Task-\d+$")
+
+
+def set_handler_name(name: str) -> None:
+    current_handler.set(name)
+
+
+def task_label(name: str) -> str:
+    """kie-poll-sora:<task_id> → kie-poll-sora (без id, чтобы метки не плодились)"""
+    return name.split(":", 1)[0]
+
+
+def _source_of(handle: asyncio.Handle) -> str:
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        name = task.get_name()
+        if not _DEFAULT_TASK_NAME.match(name):
+            return f"task:{task_label(name)}"
+
+    context = handle._context
+    handler = context.get(current_handler) if context is not None else None
+    if handler:
+        return f"handler:{handler}"
+
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return f"coro:{getattr(coro, '__qualname__', type(coro).__name__)}"
+    return f"callback:{getattr(callback, '__qualname__', type(callback).__name__)}"
+
+
+#  МОНИТОР
+
+class LoopMonitor:
+    # сколько последних замеров lag держим для /loop
+    RECENT = 600
+    # сколько разных источников медленных колбэков помним
+    MAX_SOURCES = 500
+
+    def __init__(self, interval: float, slow_threshold: float):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.recent_lag: Deque[float] = deque(maxlen=self.RECENT)
+        # источник → [сколько раз, суммарно секунд, максимум]
+        self.offenders: Dict[str, List[float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._original_run = None
+
+    #  Замер lag
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.recent_lag.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    #  Медленные колбэки
+
+    def _record_slow(self, handle: asyncio.Handle, duration: float) -> None:
+        try:
+            source = _source_of(handle)
+        except Exception:
+            source = "unknown"
+        stats = self.offenders.get(source)
+        if stats is None:
+            if len(self.offenders) >= self.MAX_SOURCES:
+                source = "other"
+                stats = self.offenders.setdefault(source, [0, 0.0, 0.0])
+            else:
+                stats = self.offenders[source] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        SLOW_CALLBACKS.labels(source).inc()
+        SLOW_CALLBACK_SECONDS.labels(source).inc(duration)
+        logger.warning("slow callback %s blocked the loop for %.0f ms", source, duration * 1000)
+
+    def _install(self) -> None:
+        if self._original_run is not None:
+            return
+        original = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            started = time.perf_counter()
+            original(handle)
+            duration = time.perf_counter() - started
+            if duration >= monitor.slow_threshold:
+                monitor._record_slow(handle, duration)
+
+        self._original_run = original
+        asyncio.events.Handle._run = _run
+
+    def _uninstall(self) -> None:
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    #  Запуск / остановка
+
+    def start(self) -> None:
+        if self._task is not None or self.interval <= 0:
+            return
+        self._install()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop_monitor")
+        logger.info(
+            f"Loop monitor started (interval {self.interval * 1000:.0f} ms, "
+            f"slow callback {self.slow_threshold * 1000:.0f} ms)"
+        )
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._uninstall()
+
+    def reset(self) -> None:
+        self.recent_lag.clear()
+        self.offenders.clear()
+
+    #  Сводка
+
+    def lag_summary(self) -> Dict[str, float]:
+        values = sorted(self.recent_lag)
+        if not values:
+            return {"samples": 0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "samples": len(values),
+            "p50": values[len(values) // 2],
+            "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+            "max": values[-1],
+        }
+
+    def top_offenders(self, limit: int = 10) -> List[Tuple[str, int, float, float]]:
+        """(источник, сколько раз, суммарно секунд, максимум) по убыванию суммы"""
+        items = sorted(self.offenders.items(), key=lambda kv: kv[1][1], reverse=True)
+        return [(src, int(s[0]), s[1], s[2]) for src, s in items[:limit]]
+
+
+# Глобальный монитор
+loop_monitor = LoopMonitor(LOOP_MONITOR_INTERVAL_MS / 1000, SLOW_CALLBACK_MS / 1000)
@@ -1,46 +1,209 @@
 # main.py
+# Отметка старта — до импортов, чтобы их время попало в тайминги запуска
+from startup import startup
+startup.mark_process_start()
+
 import asyncio
 import logging
+import signal
+import time
 
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import TOKEN, DEBUG
+from admin_handlers import register_admin_handlers
+from broadcast import resume_broadcasts, stop_broadcasts
+from bulk_grants import resume_grant_notifiers, stop_grant_notifiers
+from config import (
+    TOKEN,
+    DEBUG,
+    KIE_API_BASE,
+    YOOKASSA_API_URL,
+    SHUTDOWN_HANDLERS_TIMEOUT,
+    SHUTDOWN_OUTBOUND_TIMEOUT,
+)
 from database import db
+from http_client import close_session, warm_up
+from log_setup import setup_logging
+from loop_monitor import loop_monitor
+from memdebug import watch
+from stats import stats
+from supervisor import supervisor
+from middlewares import (
+    CallbackAutoAnswerMiddleware,
+    FirstUpdateMiddleware,
+    HandlerMetricsMiddleware,
+    UpdateDrainMiddleware,
+    updates_in_progress,
+)
 from subscription import register_common_handlers
 from sora_handlers import register_sora_handlers
 from veo_handlers import register_veo_handlers
-from payments import register_payment_handlers
+from payments import register_payment_handlers, run_rub_reconciler
+from prescreen import reload_screen
+from pricing import reload_catalog
+from tracing import tracer
+from utils import outbound
+from yookassa_client import yookassa
+
+
+def build_dispatcher() -> Dispatcher:
+    """
+    Диспетчер со всеми middleware и хендлерами бота
+    (используется и в бенчмарках — там та же сборка, что в проде).
+    """
+    storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    # время до первого апдейта после старта (startup.py)
+    dp.update.outer_middleware(FirstUpdateMiddleware())
+    # апдейты в обработке — при остановке дожидаемся их
+    dp.update.outer_middleware(UpdateDrainMiddleware())
+    watch("fsm_records", lambda: len(storage.storage), "FSM records in MemoryStorage")
+    # снимаем «часики» у всех callback-кнопок, не дожидаясь хендлеров
+    dp.callback_query.outer_middleware(CallbackAutoAnswerMiddleware())
+    # время хендлеров сообщений (callback-кнопки меряет CallbackRouter)
+    dp.message.middleware(HandlerMetricsMiddleware("message"))
+    dp.pre_checkout_query.middleware(HandlerMetricsMiddleware("pre_checkout"))
+
+    # Регистрируем группы хендлеров
+    register_common_handlers(dp)   # /start, /menu, подписка, back_to_main
+    register_sora_handlers(dp)     # Sora 2 / Sora 2 Pro
+    register_veo_handlers(dp)      # Veo 3.1
+    register_payment_handlers(dp)  # баланс, пополнение, /get_id, /give_tokens
+    register_admin_handlers(dp)    # /broadcast, /grant_csv, /stats, /trace, /tasks, /prescreen, /loop, /profile, /mem
+    return dp
 
 
 async def main():
-    # Логирование
-    logging.basicConfig(
-        level=logging.DEBUG if DEBUG else logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    )
+    # Логирование: запись в отдельном потоке, loop не ждёт I/O
+    log_listener = setup_logging(logging.DEBUG if DEBUG else logging.INFO)
     logger = logging.getLogger(__name__)
     logger.info("Starting bot...")
+    startup.mark("imports")
 
     # Бот и диспетчер
     bot = Bot(token=TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = build_dispatcher()
 
-    # Подключаем БД
-    await db.connect()
-    logger.info("DB connected")
+    # Независимые шаги запуска — параллельно: БД (+ веб-сервер, которому нужна БД),
+    # get_me (кэшируется в bot, polling его не повторит), прогрев HTTP-пула
+    async def connect_db_and_web():
+        async with startup.phase("db"):
+            await db.connect()
+        logger.info("DB connected")
+        # Вебхуки YooKassa + /metrics
+        async with startup.phase("web"):
+            # aiohttp.web нужен только веб-серверу — импортируем, когда дошли до запуска
+            from web_server import start_web_server
+            return await start_web_server(bot)
 
-    # Регистрируем группы хендлеров
-    register_common_handlers(dp)   # /start, /menu, подписка, back_to_main
-    register_sora_handlers(dp)     # Sora 2 / Sora 2 Pro
-    register_veo_handlers(dp)      # Veo 3.1
-    register_payment_handlers(dp)  # баланс, пополнение, /get_id, /give_tokens
+    async def fetch_me():
+        async with startup.phase("get_me"):
+            return await bot.me()
 
+    async def warm_http():
+        async with startup.phase("http_warmup"):
+            await warm_up([KIE_API_BASE, YOOKASSA_API_URL if yookassa.configured else ""])
+
+    web_runner = None
+    # всё, что запускается, внутри try: при сбое запуска (БД, get_me, веб-сервер)
+    # finally закроет то, что успело открыться
     try:
-        await dp.start_polling(bot)
+        async with startup.phase("parallel"):
+            # ждём все шаги, даже если один упал: иначе веб-сервер, поднятый
+            # соседним шагом, не попадёт в web_runner и не будет закрыт
+            results = await asyncio.gather(
+                connect_db_and_web(), fetch_me(), warm_http(), return_exceptions=True
+            )
+        if not isinstance(results[0], BaseException):
+            web_runner = results[0]
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        me = results[1]
+        logger.info(f"Bot @{me.username} (id {me.id})")
+
+        # термины предпроверки промптов (файл + БД) → автомат
+        try:
+            await reload_screen()
+        except Exception:
+            logger.exception("Prompt pre-screen not loaded, prompts go unchecked")
+
+        # SIGHUP → перечитать каталог цен и термины предпроверки без рестарта
+        async def _reload_screen_logged():
+            try:
+                await reload_screen()
+            except Exception:
+                logger.exception("SIGHUP: pre-screen reload failed, keeping previous terms")
+
+        def _on_sighup():
+            try:
+                reload_catalog()
+            except Exception:
+                logger.exception("SIGHUP: pricing reload failed, keeping previous catalog")
+            supervisor.spawn(
+                _reload_screen_logged(), name="prescreen_reload", kind="prescreen_reload", critical=True
+            )
+
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _on_sighup)
+        except (NotImplementedError, AttributeError):
+            pass  # Windows
+
+        # Страховочная сверка RUB-платежей
+        supervisor.spawn(run_rub_reconciler(bot), name="rub_reconciler", kind="rub_reconciler", critical=True)
+        # рассылки уведомлений /grant_csv, прерванные прошлым рестартом
+        await resume_grant_notifiers(bot)
+        # рассылка, которая шла до рестарта, продолжается с чекпоинта
+        await resume_broadcasts(bot)
+        # опросы KIE, прерванные прошлой остановкой
+        await supervisor.resume(bot)
+        # почасовые агрегаты для /stats
+        supervisor.spawn(stats.run(), name="stats_writer", kind="stats_writer", critical=True)
+        # задержка event loop и медленные колбэки (метрики + /loop)
+        loop_monitor.start()
+
+        startup.mark("ready")
+        logger.info(f"Startup: {startup.report()}")
+
+        # resolve_used_update_types() включает chat_member (кэш подписки).
+        # Сессию бота закрываем сами, когда доработают хендлеры и фоновые задачи
+        await dp.start_polling(
+            bot,
+            allowed_updates=dp.resolve_used_update_types(),
+            close_bot_session=False,
+        )
     finally:
+        # Остановка: сначала перестаём принимать работу, потом доделываем
+        # начатое, и только в конце закрываем HTTP-клиенты и пул БД —
+        # иначе возвраты токенов упрутся в закрытый пул.
+        stopping = time.perf_counter()
+        # 1. polling уже остановлен (SIGTERM/SIGINT); закрываем вебхуки —
+        #    cleanup дожидается уже принятых уведомлений YooKassa
+        if web_runner:
+            await web_runner.cleanup()
+        # 2. хендлеры, которые уже выполняются (списания, возвраты, ответы)
+        left = await updates_in_progress.drain(SHUTDOWN_HANDLERS_TIMEOUT)
+        if left:
+            logger.warning(f"Shutdown: {left} update(s) still in progress after {SHUTDOWN_HANDLERS_TIMEOUT}s")
+        # 3. фоновые задачи: доделываются возвраты и доставки, опросы KIE
+        #    сохраняются в БД для перезапуска, статистика дописывается.
+        #    RUB-платежи в ожидании и так лежат в rub_payments — их подхватит сверка
+        stop_grant_notifiers()
+        stop_broadcasts()
+        loop_monitor.stop()
+        await supervisor.shutdown()
+        # 4. сообщения, которые ещё в очереди планировщика исходящих
+        left = await outbound.pending.drain(SHUTDOWN_OUTBOUND_TIMEOUT)
+        if left:
+            logger.warning(f"Shutdown: {left} outgoing message(s) dropped")
+        # 5. теперь можно закрывать клиенты и пул
+        await close_session()
+        await bot.session.close()
+        tracer.shutdown()
         await db.close()
-        logger.info("DB closed")
+        logger.info(f"DB closed, shutdown took {time.perf_counter() - stopping:.1f}s")
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+# memdebug.py
+"""
+Поиск утечек памяти в работающем боте (/mem для админа).
+
+- Снимки tracemalloc: топ мест выделения и разница с предыдущим снимком.
+  tracemalloc включается только первым /mem (он замедляет каждое выделение
+  памяти) и выключается /mem stop.
+- Живые объекты: размеры наших словарей/множеств, которые могут расти
+  (watch — они же уходят в /metrics как bot_live_*), и подсчёт объектов
+  по типам через gc: задачи, корутины, aiohttp-сессии, записи FSM.
+
+gc.get_objects() и снимок обходят всю кучу и на это время держат loop —
+это диагностика по запросу, а не то, что стоит звать в цикле.
+"""
+import asyncio
+import gc
+import linecache
+import logging
+import os
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import MEM_TRACE_FRAMES
+from metrics import function_gauge
+
+logger = logging.getLogger(__name__)
+
+# Типы, которые считаем всегда (по имени класса): кандидаты в утечки
+TRACKED_TYPES = (
+    "Task",
+    "coroutine",
+    "ClientSession",
+    "ClientResponse",
+    "TCPConnector",
+    "MemoryStorageRecord",
+    "Span",
+)
+
+
+#  РАЗМЕРЫ КОНТЕЙНЕРОВ
+
+_watched: Dict[str, Callable[[], Optional[int]]] = {}
+
+
+def watch(name: str, fn: Callable[[], Optional[int]], documentation: str = "") -> None:
+    """
+    Следить за размером чего-то, что живёт весь процесс (кэш, множество id…).
+    Значение видно в /mem и в /metrics как bot_live_<name>.
+    """
+    _watched[name] = fn
+    gauge = function_gauge(f"bot_live_{name}", documentation or f"Live size of {name}", fn)
+    gauge.fn = fn  # повторный watch (новый Dispatcher в бенчмарке) — следим за новым
+
+
+def watched_sizes() -> Dict[str, Optional[int]]:
+    sizes = {}
+    for name, fn in _watched.items():
+        try:
+            sizes[name] = fn()
+        except Exception:
+            sizes[name] = None
+    return sizes
+
+
+def _all_tasks_count() -> int:
+    return len(asyncio.all_tasks())
+
+
+watch("asyncio_tasks", _all_tasks_count, "Pending asyncio tasks")
+
+
+#  ОБЪЕКТЫ ПО ТИПАМ
+
+def count_objects(top: int = 10) -> Tuple[Dict[str, int], List[Tuple[str, int]]]:
+    """({тип из TRACKED_TYPES: сколько}, топ-N всех типов по количеству)"""
+    counts: Counter = Counter(type(o).__name__ for o in gc.get_objects())
+    tracked = {name: counts.get(name, 0) for name in TRACKED_TYPES}
+    return tracked, counts.most_common(top)
+
+
+#  СНИМКИ TRACEMALLOC
+
+def _short_path(filename: str) -> str:
+    parts = filename.replace("\\", "/").split("/")
+    return "/".join(parts[-2:])
+
+
+def _describe(stat) -> str:
+    frame = stat.traceback[0]
+    line = linecache.getline(frame.filename, frame.lineno).strip()
+    where = f"{_short_path(frame.filename)}:{frame.lineno}"
+    return f"{where} {line[:60]}" if line else where
+
+
+class MemoryInspector:
+    def __init__(self, frames: int = MEM_TRACE_FRAMES):
+        self.frames = frames
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_at: Optional[float] = None
+        self._objects: Optional[Dict[str, int]] = None
+        self._sizes: Optional[Dict[str, Optional[int]]] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self) -> bool:
+        """Включить tracemalloc. False — уже был включён."""
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(self.frames)
+        logger.info(f"tracemalloc started ({self.frames} frames)")
+        return True
+
+    def stop(self) -> None:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("tracemalloc stopped")
+        self._snapshot = None
+        self._snapshot_at = None
+
+    def _take(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def report(self, limit: int = 10) -> str:
+        """
+        Текстовый отчёт: память под tracemalloc, топ мест выделения,
+        рост с прошлого /mem, живые объекты и размеры контейнеров
+        (с разницей к прошлому отчёту).
+        """
+        lines: List[str] = []
+        now = time.monotonic()
+
+        if tracemalloc.is_tracing():
+            snapshot = self._take()
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"tracemalloc: {current / 2**20:.1f} MiB (пик {peak / 2**20:.1f} MiB)")
+
+            lines.append("")
+            lines.append("топ выделений:")
+            for stat in snapshot.statistics("lineno")[:limit]:
+                lines.append(f"{stat.size / 1024:9.1f} KiB {stat.count:7} {_describe(stat)}")
+
+            if self._snapshot is not None:
+                lines.append("")
+                lines.append(f"рост за {now - self._snapshot_at:.0f} с:")
+                diff = [d for d in snapshot.compare_to(self._snapshot, "lineno") if d.size_diff]
+                for stat in diff[:limit]:
+                    lines.append(
+                        f"{stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7} {_describe(stat)}"
+                    )
+                if not diff:
+                    lines.append("нет")
+            self._snapshot = snapshot
+            self._snapshot_at = now
+
+        tracked, top = count_objects()
+        lines.append("")
+        lines.append(f"живые объекты (процесс {os.getpid()}):")
+        for name, count in tracked.items():
+            lines.append(f"{count:9} {self._delta(self._objects, name, count)} {name}")
+        lines.append("")
+        lines.append("больше всего объектов:")
+        for name, count in top:
+            lines.append(f"{count:9} {name}")
+
+        sizes = watched_sizes()
+        lines.append("")
+        lines.append("размеры:")
+        for name, size in sizes.items():
+            if size is None:
+                lines.append(f"{'—':>9}          {name}")
+            else:
+                lines.append(f"{size:9} {self._delta(self._sizes, name, size)} {name}")
+
+        self._objects = tracked
+        self._sizes = sizes
+        return "\n".join(lines)
+
+    @staticmethod
+    def _delta(previous: Optional[Dict[str, Optional[int]]], name: str, value: int) -> str:
+        if not previous or previous.get(name) is None:
+            return " " * 8
+        return f"{value - previous[name]:+8}"
+
+
+# Глобальный инспектор
+memory_inspector = MemoryInspector()
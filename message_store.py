@@ -0,0 +1,59 @@
+# message_store.py
+import logging
+from typing import Dict
+
+from config import TRACKED_MESSAGE_TTL, TRACKED_MESSAGE_MAX_ROWS
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+
+class TrackedMessageStore:
+    """
+    Хранилище «какое сообщение потом удалить»: (user_id, kind) → message_id.
+    Живёт в БД, поэтому переживает рестарт и общее для всех воркеров.
+    Записи истекают через ttl, таблица не растёт больше max_rows:
+    чистка запускается раз в prune_every записей.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        ttl: int = TRACKED_MESSAGE_TTL,
+        max_rows: int = TRACKED_MESSAGE_MAX_ROWS,
+        prune_every: int = 500,
+    ):
+        self.db = database
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._puts = 0
+
+    async def put(self, user_id: int, kind: str, message_id: int) -> None:
+        try:
+            await self.db.put_tracked_message(user_id, kind, message_id, self.ttl)
+        except Exception:
+            logger.exception(f"TrackedMessageStore.put failed ({user_id}, {kind})")
+            return
+
+        self._puts += 1
+        if self._puts % self.prune_every == 0:
+            try:
+                await self.db.prune_tracked_messages(self.max_rows)
+            except Exception:
+                logger.exception("TrackedMessageStore: prune failed")
+
+    async def pop(self, user_id: int, *kinds: str) -> Dict[str, int]:
+        """Забрать сообщения указанных видов одним запросом: {kind: message_id}"""
+        try:
+            return await self.db.pop_tracked_messages(user_id, list(kinds))
+        except Exception:
+            logger.exception(f"TrackedMessageStore.pop failed ({user_id}, {kinds})")
+            return {}
+
+
+# Инвойс Stars и сообщение с кнопкой «Назад» под ним
+STARS_INVOICE = "stars_invoice"
+STARS_BACK = "stars_back"
+
+tracked_messages = TrackedMessageStore(db)
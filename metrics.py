@@ -0,0 +1,305 @@
+# metrics.py
+"""
+Лёгкие метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей.
+
+Запись на горячем пути — это поиск дочерней метрики в dict по кортежу
+значений меток и `+=` над float. Блокировок нет: бот работает в одном
+event loop, а редкие гонки из to_thread-потоков для счётчиков не критичны.
+Дочерние метрики создаются один раз на набор меток — держите метки
+ограниченными (имя хендлера, модель, исход), а не uid/task_id.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Бакеты по умолчанию (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+#  ТИПЫ МЕТРИК
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Дочерняя метрика для набора значений меток (кэшируется)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_value(child.value)}"]
+
+
+class _ValueChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+
+class FunctionGauge(_Metric):
+    """Gauge, значение которого считается в момент выдачи /metrics."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], Optional[float]]):
+        super().__init__(name, documentation)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            value = None
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if value is not None:
+            lines.append(f"{self.name} {_fmt_value(value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Грубая оценка квантиля по бакетам (верхняя граница бакета)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        acc = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            acc += n
+            if acc >= rank:
+                return bound
+        return float("inf")
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        acc = 0
+        for bound, n in zip(self.bounds + (float("inf"),), child.counts):
+            acc += n
+            le = f'le="{_fmt_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, values, le)} {acc}")
+        labels = _fmt_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_fmt_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+#  РЕЕСТР
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing  # повторный импорт модуля — отдаём ту же метрику
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def function_gauge(name: str, documentation: str, fn: Callable[[], Optional[float]]) -> FunctionGauge:
+    return REGISTRY.register(FunctionGauge(name, documentation, fn))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Iterable[float] = LATENCY_BUCKETS,
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+#  МЕТРИКИ БОТА
+
+HANDLER_SECONDS = histogram(
+    "bot_handler_seconds",
+    "Handler latency by update kind, route (callback data / handler) and FSM state",
+    ("kind", "route", "state"),
+)
+HANDLER_ERRORS = counter(
+    "bot_handler_errors_total",
+    "Handlers that raised",
+    ("kind", "route"),
+)
+
+KIE_REQUEST_SECONDS = histogram(
+    "bot_kie_request_seconds",
+    "KIE API request latency (submit = createTask/generate, poll = status)",
+    ("op", "model"),
+    buckets=SLOW_BUCKETS,
+)
+KIE_REQUESTS = counter(
+    "bot_kie_requests_total",
+    "KIE API requests by outcome",
+    ("op", "model", "outcome"),
+)
+GENERATIONS_IN_FLIGHT = gauge(
+    "bot_generations_in_flight",
+    "Generations currently being polled",
+    ("engine",),
+)
+GENERATIONS = counter(
+    "bot_generations_total",
+    "Finished generations by outcome (success / failed / timeout / error / force_refund)",
+    ("engine", "outcome"),
+)
+REFUNDS = counter(
+    "bot_refunds_total",
+    "Token refunds after a failed generation",
+    ("engine",),
+)
+
+DB_POOL_ACQUIRE_SECONDS = histogram(
+    "bot_db_pool_acquire_seconds",
+    "Time spent waiting for an asyncpg pool connection",
+)
+
+TELEGRAM_CALLS = counter(
+    "bot_telegram_calls_total",
+    "Outbound Bot API calls by method and outcome (ok / retry / rate_limited / failed / gave_up)",
+    ("method", "outcome"),
+)
+TELEGRAM_CALL_SECONDS = histogram(
+    "bot_telegram_call_seconds",
+    "Outbound Bot API call latency including scheduler wait and retries",
+    ("method",),
+)
+
+PAYMENTS = counter(
+    "bot_payments_total",
+    "Payments by channel (stars / rub) and outcome",
+    ("channel", "outcome"),
+)
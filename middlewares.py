@@ -0,0 +1,198 @@
+# middlewares.py
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from loop_monitor import set_handler_name
+from metrics import HANDLER_SECONDS, HANDLER_ERRORS
+from startup import startup
+from utils import ActiveCounter, safe_send_message
+
+logger = logging.getLogger(__name__)
+
+
+# Через сколько секунд после начала обработки снимаем «часики» сами.
+# Небольшая пауза даёт хендлеру шанс первым ответить алертом; хендлеры,
+# которые решают про алерт только после запросов, зовут hold_callback_answer.
+AUTO_ANSWER_DELAY = 0.1
+
+
+class CallbackAnswerGuard:
+    """
+    Следит, чтобы на callback_query ответили ровно один раз
+    (Telegram не принимает второй answerCallbackQuery).
+    """
+
+    __slots__ = ("callback", "answered", "held")
+
+    def __init__(self, callback: CallbackQuery):
+        self.callback = callback
+        self.answered = False
+        # хендлер ответит сам — по таймеру не отвечаем
+        self.held = False
+
+    async def answer(self, text: Optional[str] = None, show_alert: bool = False) -> bool:
+        if self.answered:
+            return False
+        # флаг ставим до await — второй вызов сразу увидит, что ответ уже ушёл
+        self.answered = True
+        try:
+            await self.callback.answer(text, show_alert=show_alert)
+            return True
+        except Exception as e:
+            logger.info("callback answer failed: %s", e)
+            return False
+
+
+# callback.id → guard для callback_query, которые сейчас обрабатываются
+_PENDING: Dict[str, CallbackAnswerGuard] = {}
+
+
+async def answer_callback(
+    callback: CallbackQuery,
+    text: Optional[str] = None,
+    show_alert: bool = False,
+) -> bool:
+    """
+    Ответить на callback_query из хендлера.
+    Если middleware уже сняла «часики», а показать нужно текст —
+    отправляем его обычным сообщением, чтобы пользователь его увидел.
+    """
+    guard = _PENDING.get(callback.id)
+    if guard is None:
+        guard = CallbackAnswerGuard(callback)
+
+    if await guard.answer(text, show_alert=show_alert):
+        return True
+
+    if text:
+        return await safe_send_message(callback.bot, callback.from_user.id, text)
+    return False
+
+
+def hold_callback_answer(callback: CallbackQuery) -> None:
+    """
+    Хендлер ответит на callback_query сам, возможно алертом после I/O
+    (например, живой проверки подписки): middleware не снимает «часики»
+    по таймеру. Вызывать до первого await. Если хендлер так и не ответит,
+    пустой ответ уйдёт, когда он завершится.
+    """
+    guard = _PENDING.get(callback.id)
+    if guard is not None:
+        guard.held = True
+
+
+class CallbackAutoAnswerMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для callback_query: снимает «часики» параллельно
+    с работой хендлера, не дожидаясь его завершения.
+    Если хендлер успел ответить сам (например, алертом) или забрал ответ
+    себе (hold_callback_answer) — ничего не делает.
+    """
+
+    def __init__(self, delay: float = AUTO_ANSWER_DELAY):
+        self.delay = delay
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        guard = CallbackAnswerGuard(event)
+        _PENDING[event.id] = guard
+
+        auto = asyncio.create_task(self._auto_answer(guard))
+        try:
+            return await handler(event, data)
+        finally:
+            _PENDING.pop(event.id, None)
+            if not auto.done():
+                auto.cancel()
+            if not guard.answered:
+                # хендлер закончил раньше паузы (или держал ответ) — отвечаем сразу
+                await guard.answer()
+
+    async def _auto_answer(self, guard: CallbackAnswerGuard) -> None:
+        await asyncio.sleep(self.delay)
+        if not guard.held:
+            await guard.answer()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: время работы хендлера по имени и FSM-состоянию.
+    Для callback_query время пишет CallbackRouter (там известна callback_data).
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        set_handler_name(name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(self.kind, name).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(self.kind, name, data.get("raw_state") or "-").observe(
+                time.perf_counter() - started
+            )
+
+
+class FirstUpdateMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update: отмечает первый апдейт после старта
+    (время до первого апдейта — главная цифра холодного старта).
+    """
+
+    def __init__(self):
+        self.seen = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.seen:
+            self.seen = True
+            startup.first_update()
+        return await handler(event, data)
+
+
+# Глобальный счётчик апдейтов в обработке (при остановке ждём, пока обнулится)
+updates_in_progress = ActiveCounter()
+
+
+class UpdateDrainMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update: считает апдейты, которые сейчас обрабатываются,
+    чтобы при остановке дать им закончить (списания, возвраты, ответы),
+    прежде чем закрыть HTTP-сессии и пул БД.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        updates_in_progress.enter()
+        try:
+            return await handler(event, data)
+        finally:
+            updates_in_progress.leave()
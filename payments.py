@@ -2,7 +2,8 @@
 import asyncio
 import json
 import logging
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
 
 from aiogram import Dispatcher, F
 from aiogram.filters import Command
@@ -15,61 +16,63 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
-from yookassa import Configuration, Payment
 
 from config import (
-    YOOKASSA_SHOP_ID,
-    YOOKASSA_SECRET_KEY,
     YOOKASSA_RETURN_URL,
+    RUB_RECONCILE_INTERVAL,
+    RUB_RECONCILE_MIN_AGE,
+    RUB_RECONCILE_WINDOW,
+    RUB_RECONCILE_STALE_BATCH,
     ADMIN_IDS,
 )
 from database import db
-from keyboards import main_menu_keyboard, back_btn
+from memdebug import watch
+from message_store import tracked_messages, STARS_INVOICE, STARS_BACK
+from metrics import PAYMENTS
+from middlewares import answer_callback
+from pricing import catalog, reload_catalog, describe_catalog
+from keyboards import main_menu_keyboard, back_btn, back_keyboard
+from routing import get_callback_router
+from stats import stats
 from states import BalanceStates
+from yookassa_client import YooKassaError, yookassa
 from utils import (
     safe_answer,
     safe_send_message,
     safe_send_invoice,
     safe_edit_text,
     safe_delete_message,
+    PRIORITY_CRITICAL,
 )
 
 logger = logging.getLogger(__name__)
 
 # YooKassa настройка
 
-if YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY:
-    Configuration.account_id = YOOKASSA_SHOP_ID
-    Configuration.secret_key = YOOKASSA_SECRET_KEY
-else:
+if not yookassa.configured:
     logger.warning("YooKassa не настроена: нет YOOKASSA_SHOP_ID/YOOKASSA_SECRET_KEY")
 
 
-# Пакеты Stars и RUB
+# Клавиатуры пополнения не зависят от пользователя — строим один раз
+# (клавиатуры пакетов собирает каталог цен, см. pricing.py)
 
-# Stars → токены
-STAR_PACKS: Dict[str, Dict[str, int | str]] = {
-    "20":  {"stars": 20,  "tokens": 30,  "title": "⭐ 20 звёзд → 30 токенов"},
-    "60":  {"stars": 60,  "tokens": 100, "title": "⭐ 60 звёзд → 100 токенов"},
-    "120": {"stars": 120, "tokens": 200, "title": "⭐ 120 звёзд → 200 токенов"},
-    "300": {"stars": 300, "tokens": 500, "title": "⭐ 300 звёзд → 500 токенов"},
-}
-
-# RUB → токены
-RUB_PACKS: Dict[str, Dict[str, int]] = {
-    "30":  {"rubles": 30,  "tokens": 30},
-    "100": {"rubles": 100, "tokens": 100},
-    "200": {"rubles": 200, "tokens": 200},
-    "500": {"rubles": 500, "tokens": 500},
-}
+TOPUP_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="⭐ Звёзды", callback_data="pay_stars")],
+        [InlineKeyboardButton(text="💵 Рубли (YooKassa)", callback_data="pay_rub")],
+        [back_btn("back_to_main")],
+    ]
+)
 
-# Последний инвойс Stars для удаления
-LAST_INVOICE_MSG: Dict[int, int] = {}
-# Последнее сообщение с кнопкой "Назад" под инвойсом
-LAST_BACK_MSG: Dict[int, int] = {}
+STARS_BACK_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="stars_back")]
+    ]
+)
 
 # Fallback, если нет идемпотентного метода в БД
 APPLIED_CHARGES: set[str] = set()
+watch("applied_charges", lambda: len(APPLIED_CHARGES), "Charge ids in the in-memory fallback set")
 
 
 # Баланс / Пополнение
@@ -97,17 +100,10 @@ async def menu_topup_cb(callback: CallbackQuery, state: FSMContext):
     Кнопка '💳 Пополнить баланс' (callback_data='menu_topup').
     Выбор способа: Stars / YooKassa.
     """
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="⭐ Звёзды", callback_data="pay_stars")],
-            [InlineKeyboardButton(text="💵 Рубли (YooKassa)", callback_data="pay_rub")],
-            [back_btn("back_to_main")],
-        ]
-    )
     await safe_edit_text(
         callback.message,
         "💳 Выберите способ пополнения:",
-        reply_markup=kb,
+        reply_markup=TOPUP_KEYBOARD,
     )
     await state.set_state(BalanceStates.waiting_for_payment_method)
 
@@ -154,6 +150,7 @@ async def cmd_give_tokens(message: Message):
         return
 
     await db.add_generations(target_id, amount)
+    stats.record("tokens_granted", "admin", total=amount)
     await safe_answer(
         message,
         f"✅ Пользователю <b>{target_id}</b> начислено <b>{amount}</b> токенов.",
@@ -167,26 +164,35 @@ async def cmd_give_tokens(message: Message):
     )
 
 
+async def cmd_reload_prices(message: Message):
+    """
+    /reload_prices — перечитать каталог цен без рестарта (только для админов).
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await safe_answer(message, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    try:
+        new = reload_catalog()
+    except Exception as e:
+        logger.exception("reload_catalog failed")
+        await safe_answer(message, f"❌ Цены не обновлены, действуют прежние.\n{e}")
+        return
+
+    await safe_answer(message, "✅ Цены обновлены:\n" + "\n".join(describe_catalog(new)))
+
+
 # Stars: выбор пакета
 
 async def pay_stars_cb(callback: CallbackQuery, state: FSMContext):
     """
     Кнопка '⭐ Звёзды' (pay_stars) — выбор пакета.
     """
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=STAR_PACKS["20"]["title"],  callback_data="stars_20")],
-            [InlineKeyboardButton(text=STAR_PACKS["60"]["title"],  callback_data="stars_60")],
-            [InlineKeyboardButton(text=STAR_PACKS["120"]["title"], callback_data="stars_120")],
-            [InlineKeyboardButton(text=STAR_PACKS["300"]["title"], callback_data="stars_300")],
-            [back_btn("menu_topup")],
-        ]
-    )
     await safe_edit_text(
         callback.message,
         "⭐ Выберите пакет для пополнения:\n"
         "Дешево звёзды можно купить тут — @cheapiest_star_bot",
-        reply_markup=kb,
+        reply_markup=catalog().stars_packs_keyboard,
     )
 
 
@@ -198,14 +204,12 @@ async def stars_package_cb(callback: CallbackQuery):
     uid = callback.from_user.id
     pack = callback.data.split("_")[1]  # "20" | "60" | "120" | "300"
 
-    if pack not in STAR_PACKS:
-        try:
-            await callback.answer("❌ Неверный пакет", show_alert=True)
-        except Exception:
-            pass
+    star_packs = catalog().star_packs
+    if pack not in star_packs:
+        await answer_callback(callback, "❌ Неверный пакет", show_alert=True)
         return
 
-    pkg = STAR_PACKS[pack]
+    pkg = star_packs[pack]
 
     payload = json.dumps({
         "kind": "stars_pack",
@@ -237,20 +241,16 @@ async def stars_package_cb(callback: CallbackQuery):
 
     if msg:
         # сохраняем id инвойса
-        LAST_INVOICE_MSG[uid] = msg.message_id
+        await tracked_messages.put(uid, STARS_INVOICE, msg.message_id)
 
         # отправляем сообщение с кнопкой "Назад" напрямую (не через safe_send_message)
         try:
             back_msg = await bot.send_message(
                 uid,
                 "↩️ Если передумали — нажмите «Назад», инвойс будет удалён.",
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text="⬅️ Назад", callback_data="stars_back")]
-                    ]
-                ),
+                reply_markup=STARS_BACK_KEYBOARD,
             )
-            LAST_BACK_MSG[uid] = back_msg.message_id
+            await tracked_messages.put(uid, STARS_BACK, back_msg.message_id)
         except Exception as e:
             logger.exception(f"Не удалось отправить сообщение с кнопкой 'Назад': {e}")
 
@@ -262,10 +262,7 @@ async def stars_package_cb(callback: CallbackQuery):
         )
 
     # закрываем "часики" у пользователя
-    try:
-        await callback.answer()
-    except Exception:
-        pass
+    await answer_callback(callback)
 
 
 async def stars_back_cb(callback: CallbackQuery):
@@ -276,38 +273,21 @@ async def stars_back_cb(callback: CallbackQuery):
     bot = callback.message.bot
     uid = callback.from_user.id
 
-    # Удаляем инвойс, если есть
-    inv_mid = LAST_INVOICE_MSG.pop(uid, None)
-    if inv_mid:
-        await safe_delete_message(bot, uid, inv_mid)
-
-    # Удаляем сообщение с кнопкой "Назад"
-    back_mid = LAST_BACK_MSG.pop(uid, None)
-    if back_mid:
-        await safe_delete_message(bot, uid, back_mid)
+    # Удаляем инвойс и сообщение с кнопкой "Назад", если есть
+    tracked = await tracked_messages.pop(uid, STARS_INVOICE, STARS_BACK)
+    for mid in tracked.values():
+        await safe_delete_message(bot, uid, mid)
 
     # Показываем выбор пакетов звёзд
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=STAR_PACKS["20"]["title"],  callback_data="stars_20")],
-            [InlineKeyboardButton(text=STAR_PACKS["60"]["title"],  callback_data="stars_60")],
-            [InlineKeyboardButton(text=STAR_PACKS["120"]["title"], callback_data="stars_120")],
-            [InlineKeyboardButton(text=STAR_PACKS["300"]["title"], callback_data="stars_300")],
-            [back_btn("menu_topup")],
-        ]
-    )
     await safe_send_message(
         bot,
         uid,
         "⭐ Выберите пакет для пополнения:\n"
         "Дешево звёзды можно купить тут — @cheapiest_star_bot",
-        reply_markup=kb,
+        reply_markup=catalog().stars_packs_keyboard,
     )
 
-    try:
-        await callback.answer()
-    except Exception:
-        pass
+    await answer_callback(callback)
 
 
 # Stars: pre-checkout + успешная оплата
@@ -368,17 +348,22 @@ async def on_successful_stars_payment(message: Message):
                 applied = True
     except Exception:
         logger.exception("apply_star_payment error")
+        PAYMENTS.labels("stars", "error").inc()
         try:
             await db.add_generations(uid, tokens)
             applied = True
         except Exception:
             logger.exception("add_generations fallback error")
 
+    PAYMENTS.labels("stars", "credited" if applied else "duplicate").inc()
     if applied:
+        stats.record("revenue", "stars", total=stars_paid)
+        stats.record("tokens_sold", "stars", total=tokens)
         await safe_answer(
             message,
             f"✅ Оплата получена: {stars_paid} ⭐\n"
             f"🪙 Начислено: {tokens} токенов\nСпасибо! 🎉",
+            priority=PRIORITY_CRITICAL,
         )
     else:
         await safe_answer(
@@ -389,22 +374,24 @@ async def on_successful_stars_payment(message: Message):
     # Удаляем чек (текущее сообщение), инвойс и сообщение "Назад"
     await safe_delete_message(message.bot, message.chat.id, message.message_id)
 
-    inv_mid = LAST_INVOICE_MSG.pop(uid, None)
-    if inv_mid:
-        await safe_delete_message(message.bot, message.chat.id, inv_mid)
-
-    back_mid = LAST_BACK_MSG.pop(uid, None)
-    if back_mid:
-        await safe_delete_message(message.bot, message.chat.id, back_mid)
+    tracked = await tracked_messages.pop(uid, STARS_INVOICE, STARS_BACK)
+    for mid in tracked.values():
+        await safe_delete_message(message.bot, message.chat.id, mid)
 
 
 # YooKassa: создание платежа
 
-def create_yookassa_payment(amount_rub: int, user_id: int, tokens: int):
+async def create_yookassa_payment(
+    amount_rub: int,
+    user_id: int,
+    tokens: int,
+    idempotence_key: Optional[str] = None,
+):
     """
-    Создаёт платёж в YooKassa (синхронный вызов).
+    Создаёт платёж в YooKassa (асинхронно, через общий пул соединений).
+    Возвращает (confirmation_url, payment_id, created_at по часам YooKassa).
     """
-    payment = Payment.create({
+    payment = await yookassa.create_payment({
         "amount": {
             "value": f"{amount_rub:.2f}",
             "currency": "RUB",
@@ -433,8 +420,12 @@ def create_yookassa_payment(amount_rub: int, user_id: int, tokens: int):
                 "vat_code": "1",
             }],
         },
-    })
-    return payment.confirmation.confirmation_url, payment.id
+    }, idempotence_key=idempotence_key)
+    return (
+        payment["confirmation"]["confirmation_url"],
+        payment["id"],
+        _parse_yookassa_time(payment.get("created_at")),
+    )
 
 
 # YooKassa: хендлеры
@@ -443,38 +434,14 @@ async def pay_rub_cb(callback: CallbackQuery, state: FSMContext):
     """
     Кнопка '💵 Рубли (YooKassa)' — выбор рублёвого пакета.
     """
-    if not (YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY):
-        try:
-            await callback.answer("YooKassa не настроена", show_alert=True)
-        except Exception:
-            pass
+    if not yookassa.configured:
+        await answer_callback(callback, "YooKassa не настроена", show_alert=True)
         return
 
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(
-                text=f"💵 {RUB_PACKS['30']['rubles']}₽ → {RUB_PACKS['30']['tokens']} токенов",
-                callback_data="rubles_30"
-            )],
-            [InlineKeyboardButton(
-                text=f"💵 {RUB_PACKS['100']['rubles']}₽ → {RUB_PACKS['100']['tokens']} токенов",
-                callback_data="rubles_100"
-            )],
-            [InlineKeyboardButton(
-                text=f"💵 {RUB_PACKS['200']['rubles']}₽ → {RUB_PACKS['200']['tokens']} токенов",
-                callback_data="rubles_200"
-            )],
-            [InlineKeyboardButton(
-                text=f"💵 {RUB_PACKS['500']['rubles']}₽ → {RUB_PACKS['500']['tokens']} токенов",
-                callback_data="rubles_500"
-            )],
-            [back_btn("menu_topup")],
-        ]
-    )
     await safe_edit_text(
         callback.message,
         "💵 Выберите пакет для пополнения (YooKassa):",
-        reply_markup=kb,
+        reply_markup=catalog().rub_packs_keyboard,
     )
 
 
@@ -482,34 +449,31 @@ async def rubles_package_cb(callback: CallbackQuery):
     """
     Выбор пакета RUB → токены (rubles_30 / rubles_100 / ...).
     """
-    bot = callback.message.bot
-
-    if not (YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY):
-        try:
-            await callback.answer("YooKassa не настроена", show_alert=True)
-        except Exception:
-            pass
+    if not yookassa.configured:
+        await answer_callback(callback, "YooKassa не настроена", show_alert=True)
         return
 
     uid = callback.from_user.id
     pack = callback.data.split("_")[1]
 
-    if pack not in RUB_PACKS:
-        try:
-            await callback.answer("❌ Неверный пакет", show_alert=True)
-        except Exception:
-            pass
+    rub_packs = catalog().rub_packs
+    if pack not in rub_packs:
+        await answer_callback(callback, "❌ Неверный пакет", show_alert=True)
         return
 
-    pkg = RUB_PACKS[pack]
+    pkg = rub_packs[pack]
 
     try:
-        pay_url, pay_id = await asyncio.to_thread(
-            create_yookassa_payment,
+        # повторная доставка того же нажатия не создаст второй платёж
+        pay_url, pay_id, pay_created_at = await create_yookassa_payment(
             pkg["rubles"],
             uid,
             pkg["tokens"],
+            idempotence_key=f"tg-cb-{callback.id}",
         )
+        # дальше платёж живёт в БД: зачисление — по вебхуку или сверке
+        await db.create_rub_payment(pay_id, uid, pkg["rubles"], pkg["tokens"], pay_created_at)
+        PAYMENTS.labels("rub", "created").inc()
 
         await safe_edit_text(
             callback.message,
@@ -523,62 +487,197 @@ async def rubles_package_cb(callback: CallbackQuery):
             ),
         )
 
-        # фоновая проверка статуса
-        async def _check():
-            try:
-                for _ in range(30):
-                    payment = await asyncio.to_thread(Payment.find_one, pay_id)
-                    status = getattr(payment, "status", None)
-
-                    if status == "succeeded":
-                        await db.add_generations(uid, pkg["tokens"])
-                        await safe_send_message(
-                            bot,
-                            uid,
-                            f"""
-✅ Оплата {payment.amount.value}₽ получена.
-🪙 Начислено {pkg['tokens']} токенов.
-                            """,
-                            reply_markup=main_menu_keyboard()
-                        )
-                        return
-
-                    if status in ("canceled", "expired"):
-                        await safe_send_message(
-                            bot,
-                            uid,
-                            "❌ Оплата не завершена или отменена.",
-                        )
-                        return
-
-                    await asyncio.sleep(10)
-
-                await safe_send_message(
-                    bot,
-                    uid,
-                    "⌛ Время ожидания оплаты истекло. Если оплатили — напишите в поддержку.",
-                )
-            except Exception:
-                logger.exception("Ошибка при проверке статуса YooKassa")
-                await safe_send_message(
-                    bot,
-                    uid,
-                    "❌ Ошибка при проверке оплаты. Если списало — свяжитесь с поддержкой.",
-                )
-
-        asyncio.create_task(_check())
-
     except Exception:
         logger.exception("Ошибка при создании платежа YooKassa")
+        PAYMENTS.labels("rub", "create_error").inc()
         await safe_edit_text(
             callback.message,
             "❌ Не удалось создать платёж. Попробуйте позже.",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[back_btn("pay_rub")]],
-            ),
+            reply_markup=back_keyboard("pay_rub"),
         )
 
 
+# YooKassa: зачисление (вебхук + сверка)
+
+async def settle_rub_payment(bot, payment: Dict[str, Any]) -> None:
+    """
+    Применяет итоговый статус платежа YooKassa (объект payment из API).
+    Зачисление идемпотентно: повторный вебхук или сверка ничего не изменят.
+    """
+    status = payment.get("status")
+    if status not in ("succeeded", "canceled"):
+        return
+
+    pay_id = payment["id"]
+    meta = payment.get("metadata") or {}
+
+    # Платёж мог не записаться в БД при создании — восстанавливаем из metadata
+    try:
+        await db.create_rub_payment(
+            pay_id,
+            int(meta["user_id"]),
+            int(float(payment["amount"]["value"])),
+            int(meta["tokens"]),
+            _parse_yookassa_time(payment.get("created_at")),
+        )
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    row = await db.settle_rub_payment(pay_id, status)
+    if not row:
+        return  # уже обработан или не наш
+
+    await _notify_rub_settled(bot, row, payment)
+
+
+async def _notify_rub_settled(bot, row: Dict[str, Any], payment: Dict[str, Any]) -> None:
+    """
+    Сообщение пользователю после того, как платёж перешёл в итоговый статус.
+    """
+    uid = row["user_id"]
+    PAYMENTS.labels("rub", row["status"]).inc()
+    if row["status"] == "succeeded":
+        logger.info("YooKassa: credited %d tokens to %s (payment %s)", row["tokens"], uid, row["payment_id"])
+        await safe_send_message(
+            bot,
+            uid,
+            f"""
+✅ Оплата {payment["amount"]["value"]}₽ получена.
+🪙 Начислено {row['tokens']} токенов.
+            """,
+            reply_markup=main_menu_keyboard(),
+            priority=PRIORITY_CRITICAL,
+        )
+    else:
+        await safe_send_message(
+            bot,
+            uid,
+            "❌ Оплата не завершена или отменена.",
+        )
+
+
+async def handle_yookassa_notification(bot, event: Dict[str, Any]) -> None:
+    """
+    HTTP-уведомление YooKassa (payment.succeeded / payment.canceled).
+    Телу уведомления не доверяем: статус перечитываем из API.
+    """
+    if event.get("event") not in ("payment.succeeded", "payment.canceled"):
+        return
+    pay_id = (event.get("object") or {}).get("id")
+    if not pay_id:
+        return
+    payment = await yookassa.get_payment(pay_id)
+    await settle_rub_payment(bot, payment)
+
+
+# Сколько итоговых платежей применяем одной транзакцией
+RECONCILE_BATCH = 200
+# Запас курсора назад: расхождение часов и старые записи без provider_created_at
+# (наш created_at позже, чем у YooKassa, на время запроса и повторов)
+RECONCILE_CURSOR_MARGIN = timedelta(minutes=5)
+
+
+def _yookassa_time(dt: datetime) -> str:
+    """datetime → формат фильтров YooKassa: 2024-01-31T12:00:00.000Z"""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _parse_yookassa_time(value: Optional[str]) -> Optional[datetime]:
+    """2024-01-31T12:00:00.000Z → datetime (UTC); None, если разобрать нельзя."""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+async def _apply_rub_batch(bot, payments: Dict[str, Dict[str, Any]]) -> int:
+    rows = await db.settle_rub_payments_batch(
+        [(pay_id, p["status"]) for pay_id, p in payments.items()]
+    )
+    for row in rows:
+        await _notify_rub_settled(bot, row, payments[row["payment_id"]])
+    return len(rows)
+
+
+async def _sweep_stale_rub_payments(bot) -> int:
+    """
+    Платежи, которые висят в pending дольше окна списка: перечитываем по id,
+    не больше RUB_RECONCILE_STALE_BATCH за проход. Неоплаченный платёж YooKassa
+    сама отменяет, когда истекает подтверждение, — тогда он и закроется.
+    Неизвестный YooKassa платёж (404) закрываем как canceled без уведомления.
+    """
+    ids = await db.get_stale_pending_rub_payments(RUB_RECONCILE_WINDOW, RUB_RECONCILE_STALE_BATCH)
+    if not ids:
+        return 0
+
+    final: Dict[str, Dict[str, Any]] = {}
+    unknown = []
+    for pay_id in ids:
+        try:
+            payment = await yookassa.get_payment(pay_id)
+        except YooKassaError as e:
+            if e.status == 404:
+                unknown.append(pay_id)
+                continue
+            raise
+        if payment.get("status") in ("succeeded", "canceled"):
+            final[pay_id] = payment
+
+    settled = await _apply_rub_batch(bot, final) if final else 0
+    if unknown:
+        logger.warning("YooKassa reconcile: payments unknown to YooKassa, canceled: %s", unknown)
+        settled += len(await db.settle_rub_payments_batch([(pay_id, "canceled") for pay_id in unknown]))
+    # оставшиеся pending — в конец очереди, чтобы следующий проход брал другие
+    await db.touch_rub_payments([pay_id for pay_id in ids if pay_id not in final and pay_id not in unknown])
+    return settled
+
+
+async def reconcile_rub_payments(bot) -> int:
+    """
+    Страховочная сверка: платежи, по которым вебхук так и не пришёл.
+
+    Вместо опроса каждого платежа — один постраничный список YooKassa
+    начиная с самого старого нашего pending за последние RUB_RECONCILE_WINDOW
+    (он и есть курсор: живёт в БД и переживает рестарт). Курсор — время
+    создания по часам YooKassa с запасом RECONCILE_CURSOR_MARGIN, иначе
+    самый старый платёж выпадает из фильтра created_at.gte. Итоговые статусы
+    применяются пакетами, одна транзакция на пакет. Платежи старше окна
+    перечитываются по id (_sweep_stale_rub_payments), так что один зависший
+    платёж не растягивает список. Возвращает число обработанных платежей.
+    """
+    settled = await _sweep_stale_rub_payments(bot)
+
+    since = await db.get_oldest_pending_rub_payment(RUB_RECONCILE_MIN_AGE, RUB_RECONCILE_WINDOW)
+    if since is not None:
+        since -= RECONCILE_CURSOR_MARGIN
+        batch: Dict[str, Dict[str, Any]] = {}
+        async for payment in yookassa.iter_payments(**{"created_at.gte": _yookassa_time(since)}):
+            if payment.get("status") not in ("succeeded", "canceled"):
+                continue
+            batch[payment["id"]] = payment
+            if len(batch) >= RECONCILE_BATCH:
+                settled += await _apply_rub_batch(bot, batch)
+                batch = {}
+        if batch:
+            settled += await _apply_rub_batch(bot, batch)
+
+    if settled:
+        logger.info("YooKassa reconcile: settled %d payments since %s", settled, since)
+    return settled
+
+
+async def run_rub_reconciler(bot) -> None:
+    """Фоновый цикл сверки RUB-платежей."""
+    while True:
+        await asyncio.sleep(RUB_RECONCILE_INTERVAL)
+        if not yookassa.configured:
+            continue
+        try:
+            await reconcile_rub_payments(bot)
+        except Exception:
+            logger.exception("YooKassa reconcile loop error")
+
+
 # Регистрация хендлеров
 
 def register_payment_handlers(dp: Dispatcher) -> None:
@@ -587,23 +686,26 @@ def register_payment_handlers(dp: Dispatcher) -> None:
     - баланс / пополнение
     - Stars (инвойсы, успешные платежи)
     - YooKassa
-    - /get_id, /give_tokens
+    - /get_id, /give_tokens, /reload_prices
     """
+    callbacks = get_callback_router(dp)
+
     # Меню: баланс / пополнение
-    dp.callback_query.register(menu_balance_cb, F.data == "menu_balance")
-    dp.callback_query.register(menu_topup_cb, F.data == "menu_topup")
+    callbacks.exact("menu_balance", menu_balance_cb)
+    callbacks.exact("menu_topup", menu_topup_cb)
 
     # Stars
-    dp.callback_query.register(pay_stars_cb, F.data == "pay_stars")
-    dp.callback_query.register(stars_back_cb, F.data == "stars_back")
-    dp.callback_query.register(stars_package_cb, F.data.startswith("stars_"))
+    callbacks.exact("pay_stars", pay_stars_cb)
+    callbacks.exact("stars_back", stars_back_cb)
+    callbacks.prefix("stars_", stars_package_cb)
     dp.pre_checkout_query.register(on_pre_checkout)
     dp.message.register(on_successful_stars_payment, F.successful_payment)
 
     # YooKassa
-    dp.callback_query.register(pay_rub_cb, F.data == "pay_rub")
-    dp.callback_query.register(rubles_package_cb, F.data.startswith("rubles_"))
+    callbacks.exact("pay_rub", pay_rub_cb)
+    callbacks.prefix("rubles_", rubles_package_cb)
 
     # Команды
     dp.message.register(cmd_get_id, Command("get_id"))
     dp.message.register(cmd_give_tokens, Command("give_tokens"))
+    dp.message.register(cmd_reload_prices, Command("reload_prices"))
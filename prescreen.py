@@ -0,0 +1,247 @@
+# prescreen.py
+"""
+Предварительная проверка промпта до подтверждения генерации.
+
+KIE отклоняет часть задач по правилам модерации уже после списания токенов
+и createTask: возврат, лишний вызов API и минуты ожидания. Поэтому промпт
+сначала проверяется локально по списку терминов:
+- reject — промпт не принимаем, просим переформулировать;
+- warn   — показываем предупреждение рядом с подтверждением;
+- allow  — термин отключён (админом), обучение его не вернёт.
+
+Список: PROMPT_TERMS_FILE (JSON {"reject": [...], "warn": [...]}) плюс таблица
+prescreen_terms (добавленные админом и выученные). Из него один раз строится
+автомат Ахо — Корасик (TermMatcher): проверка — один проход по тексту,
+независимо от числа терминов. Перестройка — reload_screen() по SIGHUP
+или /prescreen reload, текущий автомат подменяется атомарно.
+
+Обратная связь: по итогу каждой генерации слова промпта учитываются
+в prompt_words (сколько раз встречались и сколько раз KIE отклонил за
+нарушение правил). Слово, которое PRESCREEN_LEARN_MIN_REJECTIONS раз
+попало в отклонённые промпты и хотя бы в половине случаев с ним был отказ,
+добавляется как warn.
+"""
+import json
+import logging
+import re
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from config import PRESCREEN_LEARN_MIN_REJECTIONS, PROMPT_TERMS_FILE
+from database import db
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+PRESCREEN_VERDICTS = counter(
+    "bot_prescreen_verdicts_total",
+    "Local prompt pre-screen verdicts",
+    ("engine", "action"),
+)
+
+REJECT = "reject"
+WARN = "warn"
+ALLOW = "allow"
+OK = "ok"
+ACTIONS = (REJECT, WARN, ALLOW)
+
+# Признаки отказа KIE по правилам модерации (в failMsg / errorMessage)
+_POLICY_MARKERS = (
+    "policy", "violat", "flagged", "moderation", "prohibited",
+    "sensitive", "nsfw", "inappropriate", "not allowed",
+)
+
+# Слова короче не учитываем (предлоги, союзы), больше MAX_WORDS с промпта не берём
+_WORD_RE = re.compile(r"\w{4,}")
+MAX_WORDS = 64
+
+
+def normalize(term: str) -> str:
+    return " ".join(term.lower().replace("ё", "е").split())
+
+
+def is_policy_failure(fail_msg: Optional[str]) -> bool:
+    msg = (fail_msg or "").lower()
+    return any(marker in msg for marker in _POLICY_MARKERS)
+
+
+def prompt_words(prompt: str) -> List[str]:
+    words = dict.fromkeys(_WORD_RE.findall(normalize(prompt)))
+    return list(words)[:MAX_WORDS]
+
+
+#  АВТОМАТ АХО — КОРАСИК
+
+class TermMatcher:
+    """
+    Поиск всех терминов в тексте за один проход. Термин засчитывается,
+    только если стоит целым словом (или фразой): «ass» не найдётся в «class».
+    """
+
+    __slots__ = ("_goto", "_fail", "_out", "size")
+
+    def __init__(self, terms: Iterable[str]):
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Tuple[str, ...]] = [()]
+        self.size = 0
+        for term in terms:
+            node = 0
+            for ch in term:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    goto.append({})
+                    out.append(())
+                    nxt = goto[node][ch] = len(goto) - 1
+                node = nxt
+            if node and term not in out[node]:
+                out[node] += (term,)
+                self.size += 1
+
+        # fail-ссылки обходом в ширину; выходы наследуются по fail-ссылке
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[child] = target if target != child else 0
+                out[child] += out[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def find(self, text: str) -> List[str]:
+        """Термины, найденные в уже нормализованном тексте (без повторов)."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found: List[str] = []
+        node = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                if i < last and text[i + 1].isalnum():
+                    continue
+                for term in out[node]:
+                    start = i - len(term) + 1
+                    if (start == 0 or not text[start - 1].isalnum()) and term not in found:
+                        found.append(term)
+        return found
+
+
+#  ПРОВЕРКА
+
+class Verdict(NamedTuple):
+    action: str          # ok / warn / reject
+    terms: List[str]
+
+
+class PromptScreen:
+    """Скомпилированный список терминов; не меняется после создания."""
+
+    def __init__(self, terms: Dict[str, str]):
+        self.actions = {t: a for t, a in terms.items() if a != ALLOW}
+        self.matcher = TermMatcher(self.actions)
+
+    def check(self, prompt: str) -> Verdict:
+        found = self.matcher.find(normalize(prompt))
+        if not found:
+            return Verdict(OK, [])
+        rejected = [t for t in found if self.actions[t] == REJECT]
+        if rejected:
+            return Verdict(REJECT, rejected)
+        return Verdict(WARN, found)
+
+
+def _load_file_terms() -> Dict[str, str]:
+    terms: Dict[str, str] = {}
+    if PROMPT_TERMS_FILE:
+        with open(PROMPT_TERMS_FILE, encoding="utf-8") as f:
+            source = json.load(f)
+        for action in (WARN, REJECT):
+            for term in source.get(action, []):
+                if normalize(term):
+                    terms[normalize(term)] = action
+    return terms
+
+
+_screen = PromptScreen({})
+
+
+def screen() -> PromptScreen:
+    return _screen
+
+
+def check_prompt(engine: str, prompt: str) -> Verdict:
+    verdict = _screen.check(prompt or "")
+    PRESCREEN_VERDICTS.labels(engine, verdict.action).inc()
+    return verdict
+
+
+async def reload_screen() -> PromptScreen:
+    """
+    Перечитать файл и таблицу терминов и подменить автомат. Записи
+    из БД важнее файла (админ может понизить или отключить термин).
+    При ошибке бросает исключение, прежний автомат остаётся в силе.
+    """
+    global _screen
+    terms = _load_file_terms()
+    for row in await db.get_prescreen_terms():
+        terms[row["term"]] = row["action"]
+    new = PromptScreen(terms)
+    _screen = new
+    logger.info(f"Prompt pre-screen compiled: {new.matcher.size} terms")
+    return new
+
+
+def reject_text(verdict: Verdict) -> str:
+    terms = ", ".join(f"«{t}»" for t in verdict.terms)
+    return (
+        f"🚫 Такой промпт почти наверняка отклонит модерация ({terms}).\n"
+        "Токены не списаны — измените описание и отправьте его снова."
+    )
+
+
+def warn_text(verdict: Verdict) -> str:
+    terms = ", ".join(f"«{t}»" for t in verdict.terms)
+    return f"⚠️ Промпт может не пройти модерацию ({terms}) — тогда токены вернутся."
+
+
+#  ОБРАТНАЯ СВЯЗЬ ОТ KIE
+
+async def learn(prompt: Optional[str], rejected: bool) -> None:
+    """
+    Учесть итог генерации: rejected — KIE отказал по правилам модерации.
+    Новые выученные термины сразу попадают в автомат.
+    """
+    words = prompt_words(prompt or "")
+    if not words:
+        return
+    try:
+        # строки prompt_words блокируются в порядке слов: всегда по алфавиту,
+        # иначе параллельные итоги с общими словами ловят deadlock
+        promoted = await db.observe_prompt_words(sorted(words), rejected, PRESCREEN_LEARN_MIN_REJECTIONS)
+        if promoted:
+            logger.warning(f"Prompt pre-screen learned from KIE rejections: {', '.join(promoted)}")
+            await reload_screen()
+    except Exception:
+        logger.exception("prescreen: failed to record KIE outcome")
+
+
+def describe_screen(scr: PromptScreen, limit: int = 50) -> List[str]:
+    """Короткая сводка для админа."""
+    by_action: Dict[str, List[str]] = {REJECT: [], WARN: []}
+    for term, action in scr.actions.items():
+        by_action[action].append(term)
+    lines = [f"терминов: {scr.matcher.size}"]
+    for action, terms in by_action.items():
+        shown = ", ".join(sorted(terms)[:limit])
+        more = f" … +{len(terms) - limit}" if len(terms) > limit else ""
+        lines.append(f"{action} ({len(terms)}): {shown or '—'}{more}")
+    return lines
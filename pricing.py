@@ -0,0 +1,254 @@
+# pricing.py
+import json
+import logging
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import (
+    PRICING_FILE,
+    SORA2_COST_10S,
+    SORA2_COST_15S,
+    SORA2_PRO_STD_10S,
+    SORA2_PRO_STD_15S,
+    SORA2_PRO_HD_10S,
+    SORA2_PRO_HD_15S,
+    VEO_FAST_COST,
+    VEO_QUALITY_COST,
+)
+from keyboards import back_btn
+
+logger = logging.getLogger(__name__)
+
+
+# Ключ цены генерации: (engine, tier, quality, duration)
+#   Sora: ("sora", "sora2" | "sora2_pro", None | "std" | "high", 10 | 15)
+#   Veo:  ("veo", "veo3_fast" | "veo3", None, None)
+PriceKey = Tuple[str, str, Optional[str], Optional[int]]
+
+
+#  ЦЕНЫ ПО УМОЛЧАНИЮ (из .env, как раньше)
+
+def _default_source() -> Dict[str, Any]:
+    return {
+        "generation": [
+            {"engine": "sora", "tier": "sora2", "duration": 10, "cost": SORA2_COST_10S},
+            {"engine": "sora", "tier": "sora2", "duration": 15, "cost": SORA2_COST_15S},
+            {"engine": "sora", "tier": "sora2_pro", "quality": "std", "duration": 10, "cost": SORA2_PRO_STD_10S},
+            {"engine": "sora", "tier": "sora2_pro", "quality": "std", "duration": 15, "cost": SORA2_PRO_STD_15S},
+            {"engine": "sora", "tier": "sora2_pro", "quality": "high", "duration": 10, "cost": SORA2_PRO_HD_10S},
+            {"engine": "sora", "tier": "sora2_pro", "quality": "high", "duration": 15, "cost": SORA2_PRO_HD_15S},
+            {"engine": "veo", "tier": "veo3_fast", "cost": VEO_FAST_COST},
+            {"engine": "veo", "tier": "veo3", "cost": VEO_QUALITY_COST},
+        ],
+        # Stars → токены
+        "star_packs": [
+            {"id": "20",  "stars": 20,  "tokens": 30},
+            {"id": "60",  "stars": 60,  "tokens": 100},
+            {"id": "120", "stars": 120, "tokens": 200},
+            {"id": "300", "stars": 300, "tokens": 500},
+        ],
+        # RUB → токены
+        "rub_packs": [
+            {"id": "30",  "rubles": 30,  "tokens": 30},
+            {"id": "100", "rubles": 100, "tokens": 100},
+            {"id": "200", "rubles": 200, "tokens": 200},
+            {"id": "500", "rubles": 500, "tokens": 500},
+        ],
+    }
+
+
+#  КАТАЛОГ
+
+class PricingCatalog:
+    """
+    Неизменяемый снимок цен: таблица цен генерации, пакеты Stars/RUB
+    и всё, что из них рендерится (тексты с ценами, клавиатуры пакетов).
+    Всё считается один раз при сборке; при перезагрузке собирается новый
+    каталог и подменяется целиком одной ссылкой.
+    """
+
+    def __init__(self, source: Dict[str, Any]):
+        costs: Dict[PriceKey, int] = {}
+        for item in source["generation"]:
+            key = (
+                item["engine"],
+                item["tier"],
+                item.get("quality"),
+                int(item["duration"]) if item.get("duration") is not None else None,
+            )
+            cost = int(item["cost"])
+            if cost <= 0:
+                raise ValueError(f"cost must be positive: {item}")
+            costs[key] = cost
+        self.costs: Mapping[PriceKey, int] = MappingProxyType(costs)
+
+        star_packs = {}
+        for p in source["star_packs"]:
+            star_packs[str(p["id"])] = MappingProxyType({
+                "stars": int(p["stars"]),
+                "tokens": int(p["tokens"]),
+                "title": f"⭐ {int(p['stars'])} звёзд → {int(p['tokens'])} токенов",
+            })
+        self.star_packs: Mapping[str, Mapping[str, Any]] = MappingProxyType(star_packs)
+
+        rub_packs = {}
+        for p in source["rub_packs"]:
+            rub_packs[str(p["id"])] = MappingProxyType({
+                "rubles": int(p["rubles"]),
+                "tokens": int(p["tokens"]),
+            })
+        self.rub_packs: Mapping[str, Mapping[str, Any]] = MappingProxyType(rub_packs)
+
+        # проверяем, что у всех вариантов FSM есть цена
+        for key in (
+            ("sora", "sora2", None, 10), ("sora", "sora2", None, 15),
+            ("sora", "sora2_pro", "std", 10), ("sora", "sora2_pro", "std", 15),
+            ("sora", "sora2_pro", "high", 10), ("sora", "sora2_pro", "high", 15),
+            ("veo", "veo3_fast", None, None), ("veo", "veo3", None, None),
+        ):
+            if key not in self.costs:
+                raise ValueError(f"missing price for {key}")
+
+        self.engine_select_text = self._render_engine_select_text()
+        self.duration_texts: Mapping[Tuple[Optional[str], Optional[str]], str] = MappingProxyType({
+            (tier, quality): self._render_duration_text(tier, quality)
+            for tier, quality in (
+                (None, None), ("sora2", None), ("sora2_pro", "std"), ("sora2_pro", "high"),
+            )
+        })
+        self.stars_packs_keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                *[
+                    [InlineKeyboardButton(text=pkg["title"], callback_data=f"stars_{pack}")]
+                    for pack, pkg in self.star_packs.items()
+                ],
+                [back_btn("menu_topup")],
+            ]
+        )
+        self.rub_packs_keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                *[
+                    [InlineKeyboardButton(
+                        text=f"💵 {pkg['rubles']}₽ → {pkg['tokens']} токенов",
+                        callback_data=f"rubles_{pack}",
+                    )]
+                    for pack, pkg in self.rub_packs.items()
+                ],
+                [back_btn("menu_topup")],
+            ]
+        )
+
+    #  Цены
+
+    def sora_cost(self, tier: str, quality: Optional[str], duration: int) -> int:
+        if tier != "sora2_pro":
+            return self.costs[("sora", "sora2", None, 15 if int(duration) >= 15 else 10)]
+        q = "high" if quality == "high" else "std"
+        return self.costs[("sora", "sora2_pro", q, 15 if int(duration) >= 15 else 10)]
+
+    def veo_cost(self, model: str) -> int:
+        return self.costs[("veo", "veo3_fast" if model == "veo3_fast" else "veo3", None, None)]
+
+    def duration_text(self, tier: Optional[str], quality: Optional[str]) -> str:
+        if not tier:
+            return self.duration_texts[(None, None)]
+        if tier == "sora2":
+            return self.duration_texts[("sora2", None)]
+        return self.duration_texts[("sora2_pro", "high" if quality == "high" else "std")]
+
+    #  Тексты
+
+    def _render_engine_select_text(self) -> str:
+        c = self.costs
+        return f"""
+Sora 2
+
+Продвинутая модель от OpenAI, которая делает очень реалистичные и плавные видео. Отлично подходит для красивых, кинематографичных роликов.
+
+Veo 3.1
+
+Современная модель от Google, которая быстро создаёт чёткие видео по тексту или фото. Идеальна для коротких и динамичных роликов.
+
+Цены:
+
+Sora 2:
+        - Standart 10s = {c[("sora", "sora2", None, 10)]}
+        - Standart 15s = {c[("sora", "sora2", None, 15)]}
+Sora 2 Pro:
+        - Standart 10s = {c[("sora", "sora2_pro", "std", 10)]}
+        - Standart 15s = {c[("sora", "sora2_pro", "std", 15)]}
+        - HD 10s = {c[("sora", "sora2_pro", "high", 10)]}
+        - HD 15s = {c[("sora", "sora2_pro", "high", 15)]}
+Veo 3.1:
+        - Fast = {c[("veo", "veo3_fast", None, None)]}
+        - Quality = {c[("veo", "veo3", None, None)]}
+
+    """
+
+    def _render_duration_text(self, tier: Optional[str], quality: Optional[str]) -> str:
+        if not tier:
+            return "Выберите длительность и ориентацию:"
+
+        if tier == "sora2":
+            return (
+                "Выберите длительность и ориентацию:\n\n"
+                f"🧠 *Sora 2*:\n"
+                f"• 10 с — *{self.sora_cost(tier, None, 10)}* токенов\n"
+                f"• 15 с — *{self.sora_cost(tier, None, 15)}* токенов"
+            )
+
+        header = "💎 *Sora 2 Pro (HD)*" if quality == "high" else "⚡ *Sora 2 Pro (Standard)*"
+        return (
+            "Выберите длительность и ориентацию:\n\n"
+            f"{header}:\n"
+            f"• 10 с — *{self.sora_cost(tier, quality, 10)}* токенов\n"
+            f"• 15 с — *{self.sora_cost(tier, quality, 15)}* токенов\n\n"
+            "⚠️ Видео в Sora 2 Pro может создаваться до *45 минут*."
+        )
+
+
+#  ЗАГРУЗКА / ПЕРЕЗАГРУЗКА
+
+def _load_source() -> Dict[str, Any]:
+    """
+    Цены по умолчанию (.env), поверх — секции из PRICING_FILE (JSON), если задан.
+    """
+    source = _default_source()
+    if PRICING_FILE:
+        with open(PRICING_FILE, encoding="utf-8") as f:
+            overrides = json.load(f)
+        for section in ("generation", "star_packs", "rub_packs"):
+            if section in overrides:
+                source[section] = overrides[section]
+    return source
+
+
+_catalog: PricingCatalog = PricingCatalog(_load_source())
+
+
+def catalog() -> PricingCatalog:
+    """Текущий каталог цен. Держите ссылку в пределах одного хендлера."""
+    return _catalog
+
+
+def reload_catalog() -> PricingCatalog:
+    """
+    Перечитать цены и атомарно подменить каталог.
+    При ошибке в файле бросает исключение, старый каталог остаётся в силе.
+    """
+    global _catalog
+    new = PricingCatalog(_load_source())
+    _catalog = new
+    logger.info(f"Pricing catalog reloaded ({len(new.costs)} prices, "
+                f"{len(new.star_packs)} star packs, {len(new.rub_packs)} rub packs)")
+    return new
+
+
+def describe_catalog(cat: PricingCatalog) -> List[str]:
+    """Короткая сводка для админа."""
+    lines = [f"{'/'.join(str(p) for p in key if p is not None)}: {cost}" for key, cost in cat.costs.items()]
+    lines += [f"stars_{k}: {v['stars']}⭐ → {v['tokens']}" for k, v in cat.star_packs.items()]
+    lines += [f"rubles_{k}: {v['rubles']}₽ → {v['tokens']}" for k, v in cat.rub_packs.items()]
+    return lines
@@ -0,0 +1,187 @@
+# profiler.py
+"""
+Сэмплирующий CPU-профайлер по запросу админа (/profile).
+
+Пока профиль не запущен — ничего не делает: ни потоков, ни хуков.
+На время профиля поднимается поток, который каждые PROFILE_INTERVAL_MS
+снимает стеки всех потоков процесса (sys._current_frames) — в первую
+очередь потока event loop — и раз в несколько замеров стеки ожидания
+всех asyncio-задач (Task.get_stack): видно, где висят опросы KIE и
+хендлеры, даже когда loop в это время свободен.
+
+Результат — collapsed stacks («a;b;c 12» на строку): подходит для
+flamegraph.pl, speedscope и inferno без конвертации. Корень стека:
+    thread:<имя потока>   — что реально исполнялось (on-CPU, в т.ч. select);
+    task:<имя задачи>     — где задача ждёт (wall-clock).
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Dict, List, Optional
+
+from config import PROFILE_INTERVAL_MS, PROFILE_MAX_SECONDS, PROFILE_TASK_EVERY
+from loop_monitor import task_label
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(RuntimeError):
+    """Профиль уже снимается."""
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}"
+
+
+def _collapse(root: str, frames: List[FrameType]) -> str:
+    """frames — от внешнего к внутреннему."""
+    return ";".join([root] + [_frame_label(f) for f in frames])
+
+
+def _thread_stack(frame: Optional[FrameType]) -> List[FrameType]:
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class ProfileResult:
+    def __init__(self, stacks: Counter, samples: int, task_samples: int, duration: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.task_samples = task_samples
+        self.duration = duration
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 10) -> List[tuple]:
+        """Самые «горячие» листовые функции потока event loop: (функция, доля)."""
+        leaves: Counter = Counter()
+        total = 0
+        for stack, count in self.stacks.items():
+            if not stack.startswith("thread:loop;"):
+                continue
+            leaves[stack.rsplit(";", 1)[-1]] += count
+            total += count
+        return [(name, count / total) for name, count in leaves.most_common(limit)] if total else []
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float, max_seconds: float, task_every: int):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.task_every = task_every
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def run(self, seconds: float, include_tasks: bool = True) -> ProfileResult:
+        """
+        Снять профиль длиной seconds (не больше PROFILE_MAX_SECONDS).
+        Второй профиль параллельно не запускается — ProfilerBusy.
+        """
+        with self._lock:
+            if self._running:
+                raise ProfilerBusy("profile already running")
+            self._running = True
+
+        try:
+            seconds = max(1.0, min(float(seconds), self.max_seconds))
+            loop = asyncio.get_running_loop()
+            stop = threading.Event()
+            stacks: Counter = Counter()
+            counts = {"samples": 0, "task_samples": 0}
+
+            thread = threading.Thread(
+                target=self._sample_loop,
+                args=(loop, threading.get_ident(), stop, stacks, counts, include_tasks),
+                name="profiler",
+                daemon=True,
+            )
+            logger.info(f"Profiler started for {seconds:.0f}s (interval {self.interval * 1000:.0f} ms)")
+            started = time.perf_counter()
+            thread.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(thread.join)
+            duration = time.perf_counter() - started
+            logger.info(f"Profiler finished: {counts['samples']} samples in {duration:.1f}s")
+            return ProfileResult(stacks, counts["samples"], counts["task_samples"], duration)
+        finally:
+            self._running = False
+
+    #  Поток сэмплирования
+
+    def _sample_loop(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        loop_thread: int,
+        stop: threading.Event,
+        stacks: Counter,
+        counts: Dict[str, int],
+        include_tasks: bool,
+    ) -> None:
+        me = threading.get_ident()
+        tick = 0
+        while not stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = "loop" if ident == loop_thread else names.get(ident, str(ident))
+                stacks[_collapse(f"thread:{name}", _thread_stack(frame))] += 1
+            counts["samples"] += 1
+
+            tick += 1
+            if include_tasks and self.task_every > 0 and tick % self.task_every == 0:
+                self._sample_tasks(loop, stacks)
+                counts["task_samples"] += 1
+
+    @staticmethod
+    def _sample_tasks(loop: asyncio.AbstractEventLoop, stacks: Counter) -> None:
+        # all_tasks из чужого потока может поймать изменение WeakSet — пробуем ещё раз
+        for _ in range(3):
+            try:
+                tasks = list(asyncio.all_tasks(loop))
+                break
+            except RuntimeError:
+                continue
+        else:
+            return
+
+        # задача, которая сейчас исполняется, уже попала в стек потока loop
+        running = asyncio.current_task(loop)
+        for task in tasks:
+            if task is running:
+                continue
+            try:
+                frames = task.get_stack()
+            except Exception:
+                continue
+            if not frames:
+                continue
+            name = task.get_name()
+            if name.startswith("Task-"):
+                # безымянная задача — по корутине
+                name = getattr(task.get_coro(), "__qualname__", "Task")
+            root = f"task:{task_label(name)}"
+            stacks[_collapse(root, frames)] += 1
+
+
+# Глобальный профайлер
+profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000, PROFILE_MAX_SECONDS, PROFILE_TASK_EVERY)
@@ -0,0 +1,141 @@
+# routing.py
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+from loop_monitor import set_handler_name
+from metrics import HANDLER_SECONDS, HANDLER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRoute:
+    """
+    Один маршрут: хендлер + (необязательно) набор FSM-состояний,
+    в которых он срабатывает.
+    """
+
+    __slots__ = ("handler", "name", "key", "states", "params", "takes_all")
+
+    def __init__(self, handler: Handler, key: str, states: Optional[FrozenSet[str]]):
+        self.handler = handler
+        self.name = handler.__name__
+        # callback_data (или "префикс*") — метка для метрик
+        self.key = key
+        self.states = states
+
+        # какие kwargs из data aiogram хендлер принимает — считаем один раз
+        sig = inspect.signature(handler)
+        self.takes_all = any(p.kind is p.VAR_KEYWORD for p in sig.parameters.values())
+        self.params = frozenset(list(sig.parameters)[1:])
+
+    def matches(self, raw_state: Optional[str]) -> bool:
+        return self.states is None or raw_state in self.states
+
+    async def call(self, callback: CallbackQuery, data: Dict[str, Any]) -> Any:
+        if self.takes_all:
+            return await self.handler(callback, **data)
+        return await self.handler(callback, **{k: v for k, v in data.items() if k in self.params})
+
+
+class CallbackRouter:
+    """
+    Маршрутизация callback_query по callback_data через словарь,
+    вместо линейного перебора десятков фильтров F.data == ... у Dispatcher.
+
+    - exact("menu_create", handler) — точное совпадение callback_data;
+    - prefix("stars_", handler) — всё, что начинается с "stars_"
+      (префикс — до первого "_" включительно).
+
+    Точное совпадение проверяется раньше префикса, поэтому "stars_back"
+    не попадёт в хендлер пакетов "stars_".
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, List[CallbackRoute]] = {}
+        self._prefix: Dict[str, List[CallbackRoute]] = {}
+
+    @staticmethod
+    def _states(states: Iterable[State]) -> Optional[FrozenSet[str]]:
+        states = tuple(states)
+        if not states:
+            return None
+        return frozenset(s.state for s in states)
+
+    def exact(self, data: str | Iterable[str], handler: Handler, *states: State) -> None:
+        keys = (data,) if isinstance(data, str) else tuple(data)
+        for key in keys:
+            self._exact.setdefault(key, []).append(CallbackRoute(handler, key, self._states(states)))
+
+    def prefix(self, prefix: str, handler: Handler, *states: State) -> None:
+        if not prefix.endswith("_") or prefix.count("_") != 1:
+            raise ValueError(f"prefix must look like 'word_', got {prefix!r}")
+        self._prefix.setdefault(prefix, []).append(
+            CallbackRoute(handler, prefix + "*", self._states(states))
+        )
+
+    def resolve(self, data: Optional[str], raw_state: Optional[str]) -> Optional[CallbackRoute]:
+        """
+        Найти маршрут для callback_data: O(1) поиск по словарю
+        + перебор только маршрутов с тем же ключом.
+        """
+        if not data:
+            return None
+        for route in self._exact.get(data, ()):
+            if route.matches(raw_state):
+                return route
+        sep = data.find("_")
+        if sep < 0:
+            return None
+        for route in self._prefix.get(data[: sep + 1], ()):
+            if route.matches(raw_state):
+                return route
+        return None
+
+    async def dispatch(self, callback: CallbackQuery, **data: Any) -> Any:
+        raw_state = data.get("raw_state")
+        route = self.resolve(callback.data, raw_state)
+        if route is None:
+            # пусть попробуют остальные хендлеры Dispatcher
+            raise SkipHandler()
+
+        set_handler_name(route.name)
+        started = time.perf_counter()
+        try:
+            return await route.call(callback, data)
+        except Exception:
+            HANDLER_ERRORS.labels("callback", route.key).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels("callback", route.key, raw_state or "-").observe(
+                time.perf_counter() - started
+            )
+
+    def routes(self) -> List[Tuple[str, str]]:
+        """Список (callback_data/префикс, имя хендлера) — для отладки."""
+        out = [(r.key, r.name) for rs in self._exact.values() for r in rs]
+        out += [(r.key, r.name) for rs in self._prefix.values() for r in rs]
+        return out
+
+
+def get_callback_router(dp: Dispatcher) -> CallbackRouter:
+    """
+    Роутер callback-кнопок этого Dispatcher'а.
+    При первом обращении создаётся и регистрируется как один хендлер callback_query.
+    """
+    router = dp.workflow_data.get("callback_router")
+    if router is None:
+        router = CallbackRouter()
+        # регистрируем bound-метод: aiogram должен видеть корутинную функцию
+        dp.callback_query.register(router.dispatch)
+        dp["callback_router"] = router
+    return router
@@ -1,10 +1,9 @@
 # sora_handlers.py
-import asyncio
 import json
 import logging
+import time
 from typing import Optional
 
-import aiohttp
 from aiogram import Dispatcher, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
@@ -13,65 +12,49 @@ from config import (
     JOBS_CREATE,
     JOBS_STATUS,
     KIE_API_KEY,
-    SORA2_COST_10S,
-    SORA2_COST_15S,
-    SORA2_PRO_STD_10S,
-    SORA2_PRO_STD_15S,
-    SORA2_PRO_HD_10S,
-    SORA2_PRO_HD_15S,
 )
 from database import db
+from metrics import (
+    KIE_REQUEST_SECONDS,
+    KIE_REQUESTS,
+    GENERATIONS_IN_FLIGHT,
+    GENERATIONS,
+    REFUNDS,
+)
+from middlewares import answer_callback
+from prescreen import REJECT, WARN, check_prompt, is_policy_failure, learn, reject_text, warn_text
+from pricing import catalog
+from delivery import deliver_video
+from http_client import get_session
+from inflight import inflight
 from keyboards import (
     main_menu_keyboard,
+    back_keyboard,
     engine_select_keyboard,
     get_prompt_type_keyboard,
     get_model_tier_keyboard,
     get_quality_keyboard,
     get_duration_orientation_keyboard,
     get_confirmation_keyboard,
-    back_btn,
 )
 from states import VideoCreationStates
+from stats import stats
+from tracing import tracer, traced, annotate
+from routing import get_callback_router
 from subscription import is_user_subscribed
+from supervisor import Reservation, SupervisorFull, supervisor
 from utils import (
     safe_answer,
     safe_send_message,
-    safe_send_video,
     safe_edit_text,
     safe_edit_reply_markup,
+    PRIORITY_CRITICAL,
 )
 
 logger = logging.getLogger(__name__)
 
 # Текст
 
-text_chose_model = (
-    """
-Sora 2
-
-Продвинутая модель от OpenAI, которая делает очень реалистичные и плавные видео. Отлично подходит для красивых, кинематографичных роликов.
-
-Veo 3.1
-
-Современная модель от Google, которая быстро создаёт чёткие видео по тексту или фото. Идеальна для коротких и динамичных роликов.
-
-Цены:
-
-Sora 2:
-        - Standart 10s = 30 
-        - Standart 15s = 35
-Sora 2 Pro:
-        - Standart 10s = 90 
-        - Standart 15s = 135
-        - HD 10s = 200
-        - HS 15s = 400
-Veo 3.1:
-        - Fast = 60
-        - Quality = 250
-
-    """
-)
-
 text_chose_sora = (
     """
 ✨ Sora 2
@@ -126,58 +109,14 @@ def calc_cost_credits(tier: str, quality: Optional[str], duration: int) -> int:
     quality: None / 'std' / 'high'
     duration: 10 или 15
     """
-    if tier == "sora2":
-        if duration == 10:
-            return SORA2_COST_10S
-        return SORA2_COST_15S
-
-    # Sora 2 Pro
-    if quality == "high":
-        # HD
-        if duration == 10:
-            return SORA2_PRO_HD_10S
-        return SORA2_PRO_HD_15S
-    else:
-        # Standard
-        if duration == 10:
-            return SORA2_PRO_STD_10S
-        return SORA2_PRO_STD_15S
+    return catalog().sora_cost(tier, quality, duration)
 
 
 def duration_price_text(tier: Optional[str], quality: Optional[str]) -> str:
     """
-    Текст для шага выбора длительности и ориентации.
+    Текст для шага выбора длительности и ориентации (готовый, из каталога цен).
     """
-    if not tier:
-        return "Выберите длительность и ориентацию:"
-
-    if tier == "sora2":
-        return (
-            "Выберите длительность и ориентацию:\n\n"
-            f"🧠 *Sora 2*:\n"
-            f"• 10 с — *{SORA2_COST_10S}* токенов\n"
-            f"• 15 с — *{SORA2_COST_15S}* токенов"
-        )
-
-    # Sora 2 Pro
-    if quality == "high":
-        # HD
-        return (
-            "Выберите длительность и ориентацию:\n\n"
-            "💎 *Sora 2 Pro (HD)*:\n"
-            f"• 10 с — *{SORA2_PRO_HD_10S}* токенов\n"
-            f"• 15 с — *{SORA2_PRO_HD_15S}* токенов\n\n"
-            "⚠️ Видео в Sora 2 Pro может создаваться до *45 минут*."
-        )
-    else:
-        # Standard
-        return (
-            "Выберите длительность и ориентацию:\n\n"
-            "⚡ *Sora 2 Pro (Standard)*:\n"
-            f"• 10 с — *{SORA2_PRO_STD_10S}* токенов\n"
-            f"• 15 с — *{SORA2_PRO_STD_15S}* токенов\n\n"
-            "⚠️ Видео в Sora 2 Pro может создаваться до *45 минут*."
-        )
+    return catalog().duration_text(tier, quality)
 
 
 #  МАППИНГ ДЛЯ KIE
@@ -282,7 +221,7 @@ async def menu_create_cb(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await safe_edit_text(
         callback.message,
-        text_chose_model,
+        catalog().engine_select_text,
         reply_markup=engine_select_keyboard(),
     )
 
@@ -490,10 +429,7 @@ async def continue_video(callback: CallbackQuery, state: FSMContext):
     prompt_type = data.get("prompt_type")
 
     if not duration or not orientation:
-        try:
-            await callback.answer("❌ Выберите длительность и ориентацию!", show_alert=True)
-        except Exception:
-            pass
+        await answer_callback(callback, "❌ Выберите длительность и ориентацию!", show_alert=True)
         return
 
     if prompt_type == "i2v":
@@ -501,24 +437,17 @@ async def continue_video(callback: CallbackQuery, state: FSMContext):
         await safe_edit_text(
             callback.message,
             "📷 Отправьте изображение (как фото, не файлом).",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[back_btn("back_to_duration")]]
-            ),
+            reply_markup=back_keyboard("back_to_duration"),
         )
     else:
         await state.set_state(VideoCreationStates.waiting_for_prompt)
         await safe_edit_text(
             callback.message,
             "✍️ Введите описание для видео:",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[back_btn("back_to_duration")]]
-            ),
+            reply_markup=back_keyboard("back_to_duration"),
         )
 
 
-from aiogram.types import InlineKeyboardMarkup
-
-
 #  SORA: ПРИЁМ КАРТИНКИ
 
 async def got_image(message: Message, state: FSMContext):
@@ -536,9 +465,7 @@ async def got_image(message: Message, state: FSMContext):
     await safe_answer(
         message,
         "✍️ Теперь отправьте текстовое описание для видео.",
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[[back_btn("back_to_duration")]]
-        ),
+        reply_markup=back_keyboard("back_to_duration"),
     )
 
 
@@ -558,6 +485,10 @@ async def prompt_msg(message: Message, state: FSMContext):
     финальное подтверждение.
     """
     prompt = message.text
+    verdict = check_prompt("sora", prompt)
+    if verdict.action == REJECT:
+        await safe_answer(message, reject_text(verdict))
+        return
     await state.update_data(prompt=prompt)
 
     data = await state.get_data()
@@ -582,6 +513,8 @@ async def prompt_msg(message: Message, state: FSMContext):
     if tier == "sora2_pro":
         info_lines.append("⚠️ В *Sora 2 Pro* видео может создаваться до *45 минут*.")
     info_lines.append("⏳ Обычно генерация занимает до 10–15 минут.")
+    if verdict.action == WARN:
+        info_lines.append(warn_text(verdict))
     info_lines.append("📋 Подтвердите параметры:")
     info_lines.extend(
         [
@@ -608,9 +541,7 @@ async def back_to_prompt(callback: CallbackQuery, state: FSMContext):
     await safe_edit_text(
         callback.message,
         "✍️ Измените описание:",
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[[back_btn("back_to_duration")]]
-        ),
+        reply_markup=back_keyboard("back_to_duration"),
     )
 
 
@@ -638,6 +569,7 @@ async def change_video(callback: CallbackQuery, state: FSMContext):
 
 #  SORA: ПОДТВЕРЖДЕНИЕ, СПИСАНИЕ, ЗАПУСК ЗАДАЧИ
 
+@traced("confirm_video")
 async def confirm_video(callback: CallbackQuery, state: FSMContext):
     """
     Списываем токены, отправляем задачу в KIE и запускаем опрос статуса.
@@ -647,54 +579,75 @@ async def confirm_video(callback: CallbackQuery, state: FSMContext):
 
     data = await state.get_data()
     cost = int(data.get("cost") or 0)
+    annotate(engine="sora", uid=uid, cost=cost, tier=data.get("tier"))
 
-    user = await db.get_user(uid)
-    if not user or user["generations_left"] < cost:
-        bal = user["generations_left"] if user else 0
+    # место под опрос занимаем до списания токенов: после createTask
+    # лимит уже не помешает опросить оплаченную задачу
+    try:
+        slot = supervisor.reserve("kie-poll-sora")
+    except SupervisorFull:
         await safe_edit_text(
             callback.message,
-            f"❌ Недостаточно токенов.\nНужно {cost}, у вас {bal}.",
+            "⏳ Сейчас в работе слишком много генераций. Попробуйте через пару минут.",
         )
         await state.clear()
         return
 
-    # списываем токены
-    await db.update_user_generations(uid, user["generations_left"] - cost)
+    try:
+        user = await db.get_user(uid)
+        if not user or user["generations_left"] < cost:
+            bal = user["generations_left"] if user else 0
+            await safe_edit_text(
+                callback.message,
+                f"❌ Недостаточно токенов.\nНужно {cost}, у вас {bal}.",
+            )
+            return
 
-    await safe_edit_text(
-        callback.message,
-        f"🎬 Видео создаётся…\n💳 Списано {cost} токенов.",
-    )
+        # списываем токены
+        await db.update_user_generations(uid, user["generations_left"] - cost)
+        stats.record("generations", "sora:started")
 
-    try:
-        await send_to_kie_api(
-            bot=bot,
-            uid=uid,
-            model=data["kie_model"],
-            prompt=data["prompt"],
-            duration=data["duration"],
-            orientation=data.get("orientation"),
-            image_url=data.get("image_url"),
-            cost=cost,
-            tier=data.get("tier"),
-            quality=data.get("quality"),
-            prompt_type=data.get("prompt_type"),
-        )
-    except Exception as e:
-        logger.exception(f"confirm_video: send_to_kie_api failed: {e}")
-        # на всякий случай возвращаем токены
-        await db.add_generations(uid, cost)
-        await safe_send_message(
-            bot,
-            uid,
-            "❌ Ошибка при отправке задачи в KIE. Токены возвращены.",
+        await safe_edit_text(
+            callback.message,
+            f"🎬 Видео создаётся…\n💳 Списано {cost} токенов.",
         )
+
+        try:
+            await send_to_kie_api(
+                bot=bot,
+                uid=uid,
+                model=data["kie_model"],
+                prompt=data["prompt"],
+                duration=data["duration"],
+                orientation=data.get("orientation"),
+                image_url=data.get("image_url"),
+                cost=cost,
+                tier=data.get("tier"),
+                quality=data.get("quality"),
+                prompt_type=data.get("prompt_type"),
+                reservation=slot,
+            )
+        except Exception as e:
+            logger.exception("confirm_video: send_to_kie_api failed: %s", e)
+            # ошибка вне запроса к KIE (подготовка, запуск опроса): сбой самого
+            # запроса send_to_kie_api обрабатывает и возвращает токены сам
+            await db.add_generations(uid, cost)
+            REFUNDS.labels("sora").inc()
+            stats.record("refunds", "sora")
+            await safe_send_message(
+                bot,
+                uid,
+                "❌ Ошибка при отправке задачи в KIE. Токены возвращены.",
+            )
     finally:
+        # место не понадобилось (нет токенов, createTask не удался) — отдаём
+        slot.release()
         await state.clear()
 
 
 #  ИНТЕГРАЦИЯ С KIE (SORA)
 
+@traced("kie.create_task")
 async def send_to_kie_api(
     bot,
     uid: int,
@@ -707,9 +660,12 @@ async def send_to_kie_api(
     tier: str,
     quality: Optional[str],
     prompt_type: str,
+    reservation: Optional[Reservation] = None,
 ):
     """
-    Отправляет задачу в KIE jobs API и запускает опрос статуса.
+    Отправляет задачу в KIE jobs API и запускает опрос статуса
+    (в место reservation, занятое до списания).
+    Если createTask не удался — возвращает токены (ровно один раз) и не бросает.
     """
     payload = {
         "model": model,
@@ -723,48 +679,63 @@ async def send_to_kie_api(
         ),
     }
 
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                JOBS_CREATE,
-                json=payload,
-                headers=_kie_headers(),
-                timeout=120,
-            ) as resp:
-                data = await resp.json(content_type=None)
-                if resp.status != 200 or data.get("code") != 200:
-                    await db.add_generations(uid, cost)
-                    raise RuntimeError(f"KIE createTask error: status={resp.status}, body={data}")
-
-                d = data.get("data") or {}
-                task_id = d.get("taskId") or d.get("task_id")
-                if not task_id:
-                    await db.add_generations(uid, cost)
-                    raise RuntimeError(f"KIE createTask: нет taskId в ответе: {data}")
+        session = get_session()
+        async with session.post(
+            JOBS_CREATE,
+            json=payload,
+            headers=_kie_headers(),
+            timeout=120,
+        ) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status != 200 or data.get("code") != 200:
+                outcome = "http_error"
+                if is_policy_failure(str(data.get("msg"))):
+                    await learn(prompt, rejected=True)
+                raise RuntimeError(f"KIE createTask error: status={resp.status}, body={data}")
+
+            d = data.get("data") or {}
+            task_id = d.get("taskId") or d.get("task_id")
+            if not task_id:
+                outcome = "no_task_id"
+                raise RuntimeError(f"KIE createTask: нет taskId в ответе: {data}")
+            outcome = "ok"
+            tracer.bind_task(task_id)
     except Exception as e:
-        logger.exception(f"send_to_kie_api: error: {e}")
+        logger.exception("send_to_kie_api: error: %s", e)
         await db.add_generations(uid, cost)
+        REFUNDS.labels("sora").inc()
+        stats.record("refunds", "sora")
         await safe_send_message(
             bot,
             uid,
             "❌ Не удалось создать задачу в KIE. Токены возвращены.",
         )
-        raise
+        return
+    finally:
+        elapsed = time.perf_counter() - started
+        KIE_REQUEST_SECONDS.labels("submit", model).observe(elapsed)
+        stats.record("kie_seconds", f"submit:{model}", total=elapsed)
+        KIE_REQUESTS.labels("submit", model, outcome).inc()
+        annotate(model=model, outcome=outcome)
 
     # запускаем фоновой опрос статуса
-    asyncio.create_task(
-        check_video_status(
-            bot=bot,
-            uid=uid,
-            task_id=task_id,
-            duration=duration,
-            orientation=orientation,
-            cost=cost,
-            tier=tier,
-        )
+    spawn_sora_poll(
+        bot,
+        reservation=reservation,
+        uid=uid,
+        task_id=task_id,
+        duration=duration,
+        orientation=orientation,
+        cost=cost,
+        tier=tier,
+        prompt=prompt,
     )
 
 
+@traced("kie.wait")
 async def check_video_status(
     bot,
     uid: int,
@@ -773,115 +744,183 @@ async def check_video_status(
     orientation: str,
     cost: int,
     tier: str,
+    prompt: str = "",
 ):
     """
     Периодически опрашивает KIE jobs/status (recordInfo) и:
     - при успехе отправляет видео пользователю
     - при ошибке/таймауте возвращает токены
+    Итог (успех / отказ модерации) учитывается предпроверкой промптов.
     """
     # Sora 2 Pro — до 45 минут (360 * 8с ≈ 48 минут)
     max_iters = 360 if tier == "sora2_pro" else 90
+    model = tier or "sora2"
 
+    entry = inflight.add(task_id, "sora", model, uid, cost)
+    GENERATIONS_IN_FLIGHT.labels("sora").inc()
     try:
-        async with aiohttp.ClientSession() as session:
-            for _ in range(max_iters):
-                async with session.get(
-                    JOBS_STATUS,
-                    params={"taskId": task_id},
-                    headers=_kie_headers(),
-                    timeout=30,
-                ) as resp:
-                    result = await resp.json(content_type=None)
-                    if resp.status != 200 or result.get("code") != 200:
-                        await asyncio.sleep(8)
-                        continue
-
-                    d = result.get("data") or {}
-                    state = (d.get("state") or "").lower()
-                    flag = d.get("successFlag")
-
-                    # still generating / in queue
-                    if state in ("", "wait", "queueing", "generating") or flag == 0:
-                        await asyncio.sleep(8)
-                        continue
-
-                    if state == "success" or flag == 1:
-                        video_url = None
-                        resp_obj = d.get("response") or {}
-                        video_url = resp_obj.get("videoUrl")
-
-                        urls = resp_obj.get("resultUrls")
-                        if not video_url and isinstance(urls, list) and urls:
-                            video_url = urls[0]
-
-                        # пробуем распарсить resultJson
-                        if not video_url and d.get("resultJson"):
-                            try:
-                                rj = d["resultJson"]
-                                rj = json.loads(rj) if isinstance(rj, str) else rj
-                                video_url = rj.get("result")
-                                if not video_url:
-                                    r_urls = rj.get("resultUrls")
-                                    if isinstance(r_urls, list) and r_urls:
-                                        video_url = r_urls[0]
-                            except Exception:
-                                pass
-
-                        line_orient = f", 📱 {orientation}" if orientation else ""
+        session = get_session()
+        for _ in range(max_iters):
+            started = time.perf_counter()
+            poll_start = time.time()
+            async with session.get(
+                JOBS_STATUS,
+                params={"taskId": task_id},
+                headers=_kie_headers(),
+                timeout=30,
+            ) as resp:
+                result = await resp.json(content_type=None)
+                elapsed = time.perf_counter() - started
+                KIE_REQUEST_SECONDS.labels("poll", model).observe(elapsed)
+                stats.record("kie_seconds", f"poll:{model}", total=elapsed)
+                tracer.record(
+                    "kie.poll",
+                    poll_start,
+                    time.time(),
+                    http=resp.status,
+                    state=(result.get("data") or {}).get("state"),
+                )
+                entry.polled(
+                    (result.get("data") or {}).get("state")
+                    if resp.status == 200
+                    else f"http {resp.status}"
+                )
+                if resp.status != 200 or result.get("code") != 200:
+                    KIE_REQUESTS.labels("poll", model, "http_error").inc()
+                    await entry.wait(8)
+                    continue
+                KIE_REQUESTS.labels("poll", model, "ok").inc()
+
+                d = result.get("data") or {}
+                state = (d.get("state") or "").lower()
+                flag = d.get("successFlag")
+
+                # still generating / in queue
+                if state in ("", "wait", "queueing", "generating") or flag == 0:
+                    await entry.wait(8)
+                    continue
+
+                if state == "success" or flag == 1:
+                    if not await entry.acquire():
+                        return
+                    video_url = None
+                    resp_obj = d.get("response") or {}
+                    video_url = resp_obj.get("videoUrl")
+
+                    urls = resp_obj.get("resultUrls")
+                    if not video_url and isinstance(urls, list) and urls:
+                        video_url = urls[0]
+
+                    # пробуем распарсить resultJson
+                    if not video_url and d.get("resultJson"):
+                        try:
+                            rj = d["resultJson"]
+                            rj = json.loads(rj) if isinstance(rj, str) else rj
+                            video_url = rj.get("result")
+                            if not video_url:
+                                r_urls = rj.get("resultUrls")
+                                if isinstance(r_urls, list) and r_urls:
+                                    video_url = r_urls[0]
+                        except Exception:
+                            pass
+
+                    line_orient = f", 📱 {orientation}" if orientation else ""
+                    title = f"🎉 Ваше видео готово! ⏱️ {duration} с{line_orient}"
+
+                    if video_url:
+                        await deliver_video(
+                            bot,
+                            uid,
+                            video_url,
+                            title,
+                            details=["🎬 Готовый ролик"],
+                        )
+                    else:
                         await safe_send_message(
                             bot,
                             uid,
-                            f"🎉 Ваше видео готово! ⏱️ {duration} с{line_orient}",
+                            f"{title}\n\n⚠️ Видео готово, но URL не найден в ответе KIE.",
+                            reply_markup=main_menu_keyboard(),
+                            priority=PRIORITY_CRITICAL,
                         )
-
-                        if video_url:
-                            await safe_send_video(
-                                bot,
-                                uid,
-                                video=video_url,
-                                caption="🎬 Готовый ролик",
-                            )
-                            await safe_send_message(bot, uid, "🏠 Главное меню:", reply_markup=main_menu_keyboard())
-                        else:
-                            await safe_send_message(
-                                bot,
-                                uid,
-                                "⚠️ Видео готово, но URL не найден в ответе KIE.",
-                            )
-                        return
-
-                    # ошибка
-                    fail_msg = (
-                        d.get("failMsg")
-                        or d.get("errorMessage")
-                        or "Ошибка генерации"
-                    )
-                    await db.add_generations(uid, cost)
-                    await safe_send_message(
-                        bot,
-                        uid,
-                        f"❌ Генерация не удалась: {fail_msg}. Токены возвращены.",
-                    )
+                    GENERATIONS.labels("sora", "success").inc()
+                    stats.record("generations", "sora:success")
+                    await learn(prompt, rejected=False)
                     return
 
-                await asyncio.sleep(8)
-
-            # таймаут
-            await db.add_generations(uid, cost)
-            await safe_send_message(
-                bot,
-                uid,
-                "⏳ Истекло время ожидания от KIE. Токены возвращены.",
-            )
+                # ошибка
+                fail_msg = (
+                    d.get("failMsg")
+                    or d.get("errorMessage")
+                    or "Ошибка генерации"
+                )
+                if not await entry.acquire():
+                    return
+                await db.add_generations(uid, cost)
+                GENERATIONS.labels("sora", "failed").inc()
+                stats.record("generations", "sora:failed")
+                REFUNDS.labels("sora").inc()
+                stats.record("refunds", "sora")
+                await safe_send_message(
+                    bot,
+                    uid,
+                    f"❌ Генерация не удалась: {fail_msg}. Токены возвращены.",
+                )
+                await learn(prompt, rejected=is_policy_failure(fail_msg))
+                return
+
+            await entry.wait(8)
+
+        # таймаут
+        if not await entry.acquire():
+            return
+        await db.add_generations(uid, cost)
+        GENERATIONS.labels("sora", "timeout").inc()
+        stats.record("generations", "sora:timeout")
+        REFUNDS.labels("sora").inc()
+        stats.record("refunds", "sora")
+        await safe_send_message(
+            bot,
+            uid,
+            "⏳ Истекло время ожидания от KIE. Токены возвращены.",
+        )
 
     except Exception as e:
-        logger.exception(f"check_video_status: error: {e}")
+        logger.exception("check_video_status: error: %s", e)
+        if not await entry.acquire():
+            return
         await db.add_generations(uid, cost)
+        GENERATIONS.labels("sora", "error").inc()
+        stats.record("generations", "sora:error")
+        REFUNDS.labels("sora").inc()
+        stats.record("refunds", "sora")
         await safe_send_message(
             bot,
             uid,
             "❌ Ошибка при проверке статуса видео. Токены возвращены.",
         )
+    finally:
+        GENERATIONS_IN_FLIGHT.labels("sora").dec()
+        inflight.remove(entry)
+
+
+def spawn_sora_poll(bot, reservation: Optional[Reservation] = None, **params) -> None:
+    """
+    Опрос статуса под supervisor: при остановке бота незавершённый опрос
+    сохраняется и после старта продолжается (если токены ещё не возвращены).
+    reservation — место, занятое до списания токенов (confirm_video).
+    """
+    task_id = params["task_id"]
+    supervisor.spawn(
+        check_video_status(bot, **params),
+        name=f"kie-poll-sora:{task_id}",
+        kind="kie-poll-sora",
+        checkpoint=lambda: None if inflight.finishing(task_id) else params,
+        reservation=reservation,
+    )
+
+
+supervisor.resumable("kie-poll-sora", lambda bot, params: spawn_sora_poll(bot, **params))
 
 
 #  РЕГИСТРАЦИЯ ХЕНДЛЕРОВ
@@ -893,59 +932,31 @@ def register_sora_handlers(dp: Dispatcher) -> None:
     - выбором движка Sora
     - Sora FSM (тип промпта, модель, качество, дюрация, промпт, подтверждение)
     """
+    callbacks = get_callback_router(dp)
+
     # Меню → выбор движка
-    dp.callback_query.register(menu_create_cb, F.data == "menu_create")
+    callbacks.exact("menu_create", menu_create_cb)
 
     # Движок Sora
-    dp.callback_query.register(engine_sora_cb, F.data == "engine_sora")
+    callbacks.exact("engine_sora", engine_sora_cb)
 
     # Тип промпта
-    dp.callback_query.register(
-        choose_prompt_type,
-        F.data.in_({"ptype_t2v", "ptype_i2v"}),
-    )
-    dp.callback_query.register(
-        back_to_prompt_type,
-        F.data == "back_to_prompt_type",
-    )
+    callbacks.exact({"ptype_t2v", "ptype_i2v"}, choose_prompt_type)
+    callbacks.exact("back_to_prompt_type", back_to_prompt_type)
 
     # Модель
-    dp.callback_query.register(
-        choose_tier,
-        F.data.in_({"tier_sora2", "tier_sora2pro"}),
-    )
-    dp.callback_query.register(
-        back_to_model_tier,
-        F.data == "back_to_model_tier",
-    )
+    callbacks.exact({"tier_sora2", "tier_sora2pro"}, choose_tier)
+    callbacks.exact("back_to_model_tier", back_to_model_tier)
 
     # Качество (Pro)
-    dp.callback_query.register(
-        choose_quality,
-        F.data.in_({"qual_std", "qual_high", "quality_next"}),
-    )
+    callbacks.exact({"qual_std", "qual_high", "quality_next"}, choose_quality)
 
     # Длительность и ориентация
-    dp.callback_query.register(
-        back_to_quality_or_tier,
-        F.data == "back_to_quality_or_tier",
-    )
-    dp.callback_query.register(
-        duration_cb,
-        F.data.startswith("duration_"),
-    )
-    dp.callback_query.register(
-        orientation_cb,
-        F.data.startswith("orientation_"),
-    )
-    dp.callback_query.register(
-        back_to_duration,
-        F.data == "back_to_duration",
-    )
-    dp.callback_query.register(
-        continue_video,
-        F.data == "continue_video",
-    )
+    callbacks.exact("back_to_quality_or_tier", back_to_quality_or_tier)
+    callbacks.prefix("duration_", duration_cb)
+    callbacks.prefix("orientation_", orientation_cb)
+    callbacks.exact("back_to_duration", back_to_duration)
+    callbacks.exact("continue_video", continue_video)
 
     from states import VideoCreationStates as VS
 
@@ -966,15 +977,6 @@ def register_sora_handlers(dp: Dispatcher) -> None:
     )
 
     # Подтверждение
-    dp.callback_query.register(
-        back_to_prompt,
-        F.data == "back_to_prompt",
-    )
-    dp.callback_query.register(
-        change_video,
-        F.data == "change_video",
-    )
-    dp.callback_query.register(
-        confirm_video,
-        F.data == "confirm_video",
-    )
+    callbacks.exact("back_to_prompt", back_to_prompt)
+    callbacks.exact("change_video", change_video)
+    callbacks.exact("confirm_video", confirm_video)
@@ -0,0 +1,76 @@
+# startup.py
+"""
+Тайминги холодного старта.
+
+Фазы меряются от момента, когда интерпретатор дошёл до main.py
+(mark_process_start), до первого обработанного апдейта:
+    imports   — импорт модулей бота;
+    db / get_me / http_warmup / web — шаги запуска (часть идёт параллельно);
+    ready     — polling вот-вот начнётся;
+    first_update — первый апдейт дошёл до диспетчера.
+Всё это уходит в лог одной строкой и в метрику bot_startup_phase_seconds —
+по ней видно время до первого апдейта при rolling deploy.
+"""
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASE_SECONDS = gauge(
+    "bot_startup_phase_seconds",
+    "Duration of startup phases (since_start: offset from process start)",
+    ("phase", "kind"),
+)
+
+
+class StartupTimer:
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.marks: Dict[str, float] = {}
+
+    def mark_process_start(self) -> None:
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+
+    def _since_start(self) -> float:
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        return time.perf_counter() - self.started_at
+
+    def mark(self, name: str) -> float:
+        """Отметка «от старта процесса до сейчас»."""
+        offset = self._since_start()
+        self.marks[name] = offset
+        STARTUP_PHASE_SECONDS.labels(name, "since_start").set(offset)
+        return offset
+
+    @asynccontextmanager
+    async def phase(self, name: str) -> AsyncIterator[None]:
+        """Длительность шага запуска; шаги можно запускать параллельно."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            self.phases[name] = duration
+            STARTUP_PHASE_SECONDS.labels(name, "duration").set(duration)
+
+    def report(self) -> str:
+        parts = [f"{name} {d:.2f}s" for name, d in self.phases.items()]
+        parts += [f"{name} at +{t:.2f}s" for name, t in self.marks.items()]
+        return ", ".join(parts)
+
+    def first_update(self) -> None:
+        if "first_update" in self.marks:
+            return
+        offset = self.mark("first_update")
+        logger.info(f"First update {offset:.2f}s after process start")
+
+
+# Глобальный таймер запуска
+startup = StartupTimer()
@@ -0,0 +1,149 @@
+# stats.py
+"""
+Почасовая статистика для /stats.
+
+Каждое событие (генерация, возврат, запрос к KIE, оплата Stars) —
+приращение в памяти: (час, name, label) → [count, total]. Раз в
+STATS_FLUSH_INTERVAL секунд накопленное уходит в stats_hourly одним
+запросом, при остановке — дописывается остаток. Рублёвая выручка
+пишется в stats_hourly прямо в транзакции зачисления (database.py).
+
+/stats читает только агрегаты за нужные окна плюс ещё не записанный
+буфер — время ответа не зависит от объёма истории.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from config import STATS_FLUSH_INTERVAL
+from database import current_hour, db
+
+logger = logging.getLogger(__name__)
+
+# Окна /stats: подпись → длина
+WINDOWS: List[Tuple[str, timedelta]] = [
+    ("24 ч", timedelta(hours=24)),
+    ("7 дн", timedelta(days=7)),
+    ("30 дн", timedelta(days=30)),
+]
+
+Key = Tuple[datetime, str, str]
+
+
+class StatsRecorder:
+    def __init__(self, flush_interval: float = STATS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Key, List[float]] = {}
+        # то, что сейчас пишется в БД (чтобы /stats не «терял» его на время записи)
+        self._flushing: Dict[Key, List[float]] = {}
+
+    def record(self, name: str, label: str = "", total: float = 0.0, count: int = 1) -> None:
+        """Приращение в текущем часе. Без I/O — можно звать где угодно."""
+        key = (current_hour(), name, label)
+        bucket = self._pending.get(key)
+        if bucket is None:
+            self._pending[key] = [count, total]
+        else:
+            bucket[0] += count
+            bucket[1] += total
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._flushing = pending
+        rows = [(h, n, l, int(c), float(t)) for (h, n, l), (c, t) in pending.items()]
+        try:
+            await db.bump_stats(rows)
+        except BaseException as e:
+            # и при отмене (остановка): run() в finally допишет их ещё раз
+            for (h, n, l, c, t) in rows:
+                bucket = self._pending.setdefault((h, n, l), [0, 0.0])
+                bucket[0] += c
+                bucket[1] += t
+            if not isinstance(e, Exception):
+                raise
+            logger.exception("stats flush failed, keeping %d rows for retry", len(rows))
+        finally:
+            self._flushing = {}
+
+    async def run(self) -> None:
+        """Фоновый цикл записи; при отмене дописывает остаток."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    async def summary(self) -> Dict[Tuple[str, str], List[Tuple[int, float]]]:
+        """
+        (name, label) → [(count, total) для каждого окна из WINDOWS],
+        из stats_hourly плюс ещё не записанный буфер.
+        """
+        now_hour = current_hour()
+        # окно «24 ч» — это 24 полных часовых строки, включая текущий час
+        since = [now_hour - length + timedelta(hours=1) for _, length in WINDOWS]
+        result: Dict[Tuple[str, str], List[Tuple[int, float]]] = {}
+
+        for row in await db.get_stats(since):
+            result[(row["name"], row["label"])] = [
+                (int(row[f"count_{i}"]), float(row[f"total_{i}"])) for i in range(len(WINDOWS))
+            ]
+
+        unflushed = list(self._flushing.items()) + list(self._pending.items())
+        for (hour, name, label), (count, total) in unflushed:
+            windows = result.setdefault((name, label), [(0, 0.0)] * len(WINDOWS))
+            result[(name, label)] = [
+                (c + int(count), t + total) if hour >= since[i] else (c, t)
+                for i, (c, t) in enumerate(windows)
+            ]
+        return result
+
+
+def format_stats(data: Dict[Tuple[str, str], List[Tuple[int, float]]]) -> str:
+    """Текст для /stats: таблица по окнам WINDOWS."""
+    n = len(WINDOWS)
+
+    def get(name: str, label: str) -> List[Tuple[int, float]]:
+        return data.get((name, label), [(0, 0.0)] * n)
+
+    def labels(name: str) -> List[str]:
+        return sorted(label for (nm, label) in data if nm == name)
+
+    def row(title: str, values: List[Any]) -> str:
+        return f"{title:<22}" + "".join(f"{v:>10}" for v in values)
+
+    lines = [row("", [title for title, _ in WINDOWS])]
+
+    lines.append("")
+    lines.append("генерации")
+    for label in labels("generations"):
+        lines.append(row(f"  {label}", [c for c, _ in get("generations", label)]))
+    for label in labels("refunds"):
+        lines.append(row(f"  возврат {label}", [c for c, _ in get("refunds", label)]))
+
+    lines.append("")
+    lines.append("выручка")
+    for label in labels("revenue"):
+        unit = "⭐" if label == "stars" else "₽"
+        lines.append(row(f"  {label} ({unit})", [f"{t:.0f}" for _, t in get("revenue", label)]))
+        lines.append(row(f"  {label} платежей", [c for c, _ in get("revenue", label)]))
+    for label in labels("tokens_sold"):
+        lines.append(row(f"  токенов {label}", [f"{t:.0f}" for _, t in get("tokens_sold", label)]))
+    for label in labels("tokens_granted"):
+        lines.append(row(f"  выдано {label}", [f"{t:.0f}" for _, t in get("tokens_granted", label)]))
+
+    lines.append("")
+    lines.append("KIE, среднее время")
+    for label in labels("kie_seconds"):
+        lines.append(row(
+            f"  {label}",
+            [f"{t / c:.2f}s" if c else "—" for c, t in get("kie_seconds", label)],
+        ))
+    return "\n".join(lines)
+
+
+# Глобальный счётчик
+stats = StatsRecorder()
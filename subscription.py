@@ -1,15 +1,24 @@
 # subscription.py
 import logging
-from typing import Optional, Union
+import time
+from typing import Dict, Optional, Tuple, Union
 
-from aiogram import Dispatcher, F, Bot
+from aiogram import Dispatcher, Bot
 from aiogram import types
 from aiogram.filters import Command
 from aiogram.enums import ChatMemberStatus
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import CallbackQuery, Message, ChatMemberUpdated
 
-from config import CHANNEL_ID, CHANNEL_USERNAME
+from config import (
+    CHANNEL_ID,
+    CHANNEL_USERNAME,
+    SUB_CACHE_POSITIVE_TTL,
+    SUB_CACHE_NEGATIVE_TTL,
+)
 from database import db
+from memdebug import watch
+from middlewares import answer_callback, hold_callback_answer
+from routing import get_callback_router
 from keyboards import (
     main_menu_keyboard,
     subscribe_keyboard,
@@ -36,6 +45,72 @@ MAIN_MENU_TEXT = (
 )
 
 
+# КЭШ ПОДПИСКИ
+
+SUBSCRIBED_STATUSES = {
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.ADMINISTRATOR,
+    ChatMemberStatus.CREATOR,
+}
+
+
+class SubscriptionCache:
+    """
+    Кэш результата get_chat_member: user_id → (подписан?, истекает_в).
+    Положительный и отрицательный результат живут разное время.
+    Апдейты chat_member канала обновляют запись сразу.
+    """
+
+    def __init__(
+        self,
+        positive_ttl: float = SUB_CACHE_POSITIVE_TTL,
+        negative_ttl: float = SUB_CACHE_NEGATIVE_TTL,
+        max_size: int = 100_000,
+    ):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: Dict[int, Tuple[bool, float]] = {}
+
+    def get(self, user_id: int) -> Optional[bool]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        subscribed, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            return None
+        return subscribed
+
+    def set(self, user_id: int, subscribed: bool) -> None:
+        if len(self._entries) >= self.max_size and user_id not in self._entries:
+            self._evict()
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        # переставляем в конец, чтобы порядок dict отражал свежесть
+        self._entries.pop(user_id, None)
+        self._entries[user_id] = (subscribed, time.monotonic() + ttl)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        expired = [uid for uid, (_, exp) in self._entries.items() if exp <= now]
+        for uid in expired:
+            del self._entries[uid]
+        # всё ещё полно — выкидываем самую старую четверть
+        if len(self._entries) >= self.max_size:
+            for uid in list(self._entries)[: max(1, self.max_size // 4)]:
+                del self._entries[uid]
+
+
+subscription_cache = SubscriptionCache()
+watch("subscription_cache_entries", lambda: len(subscription_cache), "Cached subscription checks")
+
+
 # ВСПОМОГАТЕЛЬНЫЕ
 
 def _channel_ref() -> Optional[Union[int, str]]:
@@ -52,27 +127,41 @@ def _channel_ref() -> Optional[Union[int, str]]:
     return None
 
 
-async def is_user_subscribed(bot: Bot, user_id: int) -> bool:
+def _is_our_channel(chat: types.Chat) -> bool:
+    if CHANNEL_ID != 0:
+        return chat.id == CHANNEL_ID
+    if CHANNEL_USERNAME and chat.username:
+        return chat.username.lower() == CHANNEL_USERNAME.lstrip("@").lower()
+    return False
+
+
+async def is_user_subscribed(bot: Bot, user_id: int, trust_negative: bool = True) -> bool:
     """
     Проверка, подписан ли пользователь на канал.
     Если канал не задан в конфиге — возвращает True.
+    Сначала смотрит в кэш; в Bot API идёт только при промахе.
+    trust_negative=False — закэшированное «не подписан» перепроверяется
+    (пользователь сам говорит, что только что подписался).
     """
     chat = _channel_ref()
     if not chat:
         return True  # подписка не нужна
 
+    cached = subscription_cache.get(user_id)
+    if cached or (cached is False and trust_negative):
+        return cached
+
     try:
         member = await bot.get_chat_member(chat_id=chat, user_id=user_id)
-        status = member.status
-        return status in {
-            ChatMemberStatus.MEMBER,
-            ChatMemberStatus.ADMINISTRATOR,
-            ChatMemberStatus.CREATOR,
-        }
     except Exception as e:
+        # ошибку не кэшируем — в следующий раз спросим заново
         logger.exception(f"is_user_subscribed: get_chat_member failed: {e}")
         return False
 
+    subscribed = member.status in SUBSCRIBED_STATUSES
+    subscription_cache.set(user_id, subscribed)
+    return subscribed
+
 
 # ХЕНДЛЕРЫ
 
@@ -123,10 +212,12 @@ async def on_check_sub(callback: CallbackQuery):
     """
     Обработка кнопки '✅ Я подписался'
     """
+    # «не подписались» — алерт после живой проверки, дольше паузы автоответа
+    hold_callback_answer(callback)
     bot = callback.message.bot
     uid = callback.from_user.id
 
-    if await is_user_subscribed(bot, uid):
+    if await is_user_subscribed(bot, uid, trust_negative=False):
         await safe_edit_text(
             callback.message,
             "✅ Спасибо за подписку! Доступ к боту открыт.",
@@ -140,13 +231,11 @@ async def on_check_sub(callback: CallbackQuery):
             reply_markup=main_menu_keyboard(),
         )
     else:
-        try:
-            await callback.answer(
-                "Похоже, вы ещё не подписались 🤔",
-                show_alert=True,
-            )
-        except Exception:
-            pass
+        await answer_callback(
+            callback,
+            "Похоже, вы ещё не подписались 🤔",
+            show_alert=True,
+        )
 
 
 async def back_to_main_cb(callback: CallbackQuery):
@@ -161,6 +250,32 @@ async def back_to_main_cb(callback: CallbackQuery):
     )
 
 
+async def on_channel_member_update(event: ChatMemberUpdated):
+    """
+    chat_member апдейт канала (вступил / вышел / забанен):
+    сразу обновляем кэш подписки.
+    Приходит, только если бот — админ канала и "chat_member" есть в allowed_updates.
+    """
+    if not _is_our_channel(event.chat):
+        return
+    member = event.new_chat_member
+    subscription_cache.set(member.user.id, member.status in SUBSCRIBED_STATUSES)
+
+
+async def on_my_chat_member_update(event: ChatMemberUpdated):
+    """
+    my_chat_member в личке: пользователь заблокировал / разблокировал бота.
+    Заблокировавших пропускают рассылки (users.blocked_at).
+    """
+    if event.chat.type != "private":
+        return
+    status = event.new_chat_member.status
+    if status == ChatMemberStatus.KICKED:
+        await db.set_user_blocked(event.from_user.id, True)
+    elif status == ChatMemberStatus.MEMBER:
+        await db.set_user_blocked(event.from_user.id, False)
+
+
 # РЕГИСТРАЦИЯ ОБЩИХ ХЕНДЛЕРОВ
 
 def register_common_handlers(dp: Dispatcher) -> None:
@@ -170,9 +285,15 @@ def register_common_handlers(dp: Dispatcher) -> None:
     - /menu
     - проверка подписки
     - 'Назад в главное'
+    - chat_member апдейты канала (кэш подписки)
+    - my_chat_member в личке (блокировка бота)
     """
     dp.message.register(cmd_start, Command("start"))
     dp.message.register(cmd_menu, Command("menu"))
 
-    dp.callback_query.register(on_check_sub, F.data == "check_sub")
-    dp.callback_query.register(back_to_main_cb, F.data == "back_to_main")
+    callbacks = get_callback_router(dp)
+    callbacks.exact("check_sub", on_check_sub)
+    callbacks.exact("back_to_main", back_to_main_cb)
+
+    dp.chat_member.register(on_channel_member_update)
+    dp.my_chat_member.register(on_my_chat_member_update)
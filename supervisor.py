@@ -0,0 +1,244 @@
+# supervisor.py
+"""
+Фоновые задачи бота (опрос KIE, сверка платежей, рассылки…).
+
+asyncio хранит на задачи только слабые ссылки: задачу, результат
+create_task которой выброшен, сборщик мусора может снести посреди работы,
+а её исключение никто не увидит. Поэтому фоновые корутины запускаются
+через supervisor.spawn:
+- задача держится в реестре до завершения, имя и вид (kind) обязательны;
+- исключения идут в лог и в bot_background_task_failures_total;
+- некритичных задач не больше BACKGROUND_TASK_LIMIT — сверх лимита
+  spawn бросает SupervisorFull. Генерации занимают место заранее, до списания
+  токенов и createTask (reserve()), и запускают опрос в это место: после
+  await лимит уже не помешает опросить оплаченную задачу;
+- при остановке shutdown() сначала даёт доделать задачи, чей checkpoint
+  вернул None (опрос уже доставляет видео или возвращает токены), потом
+  отменяет остальные, а задачи с checkpoint сохраняет в background_tasks;
+  resume() после старта отдаёт их зарегистрированным через resumable() функциям.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+from aiogram import Bot
+
+from config import BACKGROUND_SHUTDOWN_TIMEOUT, BACKGROUND_TASK_LIMIT
+from database import db
+from metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_TASKS = gauge(
+    "bot_background_tasks",
+    "Supervised background tasks currently running",
+    ("kind",),
+)
+BACKGROUND_TASK_FAILURES = counter(
+    "bot_background_task_failures_total",
+    "Background tasks that ended with an exception",
+    ("kind",),
+)
+BACKGROUND_TASKS_REJECTED = counter(
+    "bot_background_tasks_rejected_total",
+    "spawn() calls refused because the supervisor is full or shutting down",
+    ("kind",),
+)
+
+# Возвращает аргументы для перезапуска (JSON-сериализуемые) или None — не сохранять
+Checkpoint = Callable[[], Optional[Dict[str, Any]]]
+# (bot, аргументы из checkpoint) → запустить задачу заново
+Resumer = Callable[[Bot, Dict[str, Any]], None]
+
+
+class SupervisorFull(RuntimeError):
+    """Лимит фоновых задач исчерпан или бот останавливается."""
+
+
+class Reservation:
+    """Место под некритичную задачу, занятое заранее (TaskSupervisor.reserve)."""
+
+    __slots__ = ("_supervisor", "active")
+
+    def __init__(self, supervisor: "TaskSupervisor"):
+        self._supervisor = supervisor
+        self.active = True
+
+    def release(self) -> None:
+        """Вернуть место, если spawn так и не понадобился (повторно — ничего)."""
+        if self.active:
+            self.active = False
+            self._supervisor._reserved -= 1
+
+
+class _Supervised:
+    __slots__ = ("kind", "checkpoint", "critical")
+
+    def __init__(self, kind: str, checkpoint: Optional[Checkpoint], critical: bool):
+        self.kind = kind
+        self.checkpoint = checkpoint
+        self.critical = critical
+
+
+class TaskSupervisor:
+    def __init__(self, limit: int = BACKGROUND_TASK_LIMIT):
+        self.limit = limit
+        self._tasks: Dict[asyncio.Task, _Supervised] = {}
+        self._regular = 0
+        self._reserved = 0
+        self._resumers: Dict[str, Resumer] = {}
+        self._closing = False
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def full(self) -> bool:
+        """Новую некритичную задачу сейчас не запустить."""
+        return self._closing or self._regular + self._reserved >= self.limit
+
+    def reserve(self, kind: str) -> Reservation:
+        """
+        Занять место под некритичную задачу до того, как она понадобится
+        (до списания токенов). SupervisorFull — мест нет. Место отдаётся
+        в spawn(..., reservation=...) или через release().
+        """
+        if self.full:
+            BACKGROUND_TASKS_REJECTED.labels(kind).inc()
+            raise SupervisorFull(f"cannot reserve {kind}: {len(self._tasks)} background tasks running")
+        self._reserved += 1
+        return Reservation(self)
+
+    def spawn(
+        self,
+        coro: Coroutine,
+        *,
+        name: str,
+        kind: str,
+        checkpoint: Optional[Checkpoint] = None,
+        critical: bool = False,
+        reservation: Optional[Reservation] = None,
+    ) -> asyncio.Task:
+        """
+        Запустить корутину под присмотром. critical — служебные задачи
+        (сверка, запись статистики), лимит на них не действует.
+        reservation — место, занятое заранее через reserve(): лимит уже учтён.
+        """
+        reserved = reservation is not None and reservation.active
+        if reserved:
+            reservation.release()
+        if self._closing or (not critical and not reserved and self._regular + self._reserved >= self.limit):
+            coro.close()
+            BACKGROUND_TASKS_REJECTED.labels(kind).inc()
+            raise SupervisorFull(f"cannot start {name}: {len(self._tasks)} background tasks running")
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[task] = _Supervised(kind, checkpoint, critical)
+        if not critical:
+            self._regular += 1
+        BACKGROUND_TASKS.labels(kind).inc()
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        entry = self._tasks.pop(task, None)
+        if entry is None:
+            return
+        if not entry.critical:
+            self._regular -= 1
+        BACKGROUND_TASKS.labels(entry.kind).dec()
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            BACKGROUND_TASK_FAILURES.labels(entry.kind).inc()
+            logger.error("Background task %s failed: %r", task.get_name(), exc, exc_info=exc)
+
+    #  РЕСТАРТ
+
+    def resumable(self, kind: str, resumer: Resumer) -> None:
+        """Как перезапустить задачи вида kind, сохранённые при остановке."""
+        self._resumers[kind] = resumer
+
+    async def resume(self, bot: Bot) -> int:
+        """После старта: перезапустить задачи, сохранённые прошлым shutdown()."""
+        rows = await db.take_background_tasks()
+        resumed = 0
+        for row in rows:
+            resumer = self._resumers.get(row["kind"])
+            if resumer is None:
+                logger.warning("No resumer for saved task %s (%s), dropped", row["name"], row["kind"])
+                continue
+            try:
+                resumer(bot, json.loads(row["payload"]))
+                resumed += 1
+            except Exception:
+                logger.exception("Failed to resume %s", row["name"])
+        if rows:
+            logger.info("Resumed %s/%s background task(s) saved at shutdown", resumed, len(rows))
+        return resumed
+
+    @staticmethod
+    def _checkpoint(task: asyncio.Task, entry: _Supervised) -> Optional[Dict[str, Any]]:
+        try:
+            return entry.checkpoint()
+        except Exception:
+            logger.exception("Checkpoint of %s failed", task.get_name())
+            return None
+
+    async def shutdown(self, timeout: float = BACKGROUND_SHUTDOWN_TIMEOUT) -> int:
+        """
+        Остановить все задачи (не дольше timeout на каждый из двух шагов).
+        Задачи, которые не закончили сами, сохраняются по checkpoint.
+        Вызывать до закрытия БД.
+        """
+        self._closing = True
+
+        # 1. Дожидаемся задач, которые уже завершают работу: отмена посреди
+        #    возврата токенов или доставки видео потеряла бы их результат.
+        #    Пока ждём, завершаться могут начать другие — проверяем снова
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            finishing = [
+                task
+                for task, entry in self._tasks.items()
+                if entry.checkpoint is not None and self._checkpoint(task, entry) is None
+            ]
+            remaining = deadline - loop.time()
+            if not finishing or remaining <= 0:
+                break
+            logger.info("Supervisor: waiting for %s finishing task(s)", len(finishing))
+            await asyncio.wait(finishing, timeout=remaining)
+
+        # 2. Checkpoint и отмена — без await между ними: задача не успеет
+        #    перейти в «завершается» после снятого checkpoint
+        tasks = list(self._tasks.items())
+        payloads = {}
+        for task, entry in tasks:
+            if entry.checkpoint is not None:
+                payloads[task] = self._checkpoint(task, entry)
+            task.cancel()
+        if tasks:
+            await asyncio.wait([task for task, _ in tasks], timeout=timeout)
+
+        rows = [
+            (task.get_name(), entry.kind, json.dumps(payloads[task]))
+            for task, entry in tasks
+            if payloads.get(task) is not None and (task.cancelled() or not task.done())
+        ]
+        try:
+            await db.save_background_tasks(rows)
+        except Exception:
+            logger.exception("Failed to save %s background task(s)", len(rows))
+            return 0
+        still_running = sum(1 for task, _ in tasks if not task.done())
+        logger.info(
+            "Supervisor stopped %d task(s), saved %d for restart, %d did not stop in %ss",
+            len(tasks), len(rows), still_running, timeout,
+        )
+        return len(rows)
+
+
+# Глобальный супервизор фоновых задач
+supervisor = TaskSupervisor()
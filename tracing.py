@@ -0,0 +1,438 @@
+# tracing.py
+"""
+Трассировка жизненного цикла генерации.
+
+Одна генерация = одна трасса: confirm_video/confirm_veo → отправка задачи
+в KIE → каждый опрос статуса → доставка видео в Telegram. Контекст трассы
+живёт в contextvars, поэтому фоновая задача опроса (asyncio.create_task)
+наследует его сама. Когда KIE выдаёт taskId, трасса привязывается к нему
+(tracer.bind_task) — по task id её потом и ищем.
+
+Готовые спаны уходят в экспортёры: в памяти всегда держим последние
+TRACE_MAX_TRACES трасс (для /trace), а если задан TRACE_FILE — ещё и пишем
+JSON Lines в файл для разбора офлайн (пишет отдельный поток, файл
+ротируется по размеру TRACE_FILE_MAX_BYTES).
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config import TRACE_FILE, TRACE_FILE_BACKUPS, TRACE_FILE_MAX_BYTES, TRACE_MAX_TRACES
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+SPANS_DROPPED = counter(
+    "bot_trace_spans_dropped_total",
+    "Spans dropped because the span file queue was full",
+)
+
+
+#  СПАН
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent", "name", "start", "end", "attrs", "status")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.status = "ok"
+
+    @property
+    def parent_id(self) -> Optional[str]:
+        return self.parent.span_id if self.parent else None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def lookup(self, key: str, default: Any = None) -> Any:
+        """Атрибут этого спана или ближайшего предка (uid, engine, task_id…)."""
+        span: Optional[Span] = self
+        while span is not None:
+            if key in span.attrs:
+                return span.attrs[key]
+            span = span.parent
+        return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+#  ЭКСПОРТЁРЫ
+
+class SpanExporter:
+    """Куда уходят законченные спаны. Ошибки экспортёра не ломают хендлеры."""
+
+    # find читает диск и т.п. — Tracer.find вызывает его через asyncio.to_thread
+    blocking_find = False
+
+    def export(self, span: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        self.flush()
+
+    def find(self, task_id: str) -> List[Dict[str, Any]]:
+        """Спаны трассы по task id (если экспортёр умеет искать)."""
+        return []
+
+
+class MemorySpanExporter(SpanExporter):
+    """Последние max_traces трасс в памяти."""
+
+    def __init__(self, max_traces: int = TRACE_MAX_TRACES):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._by_task: Dict[str, str] = {}
+
+    def export(self, span: Dict[str, Any]) -> None:
+        trace_id = span["trace_id"]
+        spans = self._traces.get(trace_id)
+        if spans is None:
+            spans = self._traces[trace_id] = []
+            if len(self._traces) > self.max_traces:
+                old_id, old = self._traces.popitem(last=False)
+                for s in old:
+                    task_id = s["attrs"].get("task_id")
+                    if task_id and self._by_task.get(task_id) == old_id:
+                        del self._by_task[task_id]
+        spans.append(span)
+        task_id = span["attrs"].get("task_id")
+        if task_id:
+            self._by_task[task_id] = trace_id
+
+    def find(self, task_id: str) -> List[Dict[str, Any]]:
+        trace_id = self._by_task.get(task_id)
+        return list(self._traces.get(trace_id, ())) if trace_id else []
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    JSON Lines в файл. Event loop только кладёт спан в очередь; сериализует
+    и пишет отдельный поток — пачками, раз в flush_every спанов или раз
+    в flush_interval секунд. Очередь переполнена — спан теряется (счётчик
+    в метриках), хендлеры не ждут диска.
+
+    Файл больше max_bytes переименовывается в path.1 (path.1 → path.2 и т.д.,
+    хранится backups старых файлов), запись продолжается в новый.
+    """
+
+    blocking_find = True
+
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = 100,
+        flush_interval: float = 1.0,
+        max_bytes: int = TRACE_FILE_MAX_BYTES,
+        backups: int = TRACE_FILE_BACKUPS,
+        queue_size: int = 10_000,
+    ):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        # запись и ротация vs. поиск по файлам из другого потока
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="span-writer", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            SPANS_DROPPED.inc()
+
+    def flush(self) -> None:
+        """Дождаться, пока поток записи допишет всё, что уже в очереди."""
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def shutdown(self) -> None:
+        if self._thread.is_alive():
+            # при остановке очередь может быть полной — тут подождать можно
+            self._queue.put(None)
+            self._thread.join()
+
+    #  поток записи
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_every:
+                try:
+                    span = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is None:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(span)
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("span file write failed, %d span(s) lost", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in batch)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+                size = f.tell()
+            if self.max_bytes and size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self) -> None:
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    #  поиск (блокирующий — Tracer.find зовёт его в отдельном потоке)
+
+    def find(self, task_id: str) -> List[Dict[str, Any]]:
+        self.flush()
+        with self._lock:
+            # от новых файлов к старым; трасса целиком лежит в одном-двух соседних
+            files = [self.path] + [f"{self.path}.{i}" for i in range(1, self.backups + 1)]
+            for n, path in enumerate(files):
+                trace_id = None
+                for span in self._scan(path, task_id):
+                    if span["attrs"].get("task_id") == task_id:
+                        trace_id = span["trace_id"]
+                        break
+                if trace_id is None:
+                    continue
+                # вторым проходом — все спаны трассы, в т.ч. до привязки к task id
+                # (они могли остаться в предыдущем файле до ротации)
+                spans: List[Dict[str, Any]] = []
+                for older in reversed(files[n:n + 2]):
+                    spans.extend(s for s in self._scan(older, trace_id) if s["trace_id"] == trace_id)
+                return spans
+        return []
+
+    @staticmethod
+    def _scan(path: str, needle: str) -> Iterator[Dict[str, Any]]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if needle not in line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            return
+
+
+#  ТРЕЙСЕР
+
+class Tracer:
+    # сколько привязок trace → task id помним (опрос идёт дольше корневого спана)
+    MAX_BOUND = 10_000
+
+    def __init__(self, exporters: Optional[List[SpanExporter]] = None):
+        self.exporters: List[SpanExporter] = list(exporters or [])
+        self._task_of_trace: "OrderedDict[str, str]" = OrderedDict()
+
+    def add_exporter(self, exporter: SpanExporter) -> None:
+        self.exporters.append(exporter)
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        """
+        Спан вокруг блока кода. Без текущего спана начинается новая трасса.
+        """
+        span = Span(name, _current.get(), attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attrs["error"] = repr(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end = time.time()
+            self._export(span)
+
+    def record(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        """Уже законченный спан (start/end — time.time()) в текущей трассе."""
+        parent = _current.get()
+        if parent is None:
+            return
+        span = Span(name, parent, attrs)
+        span.start, span.end = start, end
+        self._export(span)
+
+    def bind_task(self, task_id: str) -> None:
+        """Привязать текущую трассу к task id KIE."""
+        span = _current.get()
+        if span is None or not task_id:
+            return
+        self._task_of_trace[span.trace_id] = str(task_id)
+        if len(self._task_of_trace) > self.MAX_BOUND:
+            self._task_of_trace.popitem(last=False)
+        span.attrs["task_id"] = str(task_id)
+
+    def _export(self, span: Span) -> None:
+        task_id = self._task_of_trace.get(span.trace_id)
+        if task_id:
+            span.attrs.setdefault("task_id", task_id)
+        data = span.to_dict()
+        for exporter in self.exporters:
+            try:
+                exporter.export(data)
+            except Exception:
+                logger.exception("span exporter %s failed", type(exporter).__name__)
+
+    async def find(self, task_id: str) -> List[Dict[str, Any]]:
+        """Спаны трассы по task id: сначала из памяти, потом из файла."""
+        for exporter in self.exporters:
+            try:
+                if exporter.blocking_find:
+                    spans = await asyncio.to_thread(exporter.find, task_id)
+                else:
+                    spans = exporter.find(task_id)
+            except Exception:
+                logger.exception("span exporter %s: find failed", type(exporter).__name__)
+                continue
+            if spans:
+                return sorted(spans, key=lambda s: s["start"])
+        return []
+
+    def shutdown(self) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.shutdown()
+            except Exception:
+                logger.exception("span exporter %s: shutdown failed", type(exporter).__name__)
+
+
+def traced(name: str) -> Callable:
+    """
+    Декоратор для async-функции: её вызов — спан name.
+    Сигнатура сохраняется (functools.wraps), aiogram и CallbackRouter
+    передают аргументы как раньше.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def annotate(**attrs: Any) -> None:
+    """Добавить атрибуты текущему спану (вне трассы — ничего не делает)."""
+    span = _current.get()
+    if span is not None:
+        span.attrs.update(attrs)
+
+
+#  ТАЙМЛАЙН ДЛЯ АДМИНА
+
+def format_timeline(spans: List[Dict[str, Any]], limit: int = 3500) -> str:
+    """
+    Текстовый таймлайн трассы: смещение от начала, длительность, имя, атрибуты.
+    Подряд идущие опросы с одинаковым состоянием схлопываются в одну строку.
+    """
+    if not spans:
+        return ""
+    t0 = spans[0]["start"]
+    end = max((s["end"] or s["start"]) for s in spans)
+    lines = [f"trace {spans[0]['trace_id']} · {end - t0:.1f}s total"]
+
+    def describe(s: Dict[str, Any]) -> str:
+        attrs = {k: v for k, v in s["attrs"].items() if k != "task_id"}
+        text = " ".join(f"{k}={v}" for k, v in attrs.items())
+        if s["status"] != "ok":
+            text = f"[{s['status']}] {text}"
+        return text
+
+    i = 0
+    while i < len(spans):
+        s = spans[i]
+        j = i + 1
+        while (
+            j < len(spans)
+            and spans[j]["name"] == s["name"]
+            and spans[j]["attrs"] == s["attrs"]
+            and spans[j]["status"] == s["status"]
+        ):
+            j += 1
+        offset = s["start"] - t0
+        duration = (s["end"] or s["start"]) - s["start"]
+        if j - i > 1:
+            last = spans[j - 1]
+            lines.append(
+                f"+{offset:8.2f}s  {s['name']} ×{j - i} "
+                f"(до +{last['start'] - t0:.2f}s) {describe(s)}"
+            )
+        else:
+            lines.append(f"+{offset:8.2f}s {duration:7.2f}s  {s['name']} {describe(s)}")
+        i = j
+
+    text = "\n".join(lines)
+    if len(text) > limit:
+        text = text[:limit] + "\n…"
+    return text
+
+
+# Глобальный трейсер
+tracer = Tracer([MemorySpanExporter()])
+if TRACE_FILE:
+    tracer.add_exporter(FileSpanExporter(TRACE_FILE))
@@ -1,20 +1,289 @@
 # utils.py
 import asyncio
+import heapq
+import itertools
 import logging
-from typing import Optional
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from aiogram import Bot
 from aiogram.types import Message
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+from config import (
+    TG_GLOBAL_RATE,
+    TG_CHAT_RATE,
+    TG_CHAT_BURST,
+    TG_GROUP_PER_MINUTE,
+    TG_SEND_DEADLINE,
+)
+from metrics import TELEGRAM_CALLS, TELEGRAM_CALL_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
+#  ПРИОРИТЕТЫ ИСХОДЯЩИХ СООБЩЕНИЙ
+#  (меньше число — раньше уходит в Telegram)
+
+PRIORITY_CRITICAL = 0   # готовые видео, подтверждения оплаты
+PRIORITY_NORMAL = 1     # обычные ответы
+PRIORITY_LOW = 2        # правки меню, удаление сообщений
+
+# Сколько секунд имеет смысл пытаться доставить запрос каждого приоритета.
+# Устаревшая правка меню никому не нужна, а готовое видео — нужно.
+_DEADLINES: Dict[int, float] = {
+    PRIORITY_CRITICAL: TG_SEND_DEADLINE,
+    PRIORITY_NORMAL: TG_SEND_DEADLINE,
+    PRIORITY_LOW: min(15, TG_SEND_DEADLINE),
+}
+
+# Ошибки, после которых запрос стоит повторить
+_RETRYABLE = (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+    asyncio.TimeoutError,
+)
+
+
+#  TOKEN BUCKET С ПРИОРИТЕТНОЙ ОЧЕРЕДЬЮ
+
+class TokenBucket:
+    """
+    Token bucket: rate токенов в секунду, не больше capacity в запасе.
+    Ожидающие выстраиваются по (priority, порядок прихода), поэтому
+    при нехватке токенов критичные запросы обгоняют правки меню.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        """Бакет полон и никто не ждёт — его можно выбросить."""
+        self._refill()
+        return not self._waiters and self._tokens >= self.capacity
+
+    def penalize(self, seconds: float) -> None:
+        """
+        Telegram ответил 429 — не выдаём токены ближайшие seconds секунд.
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._schedule()
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> None:
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._schedule()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # токен уже выдан, но забрать его не успели — возвращаем
+                self._tokens += 1
+                self._wake()
+            raise
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self._waiters:
+            return
+        delay = max(0.0, (1 - self._tokens) / self.rate)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue  # ожидающий отменён
+            self._tokens -= 1
+            fut.set_result(None)
+        # выбрасываем отменённых с головы, чтобы не будить таймер зря
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        self._schedule()
+
+
+#  СЧЁТЧИК НЕЗАВЕРШЁННОЙ РАБОТЫ (для плавной остановки)
+
+class ActiveCounter:
+    """
+    Сколько операций сейчас выполняется; drain() ждёт, пока их станет 0.
+    enter()/leave() — без await, стоят копейки на горячем пути.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    def enter(self) -> None:
+        self.active += 1
+
+    def leave(self) -> None:
+        self.active -= 1
+        if self.active == 0 and self._idle is not None:
+            self._idle.set()
+
+    async def drain(self, timeout: float) -> int:
+        """Дождаться нуля (не дольше timeout); сколько осталось незавершённых."""
+        if self.active:
+            self._idle = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._idle = None
+        return self.active
+
+
+#  ЦЕНТРАЛЬНЫЙ ПЛАНИРОВЩИК ИСХОДЯЩИХ ЗАПРОСОВ
+
+class OutboundScheduler:
+    """
+    Все исходящие вызовы Bot API из safe_* идут через этот планировщик:
+    - глобальный лимит бота и лимит на чат (token bucket);
+    - приоритеты: доставка видео и оплаты обгоняют правки меню;
+    - повтор с экспоненциальной задержкой и джиттером до дедлайна;
+    - на 429 весь чат ставится на паузу на retry_after.
+    """
+
+    # держим не больше стольких бакетов чатов, простаивающие выбрасываем
+    MAX_CHAT_BUCKETS = 10_000
+
+    def __init__(
+        self,
+        global_rate: float = TG_GLOBAL_RATE,
+        chat_rate: float = TG_CHAT_RATE,
+        chat_burst: float = TG_CHAT_BURST,
+        group_per_minute: float = TG_GROUP_PER_MINUTE,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60.0
+        self._chats: Dict[int, TokenBucket] = {}
+        # вызовы в очереди или в полёте — их дожидаемся при остановке
+        self.pending = ActiveCounter()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._prune()
+            if chat_id < 0:
+                # группы и каналы
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self) -> None:
+        for chat_id in [cid for cid, b in self._chats.items() if b.idle]:
+            del self._chats[chat_id]
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Full jitter: случайная задержка от 0 до 0.5 * 2^attempt (≤ 30 с)."""
+        return random.uniform(0, min(30.0, 0.5 * (2 ** attempt)))
+
+    async def call(
+        self,
+        chat_id: Optional[int],
+        request: Callable[[], Awaitable[Any]],
+        priority: int = PRIORITY_NORMAL,
+        deadline: Optional[float] = None,
+        method: str = "other",
+    ) -> Any:
+        """
+        Выполнить request() с соблюдением лимитов.
+        request — фабрика корутины (вызывается заново на каждую попытку).
+        method — имя метода Bot API для метрик.
+        Пробрасывает последнюю ошибку, если до дедлайна так и не получилось.
+        """
+        if deadline is None:
+            deadline = _DEADLINES.get(priority, TG_SEND_DEADLINE)
+        started = time.monotonic()
+        give_up_at = started + deadline
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+
+        attempt = 0
+        self.pending.enter()
+        try:
+            while True:
+                if chat_bucket is not None:
+                    await chat_bucket.acquire(priority)
+                await self.global_bucket.acquire(priority)
+
+                try:
+                    result = await request()
+                    TELEGRAM_CALLS.labels(method, "ok").inc()
+                    return result
+                except _RETRYABLE as e:
+                    if isinstance(e, TelegramRetryAfter):
+                        TELEGRAM_CALLS.labels(method, "rate_limited").inc()
+                        delay = _retry_after_delay(e) + random.uniform(0, 1)
+                        (chat_bucket or self.global_bucket).penalize(delay)
+                    else:
+                        TELEGRAM_CALLS.labels(method, "retry").inc()
+                        delay = self._backoff(attempt)
+                    attempt += 1
+
+                    if time.monotonic() + delay >= give_up_at:
+                        TELEGRAM_CALLS.labels(method, "gave_up").inc()
+                        raise
+                    logger.info(
+                        "outbound: retry #%d for chat %s in %.1fs: %r", attempt, chat_id, delay, e
+                    )
+                    if not isinstance(e, TelegramRetryAfter):
+                        await asyncio.sleep(delay)
+                    # при 429 ждать будем на acquire() оштрафованного бакета
+                except Exception:
+                    TELEGRAM_CALLS.labels(method, "failed").inc()
+                    raise
+        finally:
+            self.pending.leave()
+            TELEGRAM_CALL_SECONDS.labels(method).observe(time.monotonic() - started)
+
+
+# Глобальный планировщик исходящих запросов
+outbound = OutboundScheduler()
+
+
 #  ВСПОМОГАТЕЛЬНОЕ
 
-async def _retry_after_sleep(e: TelegramRetryAfter) -> None:
+def _retry_after_delay(e: TelegramRetryAfter) -> float:
     """
-    Аккуратно поспать, если Telegram попросил подождать (429 Too Many Requests).
+    Сколько Telegram попросил подождать (429 Too Many Requests).
     """
     try:
         delay = int(getattr(e, "retry_after", 1))  # на всякий случай
@@ -22,7 +291,7 @@ async def _retry_after_sleep(e: TelegramRetryAfter) -> None:
         delay = 1
     if delay < 0:
         delay = 1
-    await asyncio.sleep(delay)
+    return delay
 
 
 
@@ -32,30 +301,32 @@ async def safe_send_message(
     bot: Bot,
     chat_id: int,
     text: str,
+    *,
+    priority: int = PRIORITY_NORMAL,
     **kwargs,
 ) -> bool:
     """
     Безопасно отправить текстовое сообщение:
-    - обрабатывает TelegramRetryAfter (повтор)
+    - идёт через планировщик (лимиты, приоритет, повтор до дедлайна)
     - глотает Forbidden/BadRequest (например, пользователю нельзя писать)
     - логирует неожиданные ошибки
     """
     try:
-        await bot.send_message(chat_id, text, **kwargs)
+        await outbound.call(
+            chat_id,
+            lambda: bot.send_message(chat_id, text, **kwargs),
+            priority=priority,
+            method="send_message",
+        )
         return True
-    except TelegramRetryAfter as e:
-        await _retry_after_sleep(e)
-        try:
-            await bot.send_message(chat_id, text, **kwargs)
-            return True
-        except Exception as err:
-            logger.warning(f"safe_send_message: retry failed: {err}")
-            return False
     except (TelegramForbiddenError, TelegramBadRequest) as e:
-        logger.info(f"safe_send_message: forbidden/badrequest for chat {chat_id}: {e}")
+        logger.info("safe_send_message: forbidden/badrequest for chat %s: %s", chat_id, e)
+        return False
+    except _RETRYABLE as e:
+        logger.warning("safe_send_message: gave up for chat %s: %r", chat_id, e)
         return False
     except Exception as e:
-        logger.exception(f"safe_send_message: unexpected error for chat {chat_id}: {e}")
+        logger.exception("safe_send_message: unexpected error for chat %s: %s", chat_id, e)
         return False
 
 
@@ -74,32 +345,67 @@ async def safe_send_video(
     bot: Bot,
     chat_id: int,
     video: str,
+    *,
+    priority: int = PRIORITY_CRITICAL,
     **kwargs,
 ) -> bool:
     """
     Безопасная отправка видео по URL/файлу.
+    По умолчанию — высший приоритет: это доставка готового результата.
     """
     try:
-        await bot.send_video(chat_id=chat_id, video=video, **kwargs)
+        await outbound.call(
+            chat_id,
+            lambda: bot.send_video(chat_id=chat_id, video=video, **kwargs),
+            priority=priority,
+            method="send_video",
+        )
+        return True
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        logger.info("safe_send_video: forbidden/badrequest for chat %s: %s", chat_id, e)
+        return False
+    except _RETRYABLE as e:
+        logger.warning("safe_send_video: gave up for chat %s: %r", chat_id, e)
+        return False
+    except Exception as e:
+        logger.exception("safe_send_video: unexpected error for chat %s: %s", chat_id, e)
+        return False
+
+
+async def safe_send_document(
+    bot: Bot,
+    chat_id: int,
+    document: Any,
+    *,
+    priority: int = PRIORITY_NORMAL,
+    **kwargs,
+) -> bool:
+    """
+    Безопасная отправка файла (InputFile или file_id/URL).
+    """
+    try:
+        await outbound.call(
+            chat_id,
+            lambda: bot.send_document(chat_id=chat_id, document=document, **kwargs),
+            priority=priority,
+            method="send_document",
+        )
         return True
-    except TelegramRetryAfter as e:
-        await _retry_after_sleep(e)
-        try:
-            await bot.send_video(chat_id=chat_id, video=video, **kwargs)
-            return True
-        except Exception as err:
-            logger.warning(f"safe_send_video: retry failed: {err}")
-            return False
     except (TelegramForbiddenError, TelegramBadRequest) as e:
-        logger.info(f"safe_send_video: forbidden/badrequest for chat {chat_id}: {e}")
+        logger.info("safe_send_document: forbidden/badrequest for chat %s: %s", chat_id, e)
+        return False
+    except _RETRYABLE as e:
+        logger.warning("safe_send_document: gave up for chat %s: %r", chat_id, e)
         return False
     except Exception as e:
-        logger.exception(f"safe_send_video: unexpected error for chat {chat_id}: {e}")
+        logger.exception("safe_send_document: unexpected error for chat %s: %s", chat_id, e)
         return False
 
 
 async def safe_send_invoice(
     bot: Bot,
+    *,
+    priority: int = PRIORITY_CRITICAL,
     **kwargs,
 ) -> Optional[Message]:
     """
@@ -107,78 +413,114 @@ async def safe_send_invoice(
     Возвращает Message с инвойсом или None при ошибке.
     """
     try:
-        msg = await bot.send_invoice(**kwargs)
+        msg = await outbound.call(
+            kwargs.get("chat_id"),
+            lambda: bot.send_invoice(**kwargs),
+            priority=priority,
+            method="send_invoice",
+        )
         return msg
-    except TelegramRetryAfter as e:
-        await _retry_after_sleep(e)
-        try:
-            msg = await bot.send_invoice(**kwargs)
-            return msg
-        except Exception as err:
-            logger.warning(f"safe_send_invoice: retry failed: {err}")
-            return None
     except (TelegramForbiddenError, TelegramBadRequest) as e:
-        logger.info(f"safe_send_invoice: forbidden/badrequest: {e}")
+        logger.info("safe_send_invoice: forbidden/badrequest: %s", e)
+        return None
+    except _RETRYABLE as e:
+        logger.warning("safe_send_invoice: gave up: %r", e)
         return None
     except Exception as e:
-        logger.exception(f"safe_send_invoice: unexpected error: {e}")
+        logger.exception("safe_send_invoice: unexpected error: %s", e)
         return None
 
 
 async def safe_edit_text(
     message: Message,
     text: str,
+    *,
+    priority: int = PRIORITY_LOW,
     **kwargs,
 ) -> bool:
     """
     Безопасно отредактировать текст уже существующего сообщения.
     """
     try:
-        await message.edit_text(text, **kwargs)
+        await outbound.call(
+            message.chat.id,
+            lambda: message.edit_text(text, **kwargs),
+            priority=priority,
+            method="edit_message_text",
+        )
         return True
-    except TelegramRetryAfter as e:
-        await _retry_after_sleep(e)
-        try:
-            await message.edit_text(text, **kwargs)
-            return True
-        except Exception as err:
-            logger.warning(f"safe_edit_text: retry failed: {err}")
-            return False
     except TelegramBadRequest as e:
         # Например: "message is not modified" или нельзя редактировать старое сообщение.
-        logger.info(f"safe_edit_text: badrequest: {e}")
+        logger.info("safe_edit_text: badrequest: %s", e)
         return False
     except TelegramForbiddenError as e:
-        logger.info(f"safe_edit_text: forbidden: {e}")
+        logger.info("safe_edit_text: forbidden: %s", e)
+        return False
+    except _RETRYABLE as e:
+        logger.warning("safe_edit_text: gave up: %r", e)
+        return False
+    except Exception as e:
+        logger.exception("safe_edit_text: unexpected error: %s", e)
+        return False
+
+
+async def safe_edit_message_text(
+    bot: Bot,
+    chat_id: int,
+    message_id: int,
+    text: str,
+    *,
+    priority: int = PRIORITY_LOW,
+    **kwargs,
+) -> bool:
+    """
+    То же, что safe_edit_text, но по chat_id/message_id — когда объекта
+    Message нет (например, сообщение о прогрессе после рестарта).
+    """
+    try:
+        await outbound.call(
+            chat_id,
+            lambda: bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs),
+            priority=priority,
+            method="edit_message_text",
+        )
+        return True
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        logger.info("safe_edit_message_text: forbidden/badrequest for chat %s: %s", chat_id, e)
+        return False
+    except _RETRYABLE as e:
+        logger.warning("safe_edit_message_text: gave up for chat %s: %r", chat_id, e)
         return False
     except Exception as e:
-        logger.exception(f"safe_edit_text: unexpected error: {e}")
+        logger.exception("safe_edit_message_text: unexpected error for chat %s: %s", chat_id, e)
         return False
 
 
 async def safe_edit_reply_markup(
     message: Message,
+    *,
+    priority: int = PRIORITY_LOW,
     **kwargs,
 ) -> bool:
     """
     Безопасное редактирование только разметки (клавиатуры) сообщения.
     """
     try:
-        await message.edit_reply_markup(**kwargs)
+        await outbound.call(
+            message.chat.id,
+            lambda: message.edit_reply_markup(**kwargs),
+            priority=priority,
+            method="edit_message_reply_markup",
+        )
         return True
-    except TelegramRetryAfter as e:
-        await _retry_after_sleep(e)
-        try:
-            await message.edit_reply_markup(**kwargs)
-            return True
-        except Exception as err:
-            logger.warning(f"safe_edit_reply_markup: retry failed: {err}")
-            return False
     except (TelegramBadRequest, TelegramForbiddenError) as e:
-        logger.info(f"safe_edit_reply_markup: badrequest/forbidden: {e}")
+        logger.info("safe_edit_reply_markup: badrequest/forbidden: %s", e)
+        return False
+    except _RETRYABLE as e:
+        logger.warning("safe_edit_reply_markup: gave up: %r", e)
         return False
     except Exception as e:
-        logger.exception(f"safe_edit_reply_markup: unexpected error: {e}")
+        logger.exception("safe_edit_reply_markup: unexpected error: %s", e)
         return False
 
 
@@ -186,16 +528,26 @@ async def safe_delete_message(
     bot: Bot,
     chat_id: int,
     message_id: int,
+    *,
+    priority: int = PRIORITY_LOW,
 ) -> bool:
     """
     Безопасное удаление сообщения.
     """
     try:
-        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        await outbound.call(
+            chat_id,
+            lambda: bot.delete_message(chat_id=chat_id, message_id=message_id),
+            priority=priority,
+            method="delete_message",
+        )
         return True
     except (TelegramBadRequest, TelegramForbiddenError) as e:
-        logger.info(f"safe_delete_message: badrequest/forbidden for chat {chat_id}: {e}")
+        logger.info("safe_delete_message: badrequest/forbidden for chat %s: %s", chat_id, e)
+        return False
+    except _RETRYABLE as e:
+        logger.warning("safe_delete_message: gave up for chat %s: %r", chat_id, e)
         return False
     except Exception as e:
-        logger.exception(f"safe_delete_message: unexpected error for chat {chat_id}: {e}")
+        logger.exception("safe_delete_message: unexpected error for chat %s: %s", chat_id, e)
         return False
@@ -2,38 +2,49 @@
 import json
 import logging
 import random
-import asyncio
+import time
 from typing import List, Optional
 
-import aiohttp
 from aiogram import Dispatcher, F
-from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup
+from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
 
 from config import (
     VEO_URL,
     KIE_API_KEY,
-    VEO_FAST_COST,
-    VEO_QUALITY_COST,
     VEO_STATUS,
 )
 from database import db
+from delivery import deliver_video
+from http_client import get_session
+from inflight import inflight
+from metrics import (
+    KIE_REQUEST_SECONDS,
+    KIE_REQUESTS,
+    GENERATIONS_IN_FLIGHT,
+    GENERATIONS,
+    REFUNDS,
+)
 from keyboards import (
     veo_mode_keyboard,
     veo_quality_keyboard,
     get_veo_confirmation_keyboard,
     engine_select_keyboard,
-    back_btn,
+    back_keyboard,
     veo_aspect_keyboard,  # 🔹 новая клавиатура выбора ориентации
 )
+from prescreen import REJECT, WARN, check_prompt, is_policy_failure, learn, reject_text, warn_text
+from pricing import catalog
+from routing import get_callback_router
 from states import VeoStates
+from stats import stats
+from supervisor import Reservation, SupervisorFull, supervisor
+from tracing import tracer, traced, annotate
 from utils import (
     safe_answer,
     safe_send_message,
-    safe_send_video,
     safe_edit_text,
 )
-from subscription import main_menu_keyboard
 
 logger = logging.getLogger(__name__)
 
@@ -60,116 +71,181 @@ def _human_model_name(model: str) -> str:
 
 
 def _cost_for_model(model: str) -> int:
-    return VEO_FAST_COST if model == "veo3_fast" else VEO_QUALITY_COST
+    return catalog().veo_cost(model)
 
 
 # ОПРОС СТАТУСА VEO (taskId)
 
-async def check_veo_status(bot, uid: int, task_id: str, cost: int) -> None:
+@traced("kie.wait")
+async def check_veo_status(
+    bot, uid: int, task_id: str, cost: int, model: str = "veo3", prompt: str = ""
+) -> None:
+    entry = inflight.add(task_id, "veo", model, uid, cost)
+    GENERATIONS_IN_FLIGHT.labels("veo").inc()
     try:
-        async with aiohttp.ClientSession() as session:
-            for _ in range(90):  # 12 минут ожидания
-
-                try:
-                    async with session.get(
-                        VEO_STATUS,
-                        params={"taskId": task_id},
-                        headers=_veo_headers(),
-                        timeout=30,
-                    ) as resp:
-
-                        try:
-                            result = await resp.json(content_type=None)
-                        except Exception:
-                            result = {"raw": await resp.text()}
-
-                        if resp.status != 200 or result.get("code") != 200:
-                            await asyncio.sleep(8)
-                            continue
-
-                        data = result.get("data") or {}
-                        flag = data.get("successFlag")
-                        response = data.get("response")
-
-                        # --- генерируется ---
-                        if flag == 0:
-                            await asyncio.sleep(8)
-                            continue
-
-                        # --- завершено ---
-                        if flag == 1:
-                            video_url = None
-
-                            if isinstance(response, dict):
-                                # основной рабочий путь
-                                urls = response.get("resultUrls")
-                                if isinstance(urls, list) and len(urls) > 0:
-                                    video_url = urls[0]
-
-                                # запасной путь (если будет videoUrl)
-                                if not video_url:
-                                    video_url = (
-                                        response.get("videoUrl")
-                                        or response.get("video_url")
-                                    )
+        session = get_session()
+        for _ in range(90):  # 12 минут ожидания
+
+            started = time.perf_counter()
+            poll_start = time.time()
+            try:
+                async with session.get(
+                    VEO_STATUS,
+                    params={"taskId": task_id},
+                    headers=_veo_headers(),
+                    timeout=30,
+                ) as resp:
+
+                    try:
+                        result = await resp.json(content_type=None)
+                    except Exception:
+                        result = {"raw": await resp.text()}
+                    elapsed = time.perf_counter() - started
+                    KIE_REQUEST_SECONDS.labels("poll", model).observe(elapsed)
+                    stats.record("kie_seconds", f"poll:{model}", total=elapsed)
+                    tracer.record(
+                        "kie.poll",
+                        poll_start,
+                        time.time(),
+                        http=resp.status,
+                        flag=(result.get("data") or {}).get("successFlag"),
+                    )
+                    entry.polled(
+                        f"flag {(result.get('data') or {}).get('successFlag')}"
+                        if resp.status == 200
+                        else f"http {resp.status}"
+                    )
+
+                    if resp.status != 200 or result.get("code") != 200:
+                        KIE_REQUESTS.labels("poll", model, "http_error").inc()
+                        await entry.wait(8)
+                        continue
+                    KIE_REQUESTS.labels("poll", model, "ok").inc()
+
+                    data = result.get("data") or {}
+                    flag = data.get("successFlag")
+                    response = data.get("response")
+
+                    # --- генерируется ---
+                    if flag == 0:
+                        await entry.wait(8)
+                        continue
+
+                    # --- завершено ---
+                    if flag == 1:
+                        if not await entry.acquire():
+                            return
+                        video_url = None
 
+                        if isinstance(response, dict):
+                            # основной рабочий путь
+                            urls = response.get("resultUrls")
+                            if isinstance(urls, list) and len(urls) > 0:
+                                video_url = urls[0]
+
+                            # запасной путь (если будет videoUrl)
                             if not video_url:
-                                await safe_send_message(
-                                    bot,
-                                    uid,
-                                    "⚠️ Veo 3.1 завершилось, но ссылка не найдена.\n"
-                                    f"<code>{json.dumps(result, ensure_ascii=False)[:3000]}</code>"
+                                video_url = (
+                                    response.get("videoUrl")
+                                    or response.get("video_url")
                                 )
-                                return
 
-                            # УСПЕШНО
-                            await safe_send_message(bot, uid, "🎉 Ваше видео Veo 3.1 готово!")
-                            await safe_send_video(
-                                bot,
-                                uid,
-                                video_url,
-                                caption="🎬 Готовый ролик (Veo 3.1)"
-                            )
+                        if not video_url:
                             await safe_send_message(
                                 bot,
                                 uid,
-                                "🏠 Главное меню:",
-                                reply_markup=main_menu_keyboard(),
+                                "⚠️ Veo 3.1 завершилось, но ссылка не найдена.\n"
+                                f"<code>{json.dumps(result, ensure_ascii=False)[:3000]}</code>"
                             )
+                            GENERATIONS.labels("veo", "no_url").inc()
+                            stats.record("generations", "veo:no_url")
                             return
 
-                        # --- ошибка ---
-                        fail_msg = (
-                            data.get("errorMessage")
-                            or result.get("msg")
-                            or "Неизвестная ошибка Veo"
-                        )
-
-                        await db.add_generations(uid, cost)
-                        await safe_send_message(
+                        # УСПЕШНО
+                        await deliver_video(
                             bot,
                             uid,
-                            f"❌ Ошибка Veo 3.1: {fail_msg}. Токены возвращены."
+                            video_url,
+                            "🎉 Ваше видео Veo 3.1 готово!",
+                            details=["🎬 Готовый ролик (Veo 3.1)"],
                         )
+                        GENERATIONS.labels("veo", "success").inc()
+                        stats.record("generations", "veo:success")
+                        await learn(prompt, rejected=False)
+                        return
+
+                    # --- ошибка ---
+                    fail_msg = (
+                        data.get("errorMessage")
+                        or result.get("msg")
+                        or "Неизвестная ошибка Veo"
+                    )
+
+                    if not await entry.acquire():
                         return
+                    await db.add_generations(uid, cost)
+                    GENERATIONS.labels("veo", "failed").inc()
+                    stats.record("generations", "veo:failed")
+                    REFUNDS.labels("veo").inc()
+                    stats.record("refunds", "veo")
+                    await safe_send_message(
+                        bot,
+                        uid,
+                        f"❌ Ошибка Veo 3.1: {fail_msg}. Токены возвращены."
+                    )
+                    await learn(prompt, rejected=is_policy_failure(fail_msg))
+                    return
 
-                except Exception as e:
-                    print("Polling error:", e)
-                    await asyncio.sleep(8)
+            except Exception as e:
+                KIE_REQUESTS.labels("poll", model, "error").inc()
+                tracer.record("kie.poll", poll_start, time.time(), error=repr(e))
+                logger.warning("Veo poll error for task %s: %r", task_id, e)
+                entry.polled(f"error {type(e).__name__}")
+                await entry.wait(8)
 
         # --- Таймаут ---
+        if not await entry.acquire():
+            return
         await db.add_generations(uid, cost)
+        GENERATIONS.labels("veo", "timeout").inc()
+        stats.record("generations", "veo:timeout")
+        REFUNDS.labels("veo").inc()
+        stats.record("refunds", "veo")
         await safe_send_message(
             bot, uid, "⏳ Время ожидания Veo истекло. Токены возвращены."
         )
 
     except Exception as e:
+        if not await entry.acquire():
+            return
         await db.add_generations(uid, cost)
+        GENERATIONS.labels("veo", "error").inc()
+        stats.record("generations", "veo:error")
+        REFUNDS.labels("veo").inc()
+        stats.record("refunds", "veo")
         await safe_send_message(
             bot,
             uid,
             f"❌ Критическая ошибка Veo: {e}. Токены возвращены."
         )
+    finally:
+        GENERATIONS_IN_FLIGHT.labels("veo").dec()
+        inflight.remove(entry)
+
+
+def spawn_veo_poll(bot, reservation: Optional[Reservation] = None, **params) -> None:
+    """Опрос статуса под supervisor (см. spawn_sora_poll)."""
+    task_id = params["task_id"]
+    supervisor.spawn(
+        check_veo_status(bot, **params),
+        name=f"kie-poll-veo:{task_id}",
+        kind="kie-poll-veo",
+        checkpoint=lambda: None if inflight.finishing(task_id) else params,
+        reservation=reservation,
+    )
+
+
+supervisor.resumable("kie-poll-veo", lambda bot, params: spawn_veo_poll(bot, **params))
 
 
 # ОСНОВНАЯ ЛОГИКА FSM
@@ -212,29 +288,7 @@ async def back_to_engine_cb(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await safe_edit_text(
         callback.message,
-        """
-Sora 2
-
-Продвинутая модель от OpenAI, которая делает очень реалистичные и плавные видео. Отлично подходит для красивых, кинематографичных роликов.
-
-Veo 3.1
-
-Современная модель от Google, которая быстро создаёт чёткие видео по тексту или фото. Идеальна для коротких и динамичных роликов.
-
-Цены:
-
-Sora 2:
-        - Standart 10s = 30 
-        - Standart 15s = 35
-Sora 2 Pro:
-        - Standart 10s = 90 
-        - Standart 15s = 135
-        - HD 10s = 200
-        - HS 15s = 400
-Veo 3.1:
-        - Fast = 60
-        - Quality = 250
-        """,
+        catalog().engine_select_text,
         reply_markup=engine_select_keyboard(),
     )
 
@@ -341,9 +395,7 @@ async def veo_choose_orientation(callback: CallbackQuery, state: FSMContext):
                 f"Формат: {aspect}\n\n"
                 "Введите описание — и модель сама создаст видео по вашему тексту."
             ),
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[back_btn("back_to_veo_mode")]],
-            ),
+            reply_markup=back_keyboard("back_to_veo_mode"),
         )
         return
 
@@ -363,9 +415,7 @@ async def veo_choose_orientation(callback: CallbackQuery, state: FSMContext):
 
 два фото → первое фото используется как стартовый кадр который лаконично переходит во второе фото
             """,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[back_btn("back_to_veo_mode")]],
-            ),
+            reply_markup=back_keyboard("back_to_veo_mode"),
         )
         return
 
@@ -385,9 +435,7 @@ async def veo_choose_orientation(callback: CallbackQuery, state: FSMContext):
 
 Как пример вы можете загрузить свое фото, фото одежды и фото локации, модель сгенерирует ваше фото в приложенной одежде на данной локации.
             """,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[back_btn("back_to_engine")]],
-            ),
+            reply_markup=back_keyboard("back_to_engine"),
         )
         return
 
@@ -429,14 +477,19 @@ async def veo_prompt_after_images(message: Message, state: FSMContext):
         return
 
     prompt = message.text
+    verdict = check_prompt("veo", prompt)
+    if verdict.action == REJECT:
+        await safe_answer(message, reject_text(verdict))
+        return
     cost = _cost_for_model(model)
 
     await state.update_data(veo_prompt=prompt, veo_cost=cost)
     await state.set_state(VeoStates.waiting_for_confirmation)
 
+    warning = f"{warn_text(verdict)}\n\n" if verdict.action == WARN else ""
     await safe_answer(
         message,
-        f"📋 Veo 3.1\nМодель: {_human_model_name(model)}\n"
+        f"{warning}📋 Veo 3.1\nМодель: {_human_model_name(model)}\n"
         f"Фото: {len(images)}\n💳 Стоимость: {cost}\n\n📝 {prompt}",
         reply_markup=get_veo_confirmation_keyboard(),
     )
@@ -448,14 +501,19 @@ async def veo_prompt_t2v(message: Message, state: FSMContext):
     data = await state.get_data()
     model = data.get("veo_model")
     prompt = message.text
+    verdict = check_prompt("veo", prompt)
+    if verdict.action == REJECT:
+        await safe_answer(message, reject_text(verdict))
+        return
 
     cost = _cost_for_model(model)
     await state.update_data(veo_prompt=prompt, veo_cost=cost)
     await state.set_state(VeoStates.waiting_for_confirmation)
 
+    warning = f"{warn_text(verdict)}\n\n" if verdict.action == WARN else ""
     await safe_answer(
         message,
-        f"📋 Veo 3.1\nМодель: {_human_model_name(model)}\n"
+        f"{warning}📋 Veo 3.1\nМодель: {_human_model_name(model)}\n"
         f"💳 Стоимость: {cost}\n\n📝 {prompt}",
         reply_markup=get_veo_confirmation_keyboard(),
     )
@@ -467,6 +525,7 @@ async def change_veo(callback: CallbackQuery, state: FSMContext):
     await back_to_veo_mode(callback, state)
 
 
+@traced("confirm_veo")
 async def confirm_veo(callback: CallbackQuery, state: FSMContext):
     bot = callback.message.bot
     uid = callback.from_user.id
@@ -475,49 +534,70 @@ async def confirm_veo(callback: CallbackQuery, state: FSMContext):
     cost = data.get("veo_cost")
     model = data.get("veo_model")
     mode = data.get("veo_mode")
-    images = data.get("veo_images") or []
-    prompt = data.get("veo_prompt")
-    aspect_ratio = data.get("veo_aspect") or "16:9"
+    annotate(engine="veo", uid=uid, cost=cost, model=model, mode=mode)
 
-    # Проверка баланса
-    user = await db.get_user(uid)
-    if not user or user["generations_left"] < cost:
+    # место под опрос занимаем до списания токенов: после createTask
+    # лимит уже не помешает опросить оплаченную задачу
+    try:
+        slot = supervisor.reserve("kie-poll-veo")
+    except SupervisorFull:
         await safe_edit_text(
             callback.message,
-            f"❌ Недостаточно токенов. Нужно {cost}, у вас {user['generations_left']}.",
+            "⏳ Сейчас в работе слишком много генераций. Попробуйте через пару минут.",
         )
         await state.clear()
         return
 
-    # Списываем
-    await db.update_user_generations(uid, user["generations_left"] - cost)
-
-    await safe_edit_text(
-        callback.message,
-        f"🎬 Veo 3.1: видео создаётся…\n💳 Списано {cost} токенов.",
-    )
+    images = data.get("veo_images") or []
+    prompt = data.get("veo_prompt")
+    aspect_ratio = data.get("veo_aspect") or "16:9"
 
     try:
-        await send_to_veo_api(
-            bot=bot,
-            uid=uid,
-            mode=mode,
-            model=model,
-            images=images,
-            prompt=prompt,
-            cost=cost,
-            aspect_ratio=aspect_ratio,
+        # Проверка баланса
+        user = await db.get_user(uid)
+        if not user or user["generations_left"] < cost:
+            await safe_edit_text(
+                callback.message,
+                f"❌ Недостаточно токенов. Нужно {cost}, у вас {user['generations_left']}.",
+            )
+            return
+
+        # Списываем
+        await db.update_user_generations(uid, user["generations_left"] - cost)
+        stats.record("generations", "veo:started")
+
+        await safe_edit_text(
+            callback.message,
+            f"🎬 Veo 3.1: видео создаётся…\n💳 Списано {cost} токенов.",
         )
-    except Exception as e:
-        logger.exception(f"confirm_veo error: {e}")
-        await db.add_generations(uid, cost)
-        await safe_send_message(bot, uid, "❌ Ошибка Veo. Токены возвращены.")
+
+        try:
+            await send_to_veo_api(
+                bot=bot,
+                uid=uid,
+                mode=mode,
+                model=model,
+                images=images,
+                prompt=prompt,
+                cost=cost,
+                aspect_ratio=aspect_ratio,
+                reservation=slot,
+            )
+        except Exception as e:
+            logger.exception("confirm_veo error: %s", e)
+            await db.add_generations(uid, cost)
+            REFUNDS.labels("veo").inc()
+            stats.record("refunds", "veo")
+            await safe_send_message(bot, uid, "❌ Ошибка Veo. Токены возвращены.")
     finally:
+        # место не понадобилось (нет токенов, createTask не удался) — отдаём
+        slot.release()
         await state.clear()
 
 
 # ОТПРАВКА ЗАДАЧИ В VEO
 
+@traced("kie.create_task")
 async def send_to_veo_api(
     bot,
     uid: int,
@@ -527,6 +607,7 @@ async def send_to_veo_api(
     prompt: str,
     cost: int,
     aspect_ratio: str,
+    reservation: Optional[Reservation] = None,
 ) -> None:
     generation_type = _generation_type_for_mode(mode)
 
@@ -536,6 +617,8 @@ async def send_to_veo_api(
 
     if mode in ("i2v", "ref") and not images:
         await db.add_generations(uid, cost)
+        REFUNDS.labels("veo").inc()
+        stats.record("refunds", "veo")
         await safe_send_message(bot, uid, "❌ Фото не переданы. Токены возвращены.")
         return
 
@@ -552,32 +635,44 @@ async def send_to_veo_api(
         payload["imageUrls"] = images
 
     # запрос
+    started = time.perf_counter()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                VEO_URL,
-                json=payload,
-                headers=_veo_headers(),
-                timeout=300,
-            ) as resp:
-
-                try:
-                    data = await resp.json(content_type=None)
-                except Exception:
-                    data = {"raw": await resp.text()}
-
-                if resp.status != 200:
-                    await db.add_generations(uid, cost)
-                    await safe_send_message(
-                        bot,
-                        uid,
-                        f"❌ Veo HTTP {resp.status}. Токены возвращены.\n<code>{data}</code>",
-                    )
-                    return
+        session = get_session()
+        async with session.post(
+            VEO_URL,
+            json=payload,
+            headers=_veo_headers(),
+            timeout=300,
+        ) as resp:
+
+            try:
+                data = await resp.json(content_type=None)
+            except Exception:
+                data = {"raw": await resp.text()}
+            elapsed = time.perf_counter() - started
+            KIE_REQUEST_SECONDS.labels("submit", model).observe(elapsed)
+            stats.record("kie_seconds", f"submit:{model}", total=elapsed)
+
+            if resp.status != 200:
+                KIE_REQUESTS.labels("submit", model, "http_error").inc()
+                await db.add_generations(uid, cost)
+                if is_policy_failure(str(data)):
+                    await learn(prompt, rejected=True)
+                REFUNDS.labels("veo").inc()
+                stats.record("refunds", "veo")
+                await safe_send_message(
+                    bot,
+                    uid,
+                    f"❌ Veo HTTP {resp.status}. Токены возвращены.\n<code>{data}</code>",
+                )
+                return
 
     except Exception as e:
-        logger.exception(f"send_to_veo_api network error: {e}")
+        logger.exception("send_to_veo_api network error: %s", e)
+        KIE_REQUESTS.labels("submit", model, "error").inc()
         await db.add_generations(uid, cost)
+        REFUNDS.labels("veo").inc()
+        stats.record("refunds", "veo")
         await safe_send_message(
             bot,
             uid,
@@ -594,14 +689,19 @@ async def send_to_veo_api(
     if isinstance(root, dict):
         task_id = root.get("taskId") or root.get("task_id")
 
+    KIE_REQUESTS.labels("submit", model, "ok").inc()
+
     if task_id:
+        tracer.bind_task(task_id)
         await safe_send_message(
             bot,
             uid,
             "✅ Задача Veo 3.1 принята.\n"
             "Я пришлю ролик, как только он будет готов.",
         )
-        asyncio.create_task(check_veo_status(bot, uid, task_id, cost))
+        spawn_veo_poll(
+            bot, reservation=reservation, uid=uid, task_id=task_id, cost=cost, model=model, prompt=prompt
+        )
         return
 
     # Пробуем прямой videoUrl
@@ -621,19 +721,16 @@ async def send_to_veo_api(
                 video_url = urls[0]
 
     if video_url:
-        await safe_send_message(bot, uid, "🎉 Ваше видео Veo 3.1 готово!")
-        await safe_send_video(
+        await deliver_video(
             bot,
             uid,
             video_url,
-            caption="🎬 Готовый ролик (Veo 3.1)"
-        )
-        await safe_send_message(
-            bot,
-            uid,
-            "🏠 Главное меню:",
-            reply_markup=main_menu_keyboard(),
+            "🎉 Ваше видео Veo 3.1 готово!",
+            details=["🎬 Готовый ролик (Veo 3.1)"],
         )
+        GENERATIONS.labels("veo", "success").inc()
+        stats.record("generations", "veo:success")
+        await learn(prompt, rejected=False)
         return
 
     # Ничего не нашли
@@ -648,26 +745,28 @@ async def send_to_veo_api(
 # РЕГИСТРАЦИЯ
 
 def register_veo_handlers(dp: Dispatcher) -> None:
-    dp.callback_query.register(engine_veo_cb, F.data == "engine_veo")
-    dp.callback_query.register(back_to_engine_cb, F.data == "back_to_engine")
+    callbacks = get_callback_router(dp)
+
+    callbacks.exact("engine_veo", engine_veo_cb)
+    callbacks.exact("back_to_engine", back_to_engine_cb)
 
-    dp.callback_query.register(
+    callbacks.exact(
+        {"veo_mode_t2v", "veo_mode_i2v", "veo_mode_ref"},
         veo_choose_mode,
         VeoStates.choosing_mode,
-        F.data.in_({"veo_mode_t2v", "veo_mode_i2v", "veo_mode_ref"}),
     )
-    dp.callback_query.register(back_to_veo_mode, F.data == "back_to_veo_mode")
+    callbacks.exact("back_to_veo_mode", back_to_veo_mode)
 
-    dp.callback_query.register(
+    callbacks.exact(
+        {"veo_q_fast", "veo_q_quality"},
         veo_choose_quality,
         VeoStates.choosing_quality,
-        F.data.in_({"veo_q_fast", "veo_q_quality"}),
     )
 
-    dp.callback_query.register(
+    callbacks.exact(
+        {"veo_ar_169", "veo_ar_916"},
         veo_choose_orientation,
         VeoStates.choosing_orientation,
-        F.data.in_({"veo_ar_169", "veo_ar_916"}),
     )
 
     dp.message.register(veo_collect_image, VeoStates.collecting_images, F.photo)
@@ -675,5 +774,5 @@ def register_veo_handlers(dp: Dispatcher) -> None:
 
     dp.message.register(veo_prompt_t2v, VeoStates.waiting_for_prompt)
 
-    dp.callback_query.register(change_veo, F.data == "change_veo")
-    dp.callback_query.register(confirm_veo, F.data == "confirm_veo")
+    callbacks.exact("change_veo", change_veo)
+    callbacks.exact("confirm_veo", confirm_veo)
@@ -0,0 +1,120 @@
+# web_server.py
+import hmac
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+from config import (
+    ADMIN_API_PATH,
+    ADMIN_API_TOKEN,
+    METRICS_PATH,
+    RUB_RECONCILE_INTERVAL,
+    RUB_RECONCILE_MIN_AGE,
+    WEB_SERVER_HOST,
+    WEB_SERVER_PORT,
+    YOOKASSA_WEBHOOK_PATH,
+)
+from inflight import FAILED, NOT_FOUND, force_recheck, force_refund, inflight
+from metrics import render as render_metrics
+from payments import handle_yookassa_notification
+from yookassa_client import yookassa
+
+logger = logging.getLogger(__name__)
+
+
+#  ХЕНДЛЕРЫ
+
+async def yookassa_webhook(request: web.Request) -> web.Response:
+    """
+    POST от YooKassa. Отвечаем 200 только после обработки:
+    при ошибке YooKassa повторит уведомление сама.
+    """
+    try:
+        event = await request.json()
+    except Exception:
+        return web.Response(status=400, text="bad json")
+    if not isinstance(event, dict):
+        return web.Response(status=400, text="bad json")
+
+    try:
+        await handle_yookassa_notification(request.app["bot"], event)
+    except Exception:
+        logger.exception("yookassa_webhook: failed to handle %r", event.get("event"))
+        return web.Response(status=500)
+    return web.Response(text="ok")
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """GET /metrics — текстовый формат Prometheus."""
+    return web.Response(
+        body=render_metrics().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+#  СЛУЖЕБНОЕ API
+
+@web.middleware
+async def admin_auth(request: web.Request, handler):
+    if request.path.startswith(ADMIN_API_PATH + "/"):
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_API_TOKEN}".encode()):
+            return web.json_response({"error": "unauthorized"}, status=401)
+    return await handler(request)
+
+
+async def tasks_handler(request: web.Request) -> web.Response:
+    """GET {ADMIN_API_PATH}/tasks — генерации в работе (то же, что /tasks в боте)."""
+    return web.json_response({"count": len(inflight), "tasks": inflight.snapshot()})
+
+
+async def task_action_handler(request: web.Request) -> web.Response:
+    """POST {ADMIN_API_PATH}/tasks/{task_id}/refund|recheck"""
+    task_id = request.match_info["task_id"]
+    if request.match_info["action"] == "refund":
+        result = await force_refund(request.app["bot"], task_id)
+    else:
+        result = force_recheck(task_id)
+    status = 404 if result == NOT_FOUND else 500 if result == FAILED else 200
+    return web.json_response({"task_id": task_id, "result": result}, status=status)
+
+
+#  СБОРКА И ЗАПУСК
+
+def create_app(bot: Bot) -> web.Application:
+    app = web.Application(middlewares=[admin_auth] if ADMIN_API_TOKEN else [])
+    app["bot"] = bot
+    app.router.add_post(YOOKASSA_WEBHOOK_PATH, yookassa_webhook)
+    if METRICS_PATH:
+        app.router.add_get(METRICS_PATH, metrics_handler)
+    if ADMIN_API_TOKEN:
+        app.router.add_get(f"{ADMIN_API_PATH}/tasks", tasks_handler)
+        app.router.add_post(
+            ADMIN_API_PATH + "/tasks/{task_id}/{action:refund|recheck}", task_action_handler
+        )
+    return app
+
+
+async def start_web_server(bot: Bot) -> Optional[web.AppRunner]:
+    """
+    Запускает HTTP-сервер, если задан WEB_SERVER_PORT.
+    Возвращает runner (для остановки) или None.
+    """
+    if not WEB_SERVER_PORT:
+        logger.info("Web server disabled (WEB_SERVER_PORT=0)")
+        if yookassa.configured:
+            logger.warning(
+                "YooKassa is configured but the webhook server is off (WEB_SERVER_PORT=0): "
+                "RUB payments are credited only by the reconciler, every %ss after %ss",
+                RUB_RECONCILE_INTERVAL, RUB_RECONCILE_MIN_AGE,
+            )
+        return None
+
+    runner = web.AppRunner(create_app(bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT)
+    await site.start()
+    logger.info(f"Web server listening on {WEB_SERVER_HOST}:{WEB_SERVER_PORT}")
+    return runner
@@ -0,0 +1,138 @@
+# yookassa_client.py
+import asyncio
+import logging
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, YOOKASSA_API_URL
+from http_client import get_session
+
+logger = logging.getLogger(__name__)
+
+
+class YooKassaError(Exception):
+    """
+    Ошибка API YooKassa: HTTP-статус + тело ответа.
+    """
+
+    def __init__(self, status: int, body: Any):
+        super().__init__(f"YooKassa HTTP {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+class YooKassaClient:
+    """
+    Асинхронный клиент YooKassa API v3 поверх общей aiohttp-сессии.
+    Заменяет синхронный SDK (Payment.create / Payment.find_one через to_thread).
+
+    POST-запросы идут с заголовком Idempotence-Key; при сетевой ошибке или 5xx
+    повторяются с тем же ключом — YooKassa не создаст платёж дважды.
+    """
+
+    RETRIES = 3
+
+    def __init__(
+        self,
+        shop_id: Optional[str] = YOOKASSA_SHOP_ID,
+        secret_key: Optional[str] = YOOKASSA_SECRET_KEY,
+        base_url: str = YOOKASSA_API_URL,
+    ):
+        self.shop_id = shop_id
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip("/")
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.shop_id and self.secret_key)
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        idempotence_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        headers = {}
+        if idempotence_key:
+            headers["Idempotence-Key"] = idempotence_key
+
+        auth = aiohttp.BasicAuth(self.shop_id or "", self.secret_key or "")
+        url = f"{self.base_url}{path}"
+
+        for attempt in range(self.RETRIES):
+            try:
+                async with get_session().request(
+                    method,
+                    url,
+                    json=json,
+                    params=params,
+                    headers=headers,
+                    auth=auth,
+                    timeout=aiohttp.ClientTimeout(total=30),
+                ) as resp:
+                    try:
+                        body = await resp.json(content_type=None)
+                    except Exception:
+                        body = {"raw": await resp.text()}
+
+                    if resp.status < 400:
+                        return body
+                    if resp.status < 500 and resp.status != 429:
+                        raise YooKassaError(resp.status, body)
+                    error: Exception = YooKassaError(resp.status, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt + 1 < self.RETRIES:
+                logger.warning("YooKassa %s %s: %r, retry #%d", method, path, error, attempt + 1)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+        raise error
+
+    async def create_payment(
+        self,
+        payload: Dict[str, Any],
+        idempotence_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        POST /payments. Без ключа идемпотентности генерируется новый.
+        """
+        return await self._request(
+            "POST",
+            "/payments",
+            json=payload,
+            idempotence_key=idempotence_key or str(uuid.uuid4()),
+        )
+
+    async def get_payment(self, payment_id: str) -> Dict[str, Any]:
+        """GET /payments/{id}"""
+        return await self._request("GET", f"/payments/{payment_id}")
+
+    async def list_payments(self, **filters: Any) -> Dict[str, Any]:
+        """
+        GET /payments — одна страница списка.
+        filters — параметры API как есть: limit, cursor, status, "created_at.gte" и т.п.
+        """
+        return await self._request("GET", "/payments", params=filters)
+
+    async def iter_payments(self, limit: int = 100, **filters: Any) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Все платежи по фильтру, страница за страницей (по next_cursor).
+        """
+        params = {**filters, "limit": limit}
+        while True:
+            page = await self.list_payments(**params)
+            for item in page.get("items") or []:
+                yield item
+            cursor = page.get("next_cursor")
+            if not cursor:
+                return
+            params["cursor"] = cursor
+
+
+# Глобальный клиент YooKassa
+yookassa = YooKassaClient()